@@ -13,6 +13,7 @@ def get_admin_main_menu() -> InlineKeyboardMarkup:
     builder.row(InlineKeyboardButton(text="🤸 Управление позами", callback_data="admin_poses"))
     builder.row(InlineKeyboardButton(text="🌆 Управление сценами", callback_data="admin_scenes"))
     builder.row(InlineKeyboardButton(text="📊 Статистика", callback_data="admin_stats"))
+    builder.row(InlineKeyboardButton(text="🩺 Состояние KIE", callback_data="admin_kie_health"))
     builder.row(InlineKeyboardButton(text="💳 Пакеты пополнения", callback_data="admin_packages"))
     builder.row(InlineKeyboardButton(text="🏠 Главное меню", callback_data="back_to_main"))
     return builder.as_markup()
@@ -362,6 +363,16 @@ def get_confirm_delete_keyboard(item_type: str, item_id: str) -> InlineKeyboardM
     return builder.as_markup()
 
 
+def get_kie_health_keyboard(show_reset: bool) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_kie_health"))
+    builder.row(InlineKeyboardButton(text="♻️ Перечитать models.json", callback_data="admin_kie_models_reload"))
+    if show_reset:
+        builder.row(InlineKeyboardButton(text="✅ Закрыть предохранитель", callback_data="admin_kie_breaker_reset"))
+    builder.row(InlineKeyboardButton(text="◀️ Назад", callback_data="admin_back"))
+    return builder.as_markup()
+
+
 def get_admin_back_keyboard(back_to: str = "admin_back") -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="◀️ Назад", callback_data=back_to))
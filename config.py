@@ -11,7 +11,122 @@ class Settings(BaseSettings):
     DATABASE_URL: str
     
     KIE_API_KEY: str
+    # Bir nechta kalit vergul bilan: "key1,key2"; bo'sh bo'lsa faqat KIE_API_KEY ishlatiladi
+    KIE_API_KEYS: str = ""
+    # Har bir kalit uchun: createTask tezligi (so'rov/soniya), burst va bir vaqtdagi tasklar soni
+    KIE_KEY_RATE: float = 2
+    KIE_KEY_BURST: int = 20
+    KIE_KEY_MAX_IN_FLIGHT: int = 100
+    # Auth/kvota xatosi qaytargan kalit shuncha soniya ishlatilmaydi
+    KIE_KEY_QUARANTINE_SECONDS: float = 300
     KIE_API_URL: str = "https://api.kie.ai/v1"
+    KIE_HTTP_TIMEOUT: int = 60
+    KIE_CONNECT_TIMEOUT: int = 10
+    KIE_DOWNLOAD_TIMEOUT: int = 300
+    KIE_POOL_LIMIT: int = 100
+    KIE_POOL_LIMIT_PER_HOST: int = 50
+    KIE_KEEPALIVE_TIMEOUT: int = 60
+    KIE_POLL_CONCURRENCY: int = 20
+    # Task uchun umumiy muddat (yaratish + kutish), soniya
+    KIE_POLL_TIMEOUT: int = 1200
+    # Tarmoq/server xatolarida eksponensial backoff (jitter bilan), 429 da kamida shuncha kutiladi
+    KIE_RETRY_BASE_DELAY: float = 1
+    KIE_RETRY_MAX_DELAY: float = 30
+    KIE_RATE_LIMIT_DELAY: float = 10
+    # Circuit breaker: oxirgi WINDOW soniyada kamida MIN_CALLS chaqiruvdan FAILURE_RATE ulushi xato
+    # (yoki SLOW_RATE ulushi SLOW_CALL soniyadan sekin) bo'lsa, OPEN_SECONDS davomida yangi generatsiyalar rad etiladi
+    KIE_BREAKER_ENABLED: bool = True
+    KIE_BREAKER_WINDOW: float = 60
+    KIE_BREAKER_MIN_CALLS: int = 10
+    KIE_BREAKER_FAILURE_RATE: float = 0.5
+    KIE_BREAKER_SLOW_CALL: float = 15
+    KIE_BREAKER_SLOW_RATE: float = 0.8
+    KIE_BREAKER_OPEN_SECONDS: float = 30
+    KIE_BREAKER_HALF_OPEN_PROBES: int = 2
+    # Bot faqat dispetcher bo'lsa (JOB_WORKERS_IN_BOT=false) u KIE'ni o'zi chaqirmaydi — breaker o'rniga
+    # workerlar yakunlagan tasklar tekshiriladi: SHARED_WINDOW soniyada kamida SHARED_MIN_TASKS tadan
+    # FAILURE_RATE ulushi KIE nosozligi sabab FAILED bo'lsa yangi generatsiyalar rad etiladi
+    KIE_BREAKER_SHARED_WINDOW: float = 300
+    KIE_BREAKER_SHARED_MIN_TASKS: int = 5
+    KIE_LATENCY_WINDOW: int = 200
+
+    # Bo'sh bo'lmasa KIE natijani shu URL'ga POST qiladi (webhook rejimi); callback faqat signal —
+    # natija baribir recordInfo'dan olinadi. URL'ga ?token=<KIE_WEBHOOK_SECRET> qo'shish tavsiya etiladi
+    KIE_CALLBACK_URL: str = ""
+    KIE_WEBHOOK_HOST: str = "0.0.0.0"
+    KIE_WEBHOOK_PORT: int = 8081
+    KIE_WEBHOOK_PATH: str = "/kie/callback"
+    KIE_WEBHOOK_SECRET: str = ""
+    KIE_WEBHOOK_SAFETY_POLL_INTERVAL: float = 60
+
+    # Bir vaqtda ishlayotgan KIE tasklari: butun jarayon bo'yicha va bitta foydalanuvchi uchun.
+    # Limitlar har bir jarayonda alohida: N ta worker.py bilan umumiy chegara N barobar bo'ladi
+    KIE_GLOBAL_CONCURRENCY: int = 40
+    KIE_PER_USER_CONCURRENCY: int = 8
+    PRODUCT_CARD_CONCURRENCY: int = 8
+    PRODUCT_CARD_GLOBAL_CONCURRENCY: int = 32
+    # True: har bir rasm tayyor bo'lishi bilan yuboriladi; False: hammasi tugagach, katalog tartibida
+    PRODUCT_CARD_STREAMING: bool = True
+    # Natijalar sendMediaGroup albomlari bilan yuboriladi (Telegram limiti — 10 ta)
+    DELIVERY_ALBUM_SIZE: int = 10
+    DELIVERY_MAX_RETRIES: int = 3
+    # Status xabaridagi progress (tayyor/jami, ETA): chat bo'yicha editlar orasidagi minimal vaqt
+    # va yangi natija bo'lmasa ham ETA yangilanadigan oraliq
+    PROGRESS_EDIT_INTERVAL: float = 3
+    PROGRESS_REFRESH_INTERVAL: float = 15
+
+    # Bir xil rasm + prompt + model uchun tayyor natija diskdan qaytariladi
+    RESULT_CACHE_ENABLED: bool = True
+    RESULT_CACHE_DIR: str = "cache/results"
+    RESULT_CACHE_MAX_MB: int = 2048
+    # Yetkazilgan natijalar (ZIP yuklab olish uchun) diskda saqlanadi, FSM'da faqat havola;
+    # RETENTION_HOURS'dan eski fayllar shuncha soniyada bir tozalanadi
+    BLOB_STORE_DIR: str = "cache/blobs"
+    BLOB_CLEANUP_INTERVAL: float = 3600
+    # ZIP eksport: qism hajmi (Telegram bot API yuklash limiti 50 MB) va xotiradagi spool chegarasi
+    ZIP_PART_MAX_MB: int = 45
+    ZIP_SPOOL_MAX_MB: int = 8
+    # Product card ZIP'iga har bir natijadan lokal yasaladigan qo'shimcha formatlar ("3:4,9:16"; bo'sh — o'chirilgan)
+    ZIP_VARIANTS: str = "3:4,9:16"
+    # crop — markazdan kesish, pad — oq fon, extend — chetlar rangidagi fon bilan to'ldirish
+    ZIP_VARIANT_MODE: str = "extend"
+    # Natijalarni yetkazishdan oldin qayta kodlash (alohida jarayonlarda): "jpeg" ("jpg"), "webp", "png" yoki "original".
+    # PHOTO — chatdagi rasm xabarlari (sendPhoto uchun jpeg), ZIP — yuklab olinadigan arxiv
+    POSTPROCESS_PHOTO_FORMAT: str = "jpeg"
+    POSTPROCESS_PHOTO_QUALITY: int = 90
+    POSTPROCESS_ZIP_FORMAT: str = "jpeg"
+    POSTPROCESS_ZIP_QUALITY: int = 95
+    POSTPROCESS_WORKERS: int = 2
+    # Normalize ghost bosqichi natijasi (KIE URL) shuncha soniya qayta ishlatiladi
+    KIE_GHOST_MEMO_TTL: int = 3600
+
+    # configs/models.json o'zgarganini shuncha soniyada bir tekshiradi
+    MODEL_REGISTRY_CHECK_INTERVAL: float = 10
+
+    # Kirish rasmi bir marta KIE file-upload'ga yuklanadi; o'chirilsa Telegram fayl URL'i beriladi
+    KIE_UPLOAD_ENABLED: bool = True
+    KIE_UPLOAD_PATH: str = "bot-inputs"
+    # KIE yuklangan fayllarni bir necha kun saqlaydi — URL shu muddatdan kamroq qayta ishlatiladi
+    KIE_UPLOAD_REUSE_TTL: int = 86400
+    # Kirish rasmi yuklashdan oldin tayyorlanadi: EXIF orientatsiya, uzun tomoni INPUT_MAX_SIDE gacha, JPEG.
+    # Ochib bo'lmaydigan fayl kredit yechilishidan oldin rad etiladi
+    INPUT_PREPROCESS_ENABLED: bool = True
+    INPUT_MAX_SIDE: int = 2048
+    INPUT_JPEG_QUALITY: int = 92
+
+    # Generatsiyalar 'tasks' jadvalidagi navbat orqali bajariladi
+    JOB_WORKERS: int = 16
+    JOB_POLL_INTERVAL: float = 5
+    # Restart'lar sababli shuncha marta uzilgan task kredit qaytarilib yopiladi
+    JOB_MAX_ATTEMPTS: int = 3
+    # False — bot faqat dispetcher: tasklarni alohida `python worker.py` jarayonlari bajaradi
+    JOB_WORKERS_IN_BOT: bool = True
+    # Worker o'z tasklarining heartbeat'ini yangilab turadi; JOB_STALE_AFTER soniya
+    # yangilanmagan PROCESSING task o'lgan worker'niki hisoblanib qayta navbatga qo'yiladi
+    JOB_HEARTBEAT_INTERVAL: float = 15
+    JOB_STALE_AFTER: float = 90
+    # Boshqa jarayonda bosilgan "Отменить" tugmasi (cancel_requested) shu oraliqda tekshiriladi
+    JOB_CANCEL_CHECK_INTERVAL: float = 3
     
     YOOKASSA_SHOP_ID: str
     YOOKASSA_SECRET_KEY: str
@@ -14,6 +14,7 @@ class TaskStatus(enum.Enum):
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
 
 
 class TaskType(enum.Enum):
@@ -49,13 +50,23 @@ class Task(Base):
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(BigInteger, index=True)
+    chat_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
     task_type: Mapped[TaskType] = mapped_column(SQLEnum(TaskType))
-    status: Mapped[TaskStatus] = mapped_column(SQLEnum(TaskStatus), default=TaskStatus.PENDING)
+    status: Mapped[TaskStatus] = mapped_column(SQLEnum(TaskStatus), default=TaskStatus.PENDING, index=True)
     cost: Mapped[int] = mapped_column(Integer)
+    refunded: Mapped[int] = mapped_column(Integer, default=0)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
     input_data: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     result_data: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     error_message: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    worker_id: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    # Foydalanuvchi bekor qildi — taskni bajarayotgan worker uni to'xtatadi
+    cancel_requested: Mapped[bool] = mapped_column(Boolean, default=False)
+    # FAILED task KIE/tarmoq nosozligi sabab yiqilgan (foydalanuvchi so'rovi emas) — shared health gate uchun
+    backend_fault: Mapped[bool] = mapped_column(Boolean, default=False)
     completed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
 
 
@@ -1,12 +1,13 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete, func
+from sqlalchemy import select, delete, func, update
 from sqlalchemy.orm import selectinload
 from database.models import (ModelCategory, ModelItem, ModelSubcategory, PaymentPackage, User, Task, Payment, UserState, TaskStatus, TaskType,
                              BotMessage, PoseGroup, PoseSubgroup, PosePrompt,
                              SceneCategory, SceneSubcategory, SceneItem,
                              AdminLog)
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 from datetime import datetime, timedelta
+import json
 
 
 class UserRepository:
@@ -163,6 +164,18 @@ class TaskRepository:
         )
         return list(result.scalars().all())
     
+    async def get_last_completed_task(self, user_id: int, task_type: TaskType) -> Optional[Task]:
+        result = await self.session.execute(
+            select(Task).where(
+                Task.user_id == user_id,
+                Task.task_type == task_type,
+                Task.status == TaskStatus.COMPLETED
+            )
+            .order_by(Task.completed_at.desc())
+            .limit(1)
+        )
+        return result.scalar_one_or_none()
+
     async def get_total_tasks(self) -> int:
         result = await self.session.execute(select(func.count(Task.id)))
         return result.scalar()
@@ -173,6 +186,218 @@ class TaskRepository:
         )
         return result.scalar()
 
+    async def get_task(self, task_id: int) -> Optional[Task]:
+        result = await self.session.execute(select(Task).where(Task.id == task_id))
+        return result.scalar_one_or_none()
+
+    async def enqueue_task(self, user_id: int, chat_id: int, task_type: TaskType,
+                           cost: int, input_data: dict) -> Optional[Task]:
+        """Kreditni yechish va task yaratish bitta tranzaksiyada. Balans yetmasa None."""
+        result = await self.session.execute(
+            select(User).where(User.telegram_id == user_id).with_for_update()
+        )
+        user = result.scalar_one_or_none()
+        if not user or user.balance < cost:
+            return None
+
+        user.balance -= cost
+        task = Task(
+            user_id=user_id,
+            chat_id=chat_id,
+            task_type=task_type,
+            status=TaskStatus.PENDING,
+            cost=cost,
+            refunded=0,
+            attempts=0,
+            input_data=json.dumps(input_data, ensure_ascii=False),
+            created_at=datetime.utcnow()
+        )
+        self.session.add(task)
+        await self.session.commit()
+        await self.session.refresh(task)
+        return task
+
+    async def claim_next_task(self, worker_id: Optional[str] = None) -> Optional[Task]:
+        """Navbatdagi PENDING taskni band qiladi; parallel workerlar bir-birini kutmaydi (SKIP LOCKED)."""
+        result = await self.session.execute(
+            select(Task)
+            .where(Task.status == TaskStatus.PENDING)
+            .order_by(Task.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        task = result.scalar_one_or_none()
+        if not task:
+            await self.session.rollback()
+            return None
+
+        # Shartli UPDATE: qator qulfi bo'lmagan holatda ham task ikki workerga tushmaydi
+        claimed = await self.session.execute(
+            update(Task)
+            .where(Task.id == task.id, Task.status == TaskStatus.PENDING)
+            .values(
+                status=TaskStatus.PROCESSING,
+                attempts=Task.attempts + 1,
+                started_at=datetime.utcnow(),
+                worker_id=worker_id,
+                heartbeat_at=datetime.utcnow()
+            )
+        )
+        await self.session.commit()
+        if claimed.rowcount != 1:
+            return None
+        await self.session.refresh(task)
+        return task
+
+    async def get_recent_outcomes(self, since: datetime) -> Tuple[int, int]:
+        """
+        since'dan keyin yakunlangan (COMPLETED/FAILED) tasklar soni va ulardan KIE nosozligi sabab
+        yiqilganlari. Foydalanuvchi sababli xatolar (content policy, yaroqsiz kirish) hisoblanmaydi.
+        """
+        result = await self.session.execute(
+            select(Task.status, Task.backend_fault, func.count(Task.id))
+            .where(
+                Task.completed_at >= since,
+                Task.status.in_([TaskStatus.COMPLETED, TaskStatus.FAILED])
+            )
+            .group_by(Task.status, Task.backend_fault)
+        )
+        total = backend_failures = 0
+        for status, backend_fault, count in result.all():
+            total += count
+            if status == TaskStatus.FAILED and backend_fault:
+                backend_failures += count
+        return total, backend_failures
+
+    async def get_tasks_by_status(self, status: TaskStatus) -> List[Task]:
+        result = await self.session.execute(
+            select(Task).where(Task.status == status).order_by(Task.id)
+        )
+        return list(result.scalars().all())
+
+    async def get_stale_tasks(self, heartbeat_before: datetime) -> List[Task]:
+        """Worker'i yo'qolgan (heartbeat eskirgan) PROCESSING tasklar."""
+        result = await self.session.execute(
+            select(Task)
+            .where(
+                Task.status == TaskStatus.PROCESSING,
+                (Task.heartbeat_at == None) | (Task.heartbeat_at < heartbeat_before)  # noqa: E711
+            )
+            .order_by(Task.id)
+        )
+        return list(result.scalars().all())
+
+    async def requeue_task(self, task_id: int, heartbeat_before: Optional[datetime] = None) -> bool:
+        """PROCESSING taskni navbatga qaytaradi; heartbeat_before berilsa — faqat u hali ham eskirgan bo'lsa."""
+        query = update(Task).where(Task.id == task_id, Task.status == TaskStatus.PROCESSING)
+        if heartbeat_before is not None:
+            query = query.where((Task.heartbeat_at == None) | (Task.heartbeat_at < heartbeat_before))  # noqa: E711
+        result = await self.session.execute(query.values(status=TaskStatus.PENDING, worker_id=None))
+        await self.session.commit()
+        return result.rowcount == 1
+
+    async def touch_heartbeat(self, worker_id: str) -> int:
+        result = await self.session.execute(
+            update(Task)
+            .where(Task.worker_id == worker_id, Task.status == TaskStatus.PROCESSING)
+            .values(heartbeat_at=datetime.utcnow())
+        )
+        await self.session.commit()
+        return result.rowcount
+
+    async def release_worker_tasks(self, worker_id: str) -> int:
+        """To'xtayotgan worker o'z tasklarini darhol navbatga qaytaradi."""
+        result = await self.session.execute(
+            update(Task)
+            .where(Task.worker_id == worker_id, Task.status == TaskStatus.PROCESSING)
+            .values(status=TaskStatus.PENDING, worker_id=None)
+        )
+        await self.session.commit()
+        return result.rowcount
+
+    async def request_cancel(self, task_id: int, user_id: int) -> Tuple[Optional[Task], Optional[User]]:
+        """
+        Navbatdagi (PENDING) task darhol CANCELLED bo'ladi va kredit to'liq qaytariladi;
+        bajarilayotgan task'ga esa cancel_requested belgisi qo'yiladi — uni worker to'xtatadi.
+        """
+        result = await self.session.execute(
+            select(Task).where(Task.id == task_id, Task.user_id == user_id).with_for_update()
+        )
+        task = result.scalar_one_or_none()
+        if task is None:
+            return None, None
+        if task.status == TaskStatus.PENDING:
+            # Qator qulflangan: claim_next_task uni SKIP LOCKED bilan o'tkazib yuboradi
+            _, user = await self.finish_task(
+                task.id, TaskStatus.CANCELLED, refund=task.cost, from_statuses=(TaskStatus.PENDING,)
+            )
+            await self.session.refresh(task)
+            return task, user
+        if task.status == TaskStatus.PROCESSING:
+            task.cancel_requested = True
+        await self.session.commit()
+        return task, None
+
+    async def get_cancel_requested(self, worker_id: str) -> List[int]:
+        result = await self.session.execute(
+            select(Task.id).where(
+                Task.worker_id == worker_id,
+                Task.status == TaskStatus.PROCESSING,
+                Task.cancel_requested == True  # noqa: E712
+            )
+        )
+        return list(result.scalars().all())
+
+    async def save_progress(self, task_id: int, result_data: dict) -> bool:
+        """Bajarilayotgan task'ning oraliq natijasi — worker o'lsa qayta boshlanganda davom ettiriladi."""
+        result = await self.session.execute(
+            update(Task)
+            .where(Task.id == task_id, Task.status == TaskStatus.PROCESSING)
+            .values(result_data=json.dumps(result_data, ensure_ascii=False))
+        )
+        await self.session.commit()
+        return result.rowcount == 1
+
+    async def finish_task(self, task_id: int, status: TaskStatus, refund: int = 0,
+                          result_data: Optional[dict] = None, error_message: Optional[str] = None,
+                          from_statuses: Tuple[TaskStatus, ...] = (TaskStatus.PROCESSING,),
+                          worker_id: Optional[str] = None, backend_fault: bool = False) -> Tuple[bool, Optional[User]]:
+        """
+        Task holatini yozadi va kreditni qaytaradi (bitta tranzaksiyada); (yozildimi, yangilangan user).
+        Faqat task hali from_statuses holatida (va worker_id berilsa — shu worker'da) bo'lsa yoziladi:
+        orphan'ni ikki jarayon bir vaqtda yopsa yoki requeue qilingan taskni eski worker tugatsa,
+        ikkinchi yozuv hech narsa qilmaydi.
+        """
+        result = await self.session.execute(
+            select(Task).where(Task.id == task_id).with_for_update()
+        )
+        task = result.scalar_one_or_none()
+        if not task or task.status not in from_statuses or (worker_id is not None and task.worker_id != worker_id):
+            await self.session.rollback()
+            return False, None
+
+        # Ikki marta qaytarilmasin: jami qaytarilgan summa hech qachon cost dan oshmaydi
+        refund = max(0, min(refund, task.cost - task.refunded))
+        task.status = status
+        task.refunded += refund
+        task.completed_at = datetime.utcnow()
+        task.backend_fault = backend_fault
+        if result_data is not None:
+            task.result_data = json.dumps(result_data, ensure_ascii=False)
+        if error_message is not None:
+            task.error_message = error_message[:2000]
+
+        user_result = await self.session.execute(
+            select(User).where(User.telegram_id == task.user_id).with_for_update()
+        )
+        user = user_result.scalar_one_or_none()
+        if user and refund:
+            user.balance += refund
+        await self.session.commit()
+        if user:
+            await self.session.refresh(user)
+        return True, user
+
 
 from datetime import datetime
 from sqlalchemy import select
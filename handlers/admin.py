@@ -10,8 +10,15 @@ from admin_keyboards import (get_admin_main_menu, get_message_selection_keyboard
                              get_media_type_keyboard, get_admin_back_keyboard,
                              get_user_management_menu, get_user_detail_keyboard,
                              get_balance_action_keyboard, get_cancel_keyboard, 
-                             get_user_list_keyboard)
+                             get_user_list_keyboard, get_kie_health_keyboard)
 from keyboards import get_main_menu
+from config import settings
+from services.circuit_breaker import kie_breaker
+from services.generation_jobs import shared_health
+from services.kie_keys import kie_key_pool
+from services.kie_scheduler import kie_scheduler
+from services.kie_service import kie_service
+from services.model_registry import model_registry
 import logging
 
 logger = logging.getLogger(__name__)
@@ -114,6 +121,139 @@ async def admin_stats_handler(callback: CallbackQuery, state: FSMContext):
 
 
 
+BREAKER_STATE_NAMES = {
+    "closed": "🟢 Работает",
+    "half_open": "🟡 Проверка восстановления",
+    "open": "🔴 Отключен (новые генерации отклоняются)",
+}
+
+
+async def shared_health_text() -> str:
+    """Dispatcher rejimida: worker'lar umumiy holati (tasks jadvalidan), lokal hisoblagichlarsiz"""
+    await shared_health.refresh_state(force=True)
+    health = shared_health.snapshot()
+    if not health["enabled"]:
+        status = "Предохранитель выключен в настройках"
+    elif health["blocked"]:
+        status = "🔴 Новые генерации отклоняются"
+    else:
+        status = "🟢 Работает"
+    text = (
+        "🩺 <b>Состояние KIE</b>\n\n"
+        "Генерации выполняют отдельные worker-процессы\n"
+        f"Статус: <b>{status}</b>\n"
+        f"\nЗадач за {shared_health.window / 60:.0f} мин.: <b>{health['total']}</b>, "
+        f"сбоев KIE: <b>{health['failed']}</b>\n"
+        f"Порог: {shared_health.failure_rate:.0%} при минимум {shared_health.min_tasks} задачах\n"
+    )
+    if health["error"]:
+        text += f"Ошибка проверки: <code>{health['error'][:200]}</code>\n"
+    text += (
+        "\nℹ️ Предохранитель, очередь и счётчики ключей ведутся в каждом worker отдельно "
+        "и здесь не показываются\n"
+        "\n🧩 <b>Модели</b>\n"
+    )
+    for operation, route in model_registry.snapshot().items():
+        text += f"{operation}: <code>{route['model']}</code>\n"
+    return text
+
+
+async def kie_health_text() -> str:
+    if not settings.JOB_WORKERS_IN_BOT:
+        return await shared_health_text()
+    breaker = kie_breaker.snapshot()
+    text = (
+        "🩺 <b>Состояние KIE</b>\n\n"
+        f"Статус: <b>{BREAKER_STATE_NAMES[breaker['state']]}</b>\n"
+    )
+    if not breaker["enabled"]:
+        text += "Предохранитель выключен в настройках\n"
+    if breaker["state"] == "open":
+        text += f"Повторная проверка через: <b>{breaker['retry_after']:.0f} сек.</b>\n"
+    text += (
+        f"\nЗапросов за {kie_breaker.window:.0f} сек.: <b>{breaker['calls']}</b>\n"
+        f"Ошибок: <b>{breaker['failure_rate']:.0%}</b> (порог {kie_breaker.failure_rate:.0%})\n"
+        f"Медленных: <b>{breaker['slow_rate']:.0%}</b> (порог {kie_breaker.slow_call_rate:.0%})\n"
+        f"Срабатываний: <b>{breaker['opened_count']}</b>\n"
+    )
+    if breaker["last_reason"]:
+        text += f"Последняя причина: <code>{breaker['last_reason'][:200]}</code>\n"
+    text += (
+        f"\n⚙️ Активных задач: <b>{kie_scheduler.active_count}</b> / {kie_scheduler.global_limit}\n"
+        f"🕒 В очереди: <b>{kie_scheduler.waiting_count}</b>\n"
+        f"🔁 Ожидают результата: <b>{kie_service.poller.pending_count}</b>\n"
+        "\n🔑 <b>API ключи</b>\n"
+    )
+    for key in kie_key_pool.snapshot():
+        status = f"⛔️ карантин {key['quarantined_for']:.0f} сек." if key["quarantined_for"] else "✅"
+        text += (
+            f"{key['label']}: {status}, задач: <b>{key['in_flight']}</b>, "
+            f"токенов: {key['tokens']}, создано: {key['created']}\n"
+        )
+    text += "\n🧩 <b>Модели</b>\n"
+    for operation, route in model_registry.snapshot().items():
+        quota = route["quota"] if route["quota"] is not None else "∞"
+        text += (
+            f"{operation}: <code>{route['model']}</code> — "
+            f"<b>{route['active']}</b>/{quota}"
+            + (f", ждут: {route['waiting']}" if route["waiting"] else "")
+            + "\n"
+        )
+    return text
+
+
+def kie_health_show_reset() -> bool:
+    # Dispatcher rejimida lokal breaker generatsiyada qatnashmaydi — reset ma'nosiz
+    return settings.JOB_WORKERS_IN_BOT and kie_breaker.state.value != "closed"
+
+
+@router.callback_query(F.data == "admin_kie_health")
+async def admin_kie_health_handler(callback: CallbackQuery, state: FSMContext):
+    if not await check_admin(callback):
+        await callback.answer("❌ Нет доступа")
+        return
+
+    await callback.answer()
+    await safe_edit_text(
+        callback,
+        await kie_health_text(),
+        reply_markup=get_kie_health_keyboard(show_reset=kie_health_show_reset())
+    )
+
+
+@router.callback_query(F.data == "admin_kie_breaker_reset")
+async def admin_kie_breaker_reset_handler(callback: CallbackQuery, state: FSMContext):
+    if not await check_admin(callback):
+        await callback.answer("❌ Нет доступа")
+        return
+
+    if not settings.JOB_WORKERS_IN_BOT:
+        await callback.answer("ℹ️ Предохранитель работает в worker-процессах", show_alert=True)
+        return
+
+    kie_breaker.reset()
+    logger.warning(f"KIE circuit breaker reset by admin {callback.from_user.id}")
+    await callback.answer("✅ Предохранитель закрыт")
+    await safe_edit_text(callback, await kie_health_text(), reply_markup=get_kie_health_keyboard(show_reset=False))
+
+
+@router.callback_query(F.data == "admin_kie_models_reload")
+async def admin_kie_models_reload_handler(callback: CallbackQuery, state: FSMContext):
+    if not await check_admin(callback):
+        await callback.answer("❌ Нет доступа")
+        return
+
+    if model_registry.reload():
+        await callback.answer("✅ Таблица моделей обновлена")
+    else:
+        await callback.answer("❌ Ошибка в models.json — оставлена прежняя таблица", show_alert=True)
+    await safe_edit_text(
+        callback,
+        await kie_health_text(),
+        reply_markup=get_kie_health_keyboard(show_reset=kie_health_show_reset())
+    )
+
+
 @router.callback_query(F.data == "admin_users")
 async def admin_users_menu(callback: CallbackQuery, state: FSMContext):
     if not await check_admin(callback):
@@ -419,7 +559,7 @@ async def user_tasks_handler(callback: CallbackQuery, state: FSMContext):
     )
     
     for task in tasks[:10]:
-        status_emoji = {"completed": "✅", "failed": "❌", "pending": "⏳", "processing": "🔄"}
+        status_emoji = {"completed": "✅", "failed": "❌", "pending": "⏳", "processing": "🔄", "cancelled": "🚫"}
         emoji = status_emoji.get(task.status.value, "❓")
         text += f"{emoji} {task.task_type.value} - {task.created_at.strftime('%d.%m %H:%M')}\n"
     
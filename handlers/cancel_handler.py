@@ -0,0 +1,39 @@
+from aiogram import Router, F
+from aiogram.types import CallbackQuery
+from database.models import TaskStatus
+from services.generation_jobs import generation_jobs, cancelled_text
+from keyboards import get_back_to_generation
+import logging
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+
+@router.callback_query(F.data.startswith("cancel_job_"))
+async def cancel_generation(callback: CallbackQuery):
+    task_id = int(callback.data.replace("cancel_job_", ""))
+    try:
+        task, user = await generation_jobs.cancel(task_id, callback.from_user.id)
+    except Exception as e:
+        logger.error(f"Cancel generation {task_id} error: {e}")
+        await callback.answer("❌ Не удалось отменить генерацию", show_alert=True)
+        return
+
+    if task is None:
+        await callback.answer("Генерация не найдена", show_alert=True)
+        return
+
+    if task.status == TaskStatus.CANCELLED and user is not None:
+        # Navbatda turgan edi — kredit shu zahoti qaytarildi
+        await callback.answer("Генерация отменена")
+        await callback.message.edit_text(cancelled_text(task.cost, user.balance), reply_markup=get_back_to_generation())
+    elif task.status == TaskStatus.PROCESSING:
+        # Natija va qaytarilgan kredit haqida worker o'zi xabar beradi
+        await callback.answer("Отменяем...")
+        await callback.message.edit_text("⏳ Отменяем генерацию...")
+    else:
+        await callback.answer("Генерация уже завершена", show_alert=True)
+        try:
+            await callback.message.edit_reply_markup(reply_markup=None)
+        except Exception as e:
+            logger.warning(f"Failed to remove cancel button: {e}")
@@ -1,17 +1,19 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, BufferedInputFile
+from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from handlers.start import send_bot_message
 from states import NormalizeStates
 from keyboards import (get_back_button_normalize, get_back_button_normalize_with_buy, get_generation_menu, get_normalize_menu,
-                       get_confirmation_keyboard_normalize, get_repeat_button, get_back_to_generation)
+                       get_confirmation_keyboard_normalize, get_back_to_generation, get_cancel_generation_button)
 from database import async_session_maker
 from database.repositories import UserRepository, ModelCategoryRepository
 from services.config_loader import config_loader
-from services.kie_service import kie_service
-from utils.photo import get_photo_url_from_message
+from services.circuit_breaker import CircuitOpenError
+from services.input_stager import InvalidImageError
+from services.generation_jobs import generation_jobs, service_unavailable_text
+from utils.photo import stage_photo_from_message
 from config import settings
 import logging
 
@@ -54,7 +56,7 @@ async def normalize_photo_received(message: Message, state: FSMContext):
         return
     
     try:
-        photo_url = await get_photo_url_from_message(message)
+        photo_url = stage_photo_from_message(message)
     except ValueError as e:
         await message.answer(str(e), reply_markup=get_back_button_normalize("gen_normalize"))
         return
@@ -226,53 +228,35 @@ async def select_model_item(callback: CallbackQuery, state: FSMContext):
 async def confirm_normalize(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     data = await state.get_data()
-    mode = data["mode"]
-    photo_urls = data["photo_urls"]
-    cost = data["cost"]
-    
-    async with async_session_maker() as session:
-        user_repo = UserRepository(session)
-        await user_repo.update_balance(callback.from_user.id, -cost)
-        user = await user_repo.get_user_by_telegram_id(callback.from_user.id)
-    
-    await callback.message.edit_text("⏳ Магия началась...")
-    
+    params = {
+        "type": "normalize",
+        "mode": data["mode"],
+        "photo_urls": data["photo_urls"],
+        "cost": data["cost"],
+        "model_prompt": data.get("model_prompt")
+    }
     try:
-        if mode == "own_model":
-            result = await kie_service.normalize_own_model(photo_urls[0], photo_urls[1])
-        else:
-            model_prompt = data["model_prompt"]
-            result = await kie_service.normalize_new_model(photo_urls[0], model_prompt)
-        
-        if "image" in result:
-            await callback.message.answer_photo(
-                BufferedInputFile(result["image"], filename="normalized.jpg"), 
-                caption="✅ Нормализация завершена!"
-            )
-            await callback.message.answer(
-                f"Потрачено: {cost} кредита\nБаланс: {user.balance} кредитов", 
-                reply_markup=get_repeat_button()
-            )
-        else:
-            raise ValueError("No image in result")
-    except Exception as e:
-        logger.error(f"Normalize error: {e}")
-        async with async_session_maker() as session:
-            user_repo = UserRepository(session)
-            await user_repo.update_balance(callback.from_user.id, cost)
-        await callback.message.answer(
-            f"❌ Ошибка при нормализации: {str(e)}\n\nКредиты возвращены на баланс.", 
+        task = await generation_jobs.enqueue(
+            callback.from_user.id, callback.message.chat.id, params, status_message_id=callback.message.message_id
+        )
+    except CircuitOpenError as e:
+        await callback.message.edit_text(service_unavailable_text(e), reply_markup=get_back_to_generation())
+        return
+    except InvalidImageError as e:
+        await state.clear()
+        await callback.message.edit_text(str(e), reply_markup=get_back_to_generation())
+        return
+    if not task:
+        await callback.message.edit_text(
+            "❌ Недостаточно кредитов.\n\nПополните баланс в разделе 'Мой кабинет.'",
             reply_markup=get_back_to_generation()
         )
-    
+        await state.clear()
+        return
+
+    await callback.message.edit_text("⏳ Магия началась...", reply_markup=get_cancel_generation_button(task.id))
     await state.clear()
-    await state.update_data(last_generation={
-        "type": "normalize",
-        "mode": mode,
-        "photo_urls": photo_urls,
-        "cost": cost,
-        "model_prompt": data.get("model_prompt")
-    })
+    await state.update_data(last_generation=params)
 
 
 # ===== BACK NAVIGATION =====
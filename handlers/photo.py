@@ -1,5 +1,5 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, BufferedInputFile
+from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardButton
@@ -7,16 +7,18 @@ from handlers.start import send_bot_message
 from states import PhotoStates
 from keyboards import (
     get_back_to_generation_with_buy, get_generation_menu, get_photo_menu, get_back_button_photo, get_confirmation_keyboard_photo,
-    get_repeat_button, get_back_to_generation
+    get_back_to_generation, get_cancel_generation_button
 )
 from database import async_session_maker
 from database.repositories import SceneCategoryRepository, UserRepository, PoseRepository
 from services.config_loader import config_loader
-from services.kie_service import kie_service
+from services.circuit_breaker import CircuitOpenError
+from services.input_stager import InvalidImageError
+from services.generation_jobs import generation_jobs, service_unavailable_text
 from services.translator import translator_service
 import logging
 
-from utils.photo import get_photo_url_from_message
+from utils.photo import stage_photo_from_message
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -76,7 +78,7 @@ async def photo_received(message: Message, state: FSMContext):
         return
 
     try:
-        photo_url = await get_photo_url_from_message(message)
+        photo_url = stage_photo_from_message(message)
     except Exception as e:
         logger.error(f"Photo processing error: {e}")
         await message.answer("❌ Ошибка при обработке фото.", reply_markup=get_back_button_photo("gen_photo"))
@@ -192,43 +194,34 @@ async def apply_scene_item(callback: CallbackQuery, state: FSMContext):
     async with async_session_maker() as session:
         repo = SceneCategoryRepository(session)
         item = await repo.get_item(item_id)
-        user_repo = UserRepository(session)
 
-        cost = config_loader.pricing["photo"]["scene_change"]
-        if not await user_repo.check_balance(callback.from_user.id, cost):
-            await safe_edit_text(callback, "❌ Недостаточно кредитов.", reply_markup=get_back_to_generation_with_buy())
-            await state.clear()
-            return
-
-        await user_repo.update_balance(callback.from_user.id, -cost)
-        user = await user_repo.get_user_by_telegram_id(callback.from_user.id)
-
-    await safe_edit_text(callback, "⏳ Генерация...")
-
-    try:
-        result = await kie_service.change_scene(photo_url, item.prompt)
-        if "image" in result:
-            await callback.message.answer_photo(
-                BufferedInputFile(result["image"], "result.jpg"),
-                caption=f"✅ {item.name}"
-            )
-        await callback.message.answer(
-            f"✅ Готово!\n\nПотрачено: {cost} кр.\nБаланс: {user.balance} кр.",
-            reply_markup=get_repeat_button()
-        )
-    except Exception as e:
-        logger.error(f"Scene error: {e}")
-        await user_repo.update_balance(callback.from_user.id, cost)
-        await callback.message.answer("❌ Ошибка генерации. Кредиты возвращены.")
-
-    await state.clear()
-    await state.update_data(last_generation={
+    cost = config_loader.pricing["photo"]["scene_change"]
+    params = {
         "type": "photo",
         "mode": "scene_change",
         "photo_url": photo_url,
         "item_id": item.id,                # 3-darajali ITEM ID
         "cost": cost
-    })
+    }
+    try:
+        task = await generation_jobs.enqueue(
+            callback.from_user.id, callback.message.chat.id, params, status_message_id=callback.message.message_id
+        )
+    except CircuitOpenError as e:
+        await safe_edit_text(callback, service_unavailable_text(e), reply_markup=get_back_to_generation())
+        return
+    except InvalidImageError as e:
+        await state.clear()
+        await safe_edit_text(callback, str(e), reply_markup=get_back_to_generation())
+        return
+    if not task:
+        await safe_edit_text(callback, "❌ Недостаточно кредитов.", reply_markup=get_back_to_generation_with_buy())
+        await state.clear()
+        return
+
+    await safe_edit_text(callback, "⏳ Генерация...", reply_markup=get_cancel_generation_button(task.id))
+    await state.clear()
+    await state.update_data(last_generation=params)
 
 
 # ===== POSE: SELECT GROUP =====
@@ -305,43 +298,34 @@ async def apply_pose_prompt(callback: CallbackQuery, state: FSMContext):
     async with async_session_maker() as session:
         repo = PoseRepository(session)
         prompt = await repo.get_prompt(prompt_id)
-        user_repo = UserRepository(session)
-
-        cost = config_loader.pricing["photo"]["pose_change"]
-        if not await user_repo.check_balance(callback.from_user.id, cost):
-            await safe_edit_text(callback, "❌ Недостаточно кредитов.", reply_markup=get_back_to_generation_with_buy())
-            await state.clear()
-            return
-
-        await user_repo.update_balance(callback.from_user.id, -cost)
-        user = await user_repo.get_user_by_telegram_id(callback.from_user.id)
-
-    await safe_edit_text(callback, "⏳ Генерация...")
-
-    try:
-        result = await kie_service.change_pose(photo_url, prompt.prompt)
-        if "image" in result:
-            await callback.message.answer_photo(
-                BufferedInputFile(result["image"], "result.jpg"),
-                caption=f"✅ {prompt.name}"
-            )
-        await callback.message.answer(
-            f"✅ Готово!\n\nПотрачено: {cost} кр.\nБаланс: {user.balance} кр.",
-            reply_markup=get_repeat_button()
-        )
-    except Exception as e:
-        logger.error(f"Pose error: {e}")
-        await user_repo.update_balance(callback.from_user.id, cost)
-        await callback.message.answer("❌ Ошибка генерации. Кредиты возвращены.")
 
-    await state.clear()
-    await state.update_data(last_generation={
+    cost = config_loader.pricing["photo"]["pose_change"]
+    params = {
         "type": "photo",
         "mode": "pose_change",
         "photo_url": photo_url,
-        "prompt_id": prompt.id,            
+        "prompt_id": prompt.id,
         "cost": cost
-    })
+    }
+    try:
+        task = await generation_jobs.enqueue(
+            callback.from_user.id, callback.message.chat.id, params, status_message_id=callback.message.message_id
+        )
+    except CircuitOpenError as e:
+        await safe_edit_text(callback, service_unavailable_text(e), reply_markup=get_back_to_generation())
+        return
+    except InvalidImageError as e:
+        await state.clear()
+        await safe_edit_text(callback, str(e), reply_markup=get_back_to_generation())
+        return
+    if not task:
+        await safe_edit_text(callback, "❌ Недостаточно кредитов.", reply_markup=get_back_to_generation_with_buy())
+        await state.clear()
+        return
+
+    await safe_edit_text(callback, "⏳ Генерация...", reply_markup=get_cancel_generation_button(task.id))
+    await state.clear()
+    await state.update_data(last_generation=params)
 
 
 @router.message(PhotoStates.entering_custom_prompt, F.text)
@@ -367,38 +351,32 @@ async def custom_prompt_received(message: Message, state: FSMContext):
 @router.callback_query(PhotoStates.confirming, F.data.startswith("confirm_"))
 async def confirm_custom(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
-    photo_url = data["photo_url"]
-    prompt = data["prompt"]
-    cost = data["cost"]
-
-    async with async_session_maker() as session:
-        repo = UserRepository(session)
-        await repo.update_balance(callback.from_user.id, -cost)
-        user = await repo.get_user_by_telegram_id(callback.from_user.id)
-
-    await safe_edit_text(callback, "⏳ Генерация...")
-
+    params = {
+        "type": "photo",
+        "mode": "custom",
+        "photo_url": data["photo_url"],
+        "prompt": data["prompt"],          # Tarjima qilingan prompt
+        "cost": data["cost"]
+    }
     try:
-        result = await kie_service.custom_generation(photo_url, prompt)
-        if "image" in result:
-            await callback.message.answer_photo(BufferedInputFile(result["image"], "custom.jpg"))
-        await callback.message.answer(
-            f"✅ Готово!\n\nПотрачено: {cost} кр.\nБаланс: {user.balance} кр.",
-            reply_markup=get_repeat_button()
+        task = await generation_jobs.enqueue(
+            callback.from_user.id, callback.message.chat.id, params, status_message_id=callback.message.message_id
         )
-    except Exception as e:
-        await repo.update_balance(callback.from_user.id, cost)
-        await callback.message.answer("❌ Ошибка. Кредиты возвращены.")
+    except CircuitOpenError as e:
+        await safe_edit_text(callback, service_unavailable_text(e), reply_markup=get_back_to_generation())
+        return
+    except InvalidImageError as e:
+        await state.clear()
+        await safe_edit_text(callback, str(e), reply_markup=get_back_to_generation())
+        return
+    if not task:
+        await safe_edit_text(callback, "❌ Недостаточно кредитов.", reply_markup=get_back_to_generation_with_buy())
+        await state.clear()
+        return
 
+    await safe_edit_text(callback, "⏳ Генерация...", reply_markup=get_cancel_generation_button(task.id))
     await state.clear()
-    await state.update_data(last_generation={
-        "type": "photo",
-        "mode": "custom",
-        "photo_url": photo_url,
-        "prompt": prompt,                  # Tarjima qilingan prompt
-        "cost": cost
-    })
-    
+    await state.update_data(last_generation=params)
 
 
 # ===== BACK NAVIGATION =====
@@ -1,5 +1,5 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, BufferedInputFile
+from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardButton
@@ -8,18 +8,24 @@ from handlers.start import send_bot_message
 from states import ProductCardStates
 from keyboards import (
     get_back_button_product_card, get_confirmation_keyboard_product_card,
-    get_repeat_button, get_back_to_generation, get_generation_menu
+    get_repeat_button, get_back_to_generation, get_generation_menu, get_cancel_generation_button
 )
 from database import async_session_maker
-from database.repositories import UserRepository, SceneCategoryRepository
+from database.models import TaskType
+from database.repositories import UserRepository, SceneCategoryRepository, TaskRepository
 from services.config_loader import config_loader
-from services.kie_service import kie_service
-from utils.photo import get_photo_url_from_message
+from services.blob_store import blob_store
+from services.circuit_breaker import CircuitOpenError
+from services.input_stager import InvalidImageError
+from services.zip_export import SpooledInputFile, zip_exporter
+from services.generation_jobs import generation_jobs, service_unavailable_text
+from utils.photo import stage_photo_from_message
 from config import settings
+import contextlib
+import json
 import logging
-import zipfile
-import io
 from datetime import datetime
+from typing import List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -97,7 +103,7 @@ async def product_card_photo_received(message: Message, state: FSMContext):
         return
 
     try:
-        photo_url = await get_photo_url_from_message(message)
+        photo_url = stage_photo_from_message(message)
     except ValueError as e:
         await message.answer(str(e), reply_markup=get_back_button("gen_product_card"))
         return
@@ -559,95 +565,35 @@ async def select_scene_category(callback: CallbackQuery, state: FSMContext):
 async def confirm_product_card(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     data = await state.get_data()
-    photo_url = data["photo_url"]
-    cost = data["cost"]
-    generation_type = data["generation_type"]
-
-    async with async_session_maker() as session:
-        user_repo = UserRepository(session)
-        await user_repo.update_balance(callback.from_user.id, -cost)
-        user = await user_repo.get_user_by_telegram_id(callback.from_user.id)
-
-    await safe_edit_or_skip(callback, "⏳ Генерация началась...")
-
+    params = {
+        "type": "product_card",
+        "photo_url": data["photo_url"],
+        "generation_type": data["generation_type"],
+        "selected_category": data.get("selected_category"),
+        "selected_categories": data.get("selected_categories", []),
+        "cost": data["cost"]
+    }
     try:
-        results = []
-
-        async with async_session_maker() as session:
-            scene_repo = SceneCategoryRepository(session)
-
-            if generation_type == "all_scenes":
-                hierarchy = await scene_repo.get_full_hierarchy()
-                for cat_id, cat in hierarchy.items():
-                    cat_name = cat["name"]
-                    for sub_id, sub in cat["subcategories"].items():
-                        sub_name = sub["name"]
-                        for item in sub["items"]:
-                            result = await kie_service.change_scene(photo_url, item["prompt"])
-                            result["category_name"] = cat_name
-                            result["subcategory_name"] = sub_name
-                            result["item_name"] = item["name"]
-                            results.append(result)
-
-            elif generation_type == "category_all":
-                selected_category = int(data["selected_category"])
-                category = await scene_repo.get_category(selected_category)
-                subcategories = await scene_repo.get_subcategories_by_category(selected_category)
-
-                for subcat in subcategories:
-                    items = await scene_repo.get_items_by_subcategory(subcat.id)
-                    for item in items:
-                        result = await kie_service.change_scene(photo_url, item.prompt)
-                        result["category_name"] = category.name
-                        result["subcategory_name"] = subcat.name
-                        result["item_name"] = item.name
-                        results.append(result)
-
-            elif generation_type == "selected_categories":
-                selected_categories = data.get("selected_categories", [])
-                
-                for category_id in selected_categories:
-                    category = await scene_repo.get_category(category_id)
-                    subcategories = await scene_repo.get_subcategories_by_category(category_id)
-                    
-                    for subcat in subcategories:
-                        items = await scene_repo.get_items_by_subcategory(subcat.id)
-                        for item in items:
-                            result = await kie_service.change_scene(photo_url, item.prompt)
-                            result["category_name"] = category.name
-                            result["subcategory_name"] = subcat.name
-                            result["item_name"] = item.name
-                            results.append(result)
-
-        for i, result in enumerate(results, 1):
-            if "image" in result:
-                caption = (
-                    f"{result.get('category_name', 'N/A')} · "
-                    f"{result.get('subcategory_name', 'N/A')} · "
-                    f"{result.get('item_name', 'N/A')}"
-                )
-                await callback.message.answer_photo(
-                    BufferedInputFile(result["image"], filename=f"result_{i}.jpg"),
-                    caption=caption
-                )
-
-        await state.update_data(generated_results=results)
-
-        await callback.message.answer(
-            f"✅ Генерация завершена!\n\n"
-            f"Потрачено: {cost} кредитов\n"
-            f"Баланс: {user.balance} кредитов",
-            reply_markup=get_back_and_download_buttons()
+        task = await generation_jobs.enqueue(
+            callback.from_user.id, callback.message.chat.id, params, status_message_id=callback.message.message_id
         )
-    except Exception as e:
-        logger.error(f"Product card generation error: {e}", exc_info=True)
-        async with async_session_maker() as session:
-            user_repo = UserRepository(session)
-            await user_repo.update_balance(callback.from_user.id, cost)
-        await callback.message.answer(
-            f"❌ Ошибка при генерации: {str(e)}\n\nКредиты возвращены на баланс.",
+    except CircuitOpenError as e:
+        await safe_edit_or_skip(callback, service_unavailable_text(e), reply_markup=get_back_button("selecting_scene_category"))
+        return
+    except InvalidImageError as e:
+        await state.clear()
+        await safe_edit_or_skip(callback, str(e), reply_markup=get_back_to_generation())
+        return
+    if not task:
+        await safe_edit_or_skip(
+            callback,
+            "❌ Недостаточно кредитов.\n\nПополните баланс в разделе 'Мой кабинет.'",
             reply_markup=get_back_button("selecting_scene_category")
         )
+        return
+
+    await safe_edit_or_skip(callback, "⏳ Генерация началась...", reply_markup=get_cancel_generation_button(task.id))
+    await state.update_data(last_generation=params)
 
 
 @router.callback_query(F.data == "pc_download_all")
@@ -655,7 +601,14 @@ async def download_all_as_zip(callback: CallbackQuery, state: FSMContext):
     await callback.answer("📦 Создаю ZIP архив...")
     
     data = await state.get_data()
-    results = data.get("generated_results", [])
+    results = data.get("generated_results")
+    if not results:
+        # Generatsiya alohida worker jarayonida bajarilgan bo'lsa FSM'da havolalar yo'q — task natijasidan olamiz
+        async with async_session_maker() as session:
+            task = await TaskRepository(session).get_last_completed_task(callback.from_user.id, TaskType.PRODUCT_CARD)
+        if task and task.result_data:
+            results = json.loads(task.result_data).get("results")
+    results = [result for result in results or [] if "blob" in result and blob_store.exists(result["blob"])]
     
     if not results:
         await callback.message.answer(
@@ -663,118 +616,116 @@ async def download_all_as_zip(callback: CallbackQuery, state: FSMContext):
             reply_markup=get_back_and_download_buttons()
         )
         return
-    
+
+    entries = zip_exporter.entries(results)
+    cache_key = zip_exporter.cache_key(entries)
+    cached_parts = zip_exporter.cached(cache_key)
+    if cached_parts:
+        # Shu to'plam avval yuklangan — Telegram'dagi fayllarni qayta yuboramiz
+        await send_zip_parts(callback, cached_parts, len(results))
+        return
+
     status_msg = await callback.message.answer("⏳ Подготовка архива...")
-    
-    try:
-        MAX_ZIP_SIZE = 45 * 1024 * 1024 
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        zip_parts = []
-        current_zip = io.BytesIO()
-        current_size = 0
-        part_number = 1
-        images_in_current_part = 0
-        
-        current_zipfile = zipfile.ZipFile(current_zip, 'w', zipfile.ZIP_DEFLATED)
-        
-        for i, result in enumerate(results, 1):
-            if "image" in result:
-                cat = result.get('category_name', 'N/A')[:20]
-                sub = result.get('subcategory_name', 'N/A')[:20]
-                item = result.get('item_name', 'N/A')[:20]
-                
-                filename = f"{i:03d}_{cat}_{sub}_{item}.jpg"
-                filename = "".join(c for c in filename if c.isalnum() or c in ('_', '-', '.')).strip()
-                filename = filename[:100] if len(filename) > 100 else filename
-                
-                image_data = result["image"]
-                image_size = len(image_data)
-                
-                if current_size + image_size > MAX_ZIP_SIZE and images_in_current_part > 0:
-                    current_zipfile.close()
-                    current_zip.seek(0)
-                    zip_parts.append((current_zip.getvalue(), part_number, images_in_current_part))
-                    
-                    await status_msg.edit_text(
-                        f"⏳ Создан архив {part_number}... Продолжаю..."
-                    )
-
-                    current_zip = io.BytesIO()
-                    current_size = 0
-                    part_number += 1
-                    images_in_current_part = 0
-                    current_zipfile = zipfile.ZipFile(current_zip, 'w', zipfile.ZIP_DEFLATED)
-
-                current_zipfile.writestr(filename, image_data)
-                current_size += image_size
-                images_in_current_part += 1
-        
-        current_zipfile.close()
-        current_zip.seek(0)
-        zip_parts.append((current_zip.getvalue(), part_number, images_in_current_part))
-        
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    async def build_parts():
+        # Qismlar yozish davomida hajm bo'yicha ajratiladi; keyingisi oldindan quriladi —
+        # shunda joriy qism oxirgisimi (yagona arxivmi) ma'lum bo'ladi
+        parts = zip_exporter.parts(entries)
+        current = await anext(parts, None)
+        number = 0
         try:
-            await status_msg.delete()
-        except:
-            pass
-        
-        if len(zip_parts) == 1:
+            if current is None:
+                return
             try:
-                await callback.message.answer_document(
-                    BufferedInputFile(
-                        zip_parts[0][0],
-                        filename=f"product_cards_{timestamp}.zip"
-                    ),
-                    caption=f"📦 Все изображения ({len(results)} шт.)",
-                    reply_markup=get_back_and_download_buttons(download=False),
-                    request_timeout=300  
-                )
-            except Exception as e:
-                logger.error(f"Failed to send single ZIP: {e}")
-                await callback.message.answer(
-                    "❌ Файл слишком большой для отправки.\n"
-                    "Попробуйте выбрать меньше категорий.",
-                    reply_markup=get_back_and_download_buttons(download=False)
-                )
-        else:
-            sent_parts = 0
-            for zip_data, part_num, img_count in zip_parts:
+                await status_msg.delete()
+            except Exception:
+                pass
+            while current is not None:
+                following = await anext(parts, None)
+                number += 1
+                archive, count = current
+                last = following is None
+                filename = (f"product_cards_{timestamp}.zip" if number == 1 and last
+                            else f"product_cards_{timestamp}_part{number}.zip")
                 try:
-                    await callback.message.answer_document(
-                        BufferedInputFile(
-                            zip_data,
-                            filename=f"product_cards_{timestamp}_part{part_num}.zip"
-                        ),
-                        caption=f"📦 Часть {part_num}/{len(zip_parts)} ({img_count} изображений)",
-                        request_timeout=300  
-                    )
-                    sent_parts += 1
-                except Exception as e:
-                    logger.error(f"Failed to send ZIP part {part_num}: {e}")
-                    await callback.message.answer(
-                        f"❌ Ошибка при отправке части {part_num}",
-                        reply_markup=get_back_and_download_buttons(download=False)
-                    )
-                    break
-            
-            if sent_parts == len(zip_parts):
-                await callback.message.answer(
-                    f"✅ Все файлы отправлены!\n\n"
-                    f"Всего частей: {len(zip_parts)}\n"
-                    f"Изображений: {len(results)}",
-                    reply_markup=get_back_and_download_buttons(download=False)
-                )
-        
+                    yield SpooledInputFile(archive, filename=filename), count, last
+                finally:
+                    archive.close()
+                current = following
+        finally:
+            if current is not None:
+                current[0].close()
+            await parts.aclose()
+
+    try:
+        file_ids = await send_zip_parts(callback, build_parts(), len(results))
     except Exception as e:
         logger.error(f"ZIP creation error: {e}", exc_info=True)
         try:
             await status_msg.delete()
-        except:
+        except Exception:
             pass
-        
         await callback.message.answer(
             "❌ Ошибка при создании архива.\n"
             "Попробуйте выбрать меньше изображений.",
             reply_markup=get_back_and_download_buttons()
-        )
\ No newline at end of file
+        )
+        return
+
+    if file_ids:
+        zip_exporter.remember(cache_key, file_ids)
+    elif file_ids is not None:
+        await status_msg.edit_text("❌ Нет изображений для скачивания", reply_markup=get_back_and_download_buttons())
+
+
+async def send_zip_parts(callback: CallbackQuery, parts, image_count: int) -> Optional[List[Tuple[str, int]]]:
+    """
+    ZIP qismlarini yuboradi. parts — keshdagi (file_id, rasmlar soni) ro'yxati yoki
+    (document, rasmlar soni, oxirgimi) beradigan async generator.
+    Hammasi yuborilsa qismlarning file_id'larini qaytaradi.
+    """
+    if isinstance(parts, list):
+        parts = _iterate_parts(parts)
+
+    file_ids = []
+    # aclosing: xato yoki bekor qilishda zip_exporter.parts darhol yopiladi — spool fayllar o'chiriladi
+    async with contextlib.aclosing(parts):
+        async for document, count, last in parts:
+            part_number = len(file_ids) + 1
+            single = part_number == 1 and last
+            if single:
+                caption = f"📦 Все изображения ({image_count} шт.)"
+                reply_markup = get_back_and_download_buttons(download=False)
+            else:
+                caption = f"📦 Часть {part_number} ({count} изображений)"
+                reply_markup = None
+            if zip_exporter.variants:
+                caption += f"\nФорматы: оригинал + {zip_exporter.variant_labels}"
+            try:
+                message = await callback.message.answer_document(
+                    document, caption=caption, reply_markup=reply_markup, request_timeout=300
+                )
+            except Exception as e:
+                logger.error(f"Failed to send ZIP part {part_number}: {e}")
+                if single:
+                    text = "❌ Файл слишком большой для отправки.\nПопробуйте выбрать меньше категорий."
+                else:
+                    text = f"❌ Ошибка при отправке части {part_number}"
+                await callback.message.answer(text, reply_markup=get_back_and_download_buttons(download=False))
+                return None
+            file_ids.append((message.document.file_id, count))
+
+    if len(file_ids) > 1:
+        await callback.message.answer(
+            f"✅ Все файлы отправлены!\n\n"
+            f"Всего частей: {len(file_ids)}\n"
+            f"Изображений: {image_count}",
+            reply_markup=get_back_and_download_buttons(download=False)
+        )
+    return file_ids
+
+
+async def _iterate_parts(parts: List[Tuple[str, int]]):
+    for number, (file_id, count) in enumerate(parts, 1):
+        yield file_id, count, number == len(parts)
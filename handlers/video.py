@@ -1,20 +1,22 @@
 import logging
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, BufferedInputFile
+from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardButton
 from handlers.start import send_bot_message
 from states import VideoStates
 from keyboards import (get_back_button_video, get_video_menu, get_video_scenarios, 
-                       get_confirmation_keyboard, get_repeat_button, get_back_to_generation, get_generation_menu)
+                       get_confirmation_keyboard, get_back_to_generation, get_generation_menu, get_cancel_generation_button)
 from database import async_session_maker
 from database.repositories import UserRepository
 from database.repositories import VideoScenarioRepository   # <-- YANGI
 from services.config_loader import config_loader
-from services.kie_service import kie_service
+from services.circuit_breaker import CircuitOpenError
+from services.input_stager import InvalidImageError
+from services.generation_jobs import generation_jobs, service_unavailable_text
 from services.translator import translator_service
-from utils.photo import get_photo_url_from_message
+from utils.photo import stage_photo_from_message
 from config import settings
 
 logger = logging.getLogger(__name__)
@@ -57,7 +59,7 @@ async def video_mode_selected(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     nav_stack = data.get("nav_stack", [])
     nav_stack.append(f"video_mode_{mode}") 
-    await state.update_data(nav_stack=nav_stack, mode=mode, cost=cost, model=video_config["model"], duration=video_config["duration"], resolution=video_config["resolution"])
+    await state.update_data(nav_stack=nav_stack, mode=mode, cost=cost, duration=video_config["duration"], resolution=video_config["resolution"])
     await state.set_state(VideoStates.waiting_for_photo)
     mode_names = {
         "balance": "⚖️ Баланс — Grok",
@@ -80,7 +82,7 @@ def get_back_button(current_step: str):
 @router.message(VideoStates.waiting_for_photo, F.photo | F.document)
 async def video_photo_received(message: Message, state: FSMContext):
     try:
-        photo_url = await get_photo_url_from_message(message)
+        photo_url = stage_photo_from_message(message)
     except ValueError as e:
         await message.answer(str(e), reply_markup=get_back_button("gen_video"))
         return
@@ -141,7 +143,6 @@ async def back_navigation_video(callback: CallbackQuery, state: FSMContext):
         
         await state.set_state(VideoStates.waiting_for_photo)
         await state.update_data(mode=mode, cost=video_config["cost"], 
-                              model=video_config["model"], 
                               duration=video_config["duration"],
                               resolution=video_config["resolution"])
         
@@ -260,40 +261,37 @@ async def video_custom_prompt_received(message: Message, state: FSMContext):
 async def confirm_video(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     data = await state.get_data()
-    photo_url = data["photo_url"]
-    prompt = data["prompt"]
-    cost = data["cost"]
-    model = data["model"]
-    duration = int(data["duration"].split()[0].replace("~", ""))
-    resolution = data["resolution"]
-
-    async with async_session_maker() as session:
-        user_repo = UserRepository(session)
-        await user_repo.update_balance(callback.from_user.id, -cost)
-        user = await user_repo.get_user_by_telegram_id(callback.from_user.id)
-    await callback.message.edit_text("⏳ Генерация видео... Это может занять несколько минут.")
+    params = {
+        "type": "video",
+        "mode": data["mode"],
+        "photo_url": data["photo_url"],
+        "prompt": data["prompt"],
+        "cost": data["cost"],
+        "duration": str(int(data["duration"].split()[0].replace("~", ""))),
+        "resolution": data["resolution"]
+    }
     try:
-        logger.info(f"Using image URL: {photo_url} for model {model}")
-        result = await kie_service.generate_video(photo_url, prompt, model, duration, resolution)
-        if "video" in result:
-            await callback.message.answer_video(BufferedInputFile(result["video"], filename="video.mp4"), caption="✅ Видео готово!")
-            await callback.message.answer(f"Потрачено: {cost} кредитов\nБаланс: {user.balance} кредитов", reply_markup=get_repeat_button())
-        else:
-            raise ValueError("No video in result")
-    except Exception as e:
-        logger.error(f"Video generation error: {e}", exc_info=True)
-        async with async_session_maker() as session:
-            user_repo = UserRepository(session)
-            await user_repo.update_balance(callback.from_user.id, cost)
-        await callback.message.answer(f"❌ Ошибка при генерации видео: {str(e)}\n\nКредиты возвращены на баланс.", reply_markup=get_back_to_generation())
-    finally:
+        task = await generation_jobs.enqueue(
+            callback.from_user.id, callback.message.chat.id, params, status_message_id=callback.message.message_id
+        )
+    except CircuitOpenError as e:
+        await callback.message.edit_text(service_unavailable_text(e), reply_markup=get_back_to_generation())
+        return
+    except InvalidImageError as e:
         await state.clear()
-    await state.update_data(last_generation={
-        "type": "video",
-        "photo_url": photo_url,
-        "prompt": prompt,
-        "cost": cost,
-        "model": model,
-        "duration": str(duration),
-        "resolution": resolution
-    })
\ No newline at end of file
+        await callback.message.edit_text(str(e), reply_markup=get_back_to_generation())
+        return
+    if not task:
+        await callback.message.edit_text(
+            "❌ Недостаточно кредитов.\n\nПополните баланс в разделе 'Мой кабинет.'",
+            reply_markup=get_back_to_generation()
+        )
+        await state.clear()
+        return
+
+    await callback.message.edit_text(
+        "⏳ Генерация видео... Это может занять несколько минут.",
+        reply_markup=get_cancel_generation_button(task.id)
+    )
+    await state.clear()
+    await state.update_data(last_generation=params)
\ No newline at end of file
@@ -3,6 +3,7 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from typing import List
 from database.repositories import UserRepository
+from config import settings
 
 
 
@@ -316,14 +317,34 @@ def get_payment_packages(packages: List[dict]) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+def get_cancel_generation_button(task_id: int) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text="🚫 Отменить", callback_data=f"cancel_job_{task_id}"))
+    return builder.as_markup()
+
+
 def get_repeat_button() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="🔄 Повторить", callback_data="repeat_generation"))
+    if settings.RESULT_CACHE_ENABLED:
+        # "Повторить" keshdagi natijani qaytarishi mumkin — bu tugma har doim yangi generatsiya qiladi
+        builder.row(InlineKeyboardButton(text="🎲 Сгенерировать заново", callback_data="regenerate_generation"))
     builder.row(InlineKeyboardButton(text="🔙 В меню генерации", callback_data="back_to_generations"))
     return builder.as_markup()
 
 
 
+def get_product_card_result_buttons(download: bool = True) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    if download:
+        builder.row(InlineKeyboardButton(text="📥 Скачать все", callback_data="pc_download_all"))
+    builder.row(InlineKeyboardButton(text="🔄 Повторить", callback_data="repeat_generation"))
+    if settings.RESULT_CACHE_ENABLED:
+        builder.row(InlineKeyboardButton(text="🎲 Сгенерировать заново", callback_data="regenerate_generation"))
+    builder.row(InlineKeyboardButton(text="🔙 В меню генерации", callback_data="back_to_generations"))
+    return builder.as_markup()
+
+
 def get_dynamic_back_button(current_step: str):
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="◀️ Назад", callback_data=f"back_{current_step}"))
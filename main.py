@@ -7,8 +7,12 @@ from aiogram.enums import ParseMode
 from config import settings
 from database import engine
 from database.models import Base
-from handlers import admin_poses, admin_scene, admin_video_scenarios, start, product_card, normalize, video, photo, cabinet , common, admin, repeat_handler, admin_model_type, admin_normalize, admin_packege
+from handlers import admin_poses, admin_scene, admin_video_scenarios, start, product_card, normalize, video, photo, cabinet , common, admin, repeat_handler, cancel_handler, admin_model_type, admin_normalize, admin_packege
 from middlewares.middlewares import BanCheckMiddleware 
+from services.kie_service import kie_service
+from services.kie_webhook import create_webhook_server
+from services.generation_jobs import generation_jobs
+from services.output_processor import output_processor
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -35,6 +39,7 @@ async def main():
     dp.callback_query.middleware(BanCheckMiddleware())
 
     dp.include_router(repeat_handler.router)
+    dp.include_router(cancel_handler.router)
     dp.include_router(normalize.router)
     dp.include_router(photo.router)
     dp.include_router(product_card.router)
@@ -49,10 +54,26 @@ async def main():
     dp.include_router(admin_video_scenarios.router)
     dp.include_router(admin_normalize.router)
     dp.include_router(admin_packege.router)
+    # KIE callback'lari faqat generatsiyani kutayotgan (pollerli) jarayonda kerak — bot faqat
+    # dispetcher bo'lsa port worker.py uchun bo'sh qoladi
+    webhook_server = None
+    if settings.JOB_WORKERS_IN_BOT:
+        if kie_service.webhook_enabled:
+            webhook_server = create_webhook_server(kie_service)
+            await webhook_server.start()
+        await generation_jobs.start(bot, storage=dp.storage)
+    else:
+        logger.info("Generation jobs are handled by separate worker processes")
+
     logger.info("Bot started")
     try:
         await dp.start_polling(bot, skip_updates=True)
     finally:
+        await generation_jobs.stop()
+        if webhook_server is not None:
+            await webhook_server.stop()
+        await kie_service.close()
+        output_processor.shutdown()
         await bot.session.close()
 
 
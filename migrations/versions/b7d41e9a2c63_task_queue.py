@@ -0,0 +1,36 @@
+"""task queue
+
+Revision ID: b7d41e9a2c63
+Revises: f579c52728d0
+Create Date: 2026-10-17 10:12:40.512934
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d41e9a2c63'
+down_revision: Union[str, Sequence[str], None] = 'f579c52728d0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('tasks', sa.Column('chat_id', sa.BigInteger(), nullable=True))
+    op.add_column('tasks', sa.Column('refunded', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('tasks', sa.Column('attempts', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('tasks', sa.Column('started_at', sa.DateTime(), nullable=True))
+    op.create_index(op.f('ix_tasks_status'), 'tasks', ['status'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_tasks_status'), table_name='tasks')
+    op.drop_column('tasks', 'started_at')
+    op.drop_column('tasks', 'attempts')
+    op.drop_column('tasks', 'refunded')
+    op.drop_column('tasks', 'chat_id')
@@ -0,0 +1,30 @@
+"""task worker heartbeat
+
+Revision ID: c5e8f0a17d94
+Revises: b7d41e9a2c63
+Create Date: 2026-10-17 12:03:18.221047
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5e8f0a17d94'
+down_revision: Union[str, Sequence[str], None] = 'b7d41e9a2c63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('tasks', sa.Column('worker_id', sa.String(length=128), nullable=True))
+    op.add_column('tasks', sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('tasks', 'heartbeat_at')
+    op.drop_column('tasks', 'worker_id')
@@ -0,0 +1,32 @@
+"""task cancel
+
+Revision ID: d9a3b6e1f420
+Revises: c5e8f0a17d94
+Create Date: 2026-10-17 13:41:05.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd9a3b6e1f420'
+down_revision: Union[str, Sequence[str], None] = 'c5e8f0a17d94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ALTER TYPE ... ADD VALUE tranzaksiya ichida bajarilmaydi (PostgreSQL < 12)
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE taskstatus ADD VALUE IF NOT EXISTS 'CANCELLED'")
+    op.add_column('tasks', sa.Column('cancel_requested', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('tasks', 'cancel_requested')
+    # PostgreSQL enum'dan qiymatni olib tashlab bo'lmaydi — 'CANCELLED' qoladi
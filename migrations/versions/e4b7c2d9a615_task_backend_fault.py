@@ -0,0 +1,28 @@
+"""task backend fault
+
+Revision ID: e4b7c2d9a615
+Revises: d9a3b6e1f420
+Create Date: 2026-10-17 18:22:47.503116
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b7c2d9a615'
+down_revision: Union[str, Sequence[str], None] = 'd9a3b6e1f420'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('tasks', sa.Column('backend_fault', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('tasks', 'backend_fault')
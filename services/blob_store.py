@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class BlobStore:
+    """
+    Generatsiya natijalari (rasm baytlari) uchun diskdagi content-addressed ombor.
+    FSM va bazada faqat kichik havola (sha256) saqlanadi — xotira batch hajmiga bog'liq emas.
+    retention_hours davomida ishlatilmagan (mtime) fayllar vaqti-vaqti bilan o'chiriladi.
+    """
+
+    def __init__(self, directory: str, retention_hours: float, cleanup_interval: float):
+        self.directory = Path(directory)
+        self.retention = retention_hours * 3600
+        self.cleanup_interval = cleanup_interval
+        self._last_cleanup = 0.0
+        self._cleanup_task: Optional[asyncio.Task] = None
+
+    def path(self, ref: str) -> Path:
+        return self.directory / ref[:2] / f"{ref}.bin"
+
+    async def put(self, data: bytes) -> str:
+        ref = hashlib.sha256(data).hexdigest()
+        await asyncio.to_thread(self._write, ref, data)
+        self._maybe_cleanup()
+        return ref
+
+    async def get(self, ref: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._read, ref)
+
+    def exists(self, ref: str) -> bool:
+        return self.path(ref).is_file()
+
+    def _write(self, ref: str, data: bytes):
+        path = self.path(ref)
+        if path.exists():
+            # Bir xil natija qayta keldi — saqlash muddatini yangilaymiz
+            try:
+                os.utime(path, None)
+                return
+            except OSError:
+                pass
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Noyob vaqtinchalik nom: bir xil natijani bir vaqtda yozayotgan thread'lar
+        # (yoki bot va worker.py jarayonlari) bir-birining faylini buzmaydi
+        tmp_path = path.with_suffix(f".{os.getpid()}.{uuid.uuid4().hex}.tmp")
+        try:
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                tmp_path.unlink(missing_ok=True)
+            except OSError:
+                pass
+            raise
+
+    def _read(self, ref: str) -> Optional[bytes]:
+        try:
+            return self.path(ref).read_bytes()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Blob read failed for {ref}: {e}")
+            return None
+
+    def _maybe_cleanup(self):
+        now = time.monotonic()
+        if now - self._last_cleanup < self.cleanup_interval:
+            return
+        if self._cleanup_task is not None and not self._cleanup_task.done():
+            return
+        self._last_cleanup = now
+        self._cleanup_task = asyncio.create_task(asyncio.to_thread(self.cleanup))
+
+    def cleanup(self) -> int:
+        """RETENTION_HOURS'dan eski bloblarni o'chiradi; o'chirilganlar sonini qaytaradi."""
+        if not self.directory.exists():
+            return 0
+        cutoff = time.time() - self.retention
+        removed = 0
+        for path in self.directory.glob("*/*"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                continue
+        if removed:
+            logger.info(f"Blob store removed {removed} expired files")
+        return removed
+
+
+blob_store = BlobStore(
+    directory=settings.BLOB_STORE_DIR,
+    retention_hours=settings.RETENTION_HOURS,
+    cleanup_interval=settings.BLOB_CLEANUP_INTERVAL
+)
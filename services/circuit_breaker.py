@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import Enum
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Deque, Optional, Tuple
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Backend vaqtincha o'chirilgan — so'rov KIE'ga yuborilmadi."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"KIE is unavailable, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    KIE uchun circuit breaker.
+    Oxirgi `window` soniyadagi chaqiruvlar bo'yicha xatolar va sekin javoblar ulushini kuzatadi;
+    chegaradan oshsa OPEN holatiga o'tadi va yangi generatsiyalar darhol rad etiladi.
+    `open_seconds` o'tgach HALF_OPEN: bir nechta sinov chaqiruvi o'tkaziladi —
+    hammasi muvaffaqiyatli bo'lsa CLOSED, birortasi yiqilsa yana OPEN.
+    """
+
+    def __init__(self, window: float, min_calls: int, failure_rate: float,
+                 slow_call_seconds: float, slow_call_rate: float,
+                 open_seconds: float, half_open_probes: int, enabled: bool = True):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.enabled = enabled
+
+        self._state = CircuitState.CLOSED
+        # (vaqt, muvaffaqiyatli, sekin)
+        self._calls: Deque[Tuple[float, bool, bool]] = deque()
+        self._opened_at: Optional[float] = None
+        self._last_reason: Optional[str] = None
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._changed: Optional[asyncio.Event] = None
+        self.opened_count = 0
+
+    @property
+    def state(self) -> CircuitState:
+        if self._state == CircuitState.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition(CircuitState.HALF_OPEN)
+        return self._state
+
+    def retry_after(self) -> float:
+        if self._state != CircuitState.OPEN:
+            return 0.0
+        return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def allow_request(self) -> bool:
+        """Yangi generatsiyani qabul qilish mumkinmi (kredit yechishdan oldin tekshiriladi)."""
+        return not self.enabled or self.state != CircuitState.OPEN
+
+    def check(self):
+        if not self.allow_request():
+            raise CircuitOpenError(self.retry_after())
+
+    @asynccontextmanager
+    async def guard(self):
+        """
+        KIE chaqiruvi atrofida: OPEN bo'lsa CircuitOpenError, HALF_OPEN da esa
+        bir vaqtda faqat half_open_probes ta sinov o'tkaziladi, qolganlari natijani kutadi.
+        Qaytarilgan qiymat — shu chaqiruv sinovmi (natija record_success(probe=...) ga beriladi).
+        """
+        probe = await self._acquire()
+        try:
+            yield probe
+        finally:
+            if probe:
+                self._probes_in_flight -= 1
+                self._signal()
+
+    async def _acquire(self) -> bool:
+        while True:
+            if not self.enabled:
+                return False
+            state = self.state
+            if state == CircuitState.CLOSED:
+                return False
+            if state == CircuitState.OPEN:
+                raise CircuitOpenError(self.retry_after())
+            if self._probes_in_flight < self.half_open_probes:
+                self._probes_in_flight += 1
+                return True
+            if self._changed is None:
+                self._changed = asyncio.Event()
+            await self._changed.wait()
+
+    def record_success(self, duration: float = 0.0, probe: bool = False):
+        slow = duration >= self.slow_call_seconds
+        self._record(True, slow)
+        if self._state != CircuitState.HALF_OPEN:
+            self._evaluate()
+        elif probe and slow:
+            self._open(f"slow probe ({duration:.1f}s)")
+        elif probe:
+            # Faqat sinov chaqiruvlari yopadi: status so'rovlari ishlashi task yaratish ishlashini anglatmaydi
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_probes:
+                self._transition(CircuitState.CLOSED)
+
+    def record_failure(self, error: Optional[BaseException] = None):
+        self._record(False, False)
+        if self._state == CircuitState.HALF_OPEN:
+            self._open(f"probe failed: {error}")
+        elif self._state == CircuitState.CLOSED:
+            self._evaluate(error)
+
+    def reset(self):
+        self._calls.clear()
+        self._transition(CircuitState.CLOSED)
+
+    def _record(self, ok: bool, slow: bool):
+        now = time.monotonic()
+        self._calls.append((now, ok, slow))
+        self._prune(now)
+
+    def _prune(self, now: float):
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+    def _rates(self) -> Tuple[int, float, float]:
+        self._prune(time.monotonic())
+        total = len(self._calls)
+        if not total:
+            return 0, 0.0, 0.0
+        failures = sum(1 for _, ok, _ in self._calls if not ok)
+        slow = sum(1 for _, _, is_slow in self._calls if is_slow)
+        return total, failures / total, slow / total
+
+    def _evaluate(self, error: Optional[BaseException] = None):
+        if not self.enabled or self._state != CircuitState.CLOSED:
+            return
+        total, failure_rate, slow_rate = self._rates()
+        if total < self.min_calls:
+            return
+        if failure_rate >= self.failure_rate:
+            self._open(f"failure rate {failure_rate:.0%} over {total} calls (last: {error})")
+        elif slow_rate >= self.slow_call_rate:
+            self._open(f"slow call rate {slow_rate:.0%} over {total} calls")
+
+    def _open(self, reason: str):
+        self._opened_at = time.monotonic()
+        self._last_reason = reason
+        self.opened_count += 1
+        self._transition(CircuitState.OPEN)
+
+    def _transition(self, state: CircuitState):
+        if state == self._state:
+            return
+        logger.warning(f"KIE circuit breaker: {self._state.value} -> {state.value}"
+                       + (f" ({self._last_reason})" if state == CircuitState.OPEN else ""))
+        self._state = state
+        self._probe_successes = 0
+        if state == CircuitState.CLOSED:
+            self._opened_at = None
+            # Eski xatolar yangi ochilishga sabab bo'lmasin
+            self._calls.clear()
+        self._signal()
+
+    def _signal(self):
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    def snapshot(self) -> dict:
+        total, failure_rate, slow_rate = self._rates()
+        return {
+            "enabled": self.enabled,
+            "state": self.state.value,
+            "calls": total,
+            "failure_rate": failure_rate,
+            "slow_rate": slow_rate,
+            "retry_after": self.retry_after(),
+            "last_reason": self._last_reason,
+            "opened_count": self.opened_count,
+        }
+
+
+class SharedHealthGate:
+    """
+    CircuitBreaker holati jarayon ichida: dispetcher rejimidagi bot (JOB_WORKERS_IN_BOT=false)
+    KIE'ni chaqirmaydi va uning breaker'i hech qachon ochilmaydi. Shu rejimda yangi generatsiyalar
+    bazadagi umumiy manba — workerlar yaqinda yakunlagan tasklar bo'yicha qabul qilinadi
+    (faqat KIE nosozligi sabab yiqilganlari xato hisoblanadi, CircuitBreaker'dagi kabi).
+    Natija refresh soniya keshlanadi; bazaga ulanib bo'lmasa tekshiruv o'tkazib yuboriladi.
+    """
+
+    def __init__(self, load_outcomes: Callable[[datetime], Awaitable[Tuple[int, int]]],
+                 window: float, min_tasks: int, failure_rate: float, open_seconds: float,
+                 refresh: float = 10, enabled: bool = True):
+        self._load_outcomes = load_outcomes
+        self.window = window
+        self.min_tasks = min_tasks
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.refresh = refresh
+        self.enabled = enabled
+        self._checked_at = 0.0
+        self._total = 0
+        self._failed = 0
+        self._error: Optional[str] = None
+        self._blocked = False
+
+    async def refresh_state(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.refresh:
+            return
+        self._checked_at = now
+        try:
+            self._total, self._failed = await self._load_outcomes(datetime.utcnow() - timedelta(seconds=self.window))
+            self._error = None
+        except Exception as e:
+            logger.warning(f"KIE shared health check failed, allowing: {e}")
+            self._total, self._failed, self._error = 0, 0, str(e)
+        blocked = (self.enabled and self._total >= self.min_tasks
+                   and self._failed / self._total >= self.failure_rate)
+        if blocked != self._blocked:
+            logger.warning(f"KIE shared health: {self._failed}/{self._total} recent tasks failed, "
+                           + ("rejecting new generations" if blocked else "accepting again"))
+        self._blocked = blocked
+
+    async def check(self):
+        if not self.enabled:
+            return
+        await self.refresh_state()
+        if self._blocked:
+            raise CircuitOpenError(self.open_seconds)
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "blocked": self._blocked,
+            "total": self._total,
+            "failed": self._failed,
+            "error": self._error,
+        }
+
+
+kie_breaker = CircuitBreaker(
+    window=settings.KIE_BREAKER_WINDOW,
+    min_calls=settings.KIE_BREAKER_MIN_CALLS,
+    failure_rate=settings.KIE_BREAKER_FAILURE_RATE,
+    slow_call_seconds=settings.KIE_BREAKER_SLOW_CALL,
+    slow_call_rate=settings.KIE_BREAKER_SLOW_RATE,
+    open_seconds=settings.KIE_BREAKER_OPEN_SECONDS,
+    half_open_probes=settings.KIE_BREAKER_HALF_OPEN_PROBES,
+    enabled=settings.KIE_BREAKER_ENABLED
+)
@@ -0,0 +1,144 @@
+import asyncio
+import contextlib
+import logging
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import BufferedInputFile, InputMediaPhoto
+
+from config import settings
+from services.blob_store import blob_store
+from services.output_processor import PHOTO, output_processor
+from services.product_card_service import product_card_service
+
+logger = logging.getLogger(__name__)
+
+# sendMediaGroup 2..10 ta elementni qabul qiladi
+MAX_ALBUM_SIZE = 10
+
+
+def product_card_caption(result: dict) -> str:
+    return (
+        f"{result.get('category_name', 'N/A')} · "
+        f"{result.get('subcategory_name', 'N/A')} · "
+        f"{result.get('item_name', 'N/A')}"
+    )
+
+
+def _photo_file(result: dict) -> BufferedInputFile:
+    return BufferedInputFile(result["image"], filename=f"result_{result['index'] + 1}.{result.get('ext', 'jpg')}")
+
+
+async def _with_retry_after(call: Callable[[], Awaitable]):
+    """Flood limitga tushsa, Telegram aytgan vaqtcha kutib qayta yuboradi."""
+    for attempt in range(settings.DELIVERY_MAX_RETRIES + 1):
+        try:
+            return await call()
+        except TelegramRetryAfter as e:
+            if attempt >= settings.DELIVERY_MAX_RETRIES:
+                raise
+            logger.warning(f"Telegram flood limit, retrying in {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
+
+
+async def _send_result(bot: Bot, chat_id: int, result: dict) -> bool:
+    try:
+        await _with_retry_after(lambda: bot.send_photo(
+            chat_id, _photo_file(result), caption=product_card_caption(result)
+        ))
+        return True
+    except Exception as e:
+        logger.error(f"Failed to deliver product card item {result['index']}: {e}")
+        return False
+
+
+async def _send_album(bot: Bot, chat_id: int, album: List[dict]) -> List[dict]:
+    """Albomni bitta so'rov bilan yuboradi; yetkazilgan natijalarni qaytaradi."""
+    if len(album) == 1:
+        return album if await _send_result(bot, chat_id, album[0]) else []
+
+    try:
+        await _with_retry_after(lambda: bot.send_media_group(chat_id, [
+            InputMediaPhoto(media=_photo_file(result), caption=product_card_caption(result))
+            for result in album
+        ]))
+        return album
+    except Exception as e:
+        # Albom rad etilsa (masalan, bitta fayl yaroqsiz) — qolganlarini alohida yuboramiz
+        logger.error(f"Failed to deliver album of {len(album)} product cards, sending one by one: {e}")
+        return [result for result in album if await _send_result(bot, chat_id, result)]
+
+
+async def deliver_product_cards(bot: Bot, chat_id: int, photo_url: str, items: List[dict],
+                                user_id: Optional[int] = None, use_cache: bool = True,
+                                on_delivered: Optional[Callable[[List[dict]], Awaitable[None]]] = None,
+                                on_result: Optional[Callable[[dict], None]] = None) -> Tuple[List[dict], int]:
+    """
+    Карточка товара generatsiyasi va chatga yetkazish.
+    Natijalar albomlarga (DELIVERY_ALBUM_SIZE tadan) yig'ib yuboriladi;
+    streaming rejimida albom to'lishi bilan darhol jo'natiladi.
+    on_delivered har bir yuborilgan albom bilan kutiladi (sarflangan kredit hisobi va task progressini saqlash uchun),
+    on_result — har bir tayyor yoki muvaffaqiyatsiz natija bilan (progress uchun).
+    Yetkazilgan natijalar (katalog tartibida, rasm o'rnida blob_store havolasi "blob")
+    va muvaffaqiyatsizlar sonini qaytaradi.
+    """
+    album_size = max(1, min(settings.DELIVERY_ALBUM_SIZE, MAX_ALBUM_SIZE))
+    delivered = []
+    failed_count = 0
+    album = []
+
+    async def flush():
+        nonlocal failed_count
+        # Albom await'lardan oldin bo'shatiladi: flush paytida bekor qilinsa, xuddi shu natijalar
+        # CancelledError bo'limida qayta yuborilmaydi
+        batch, album[:] = album[:], []
+        # Asl natija (ZIP uchun) diskka, chatga esa PHOTO kanali bo'yicha qayta kodlangan nusxa ketadi
+        for result in batch:
+            result["blob"] = await blob_store.put(result["image"])
+        encoded = await asyncio.gather(*(output_processor.process(result["image"], PHOTO) for result in batch))
+        for result, (image, ext) in zip(batch, encoded):
+            result["image"], result["ext"] = image, ext
+        sent = await _send_album(bot, chat_id, batch)
+        # Batch qancha katta bo'lmasin, xotirada faqat havolalar qoladi
+        for result in batch:
+            result.pop("image", None)
+            result.pop("ext", None)
+        delivered.extend(sent)
+        failed_count += len(batch) - len(sent)
+        if on_delivered is not None and sent:
+            await on_delivered(sent)
+
+    if settings.PRODUCT_CARD_STREAMING:
+        results = product_card_service.generate_stream(photo_url, items, user_id=user_id, use_cache=use_cache)
+    else:
+        results = _iterate(await product_card_service.generate(photo_url, items, user_id=user_id, use_cache=use_cache))
+
+    try:
+        # aclosing: bekor qilinganda oqim darhol yopiladi va KIE'dagi tugallanmagan tasklar to'xtatiladi
+        async with contextlib.aclosing(results):
+            async for result in results:
+                if on_result is not None:
+                    on_result(result)
+                if "image" not in result:
+                    failed_count += 1
+                    continue
+                album.append(result)
+                if len(album) >= album_size:
+                    await flush()
+    except asyncio.CancelledError:
+        # Bekor qilindi: tayyor bo'lib qolgan natijalar baribir yuboriladi, qolganlari to'xtaydi
+        if album:
+            await flush()
+        raise
+
+    if album:
+        await flush()
+
+    delivered.sort(key=lambda result: result["index"])
+    return delivered, failed_count
+
+
+async def _iterate(results: List[dict]):
+    for result in results:
+        yield result
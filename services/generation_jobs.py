@@ -0,0 +1,607 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.types import BufferedInputFile
+
+from config import settings
+from database import async_session_maker
+from database.models import Task, TaskStatus, TaskType, User
+from database.repositories import TaskRepository, SceneCategoryRepository, PoseRepository
+from keyboards import (
+    get_back_to_generation, get_cancel_generation_button, get_product_card_result_buttons, get_repeat_button
+)
+from services.circuit_breaker import CircuitOpenError, SharedHealthGate, kie_breaker
+from services.config_loader import config_loader
+from services.delivery import deliver_product_cards
+from services.input_stager import input_stager
+from services.kie_scheduler import queue_position_notifier
+from services.kie_service import kie_service
+from services.model_registry import model_registry
+from services.output_processor import PHOTO, output_processor
+from services.product_card_service import product_card_service
+from services.progress_reporter import ProgressReporter
+
+logger = logging.getLogger(__name__)
+
+VIDEO_TASK_TYPES = {
+    "balance": TaskType.VIDEO_BALANCE,
+    "pro_6": TaskType.VIDEO_PRO_6,
+    "pro_10": TaskType.VIDEO_PRO_10,
+    "super_6": TaskType.VIDEO_SUPER_6,
+}
+
+# Foto rejimi -> configs/models.json operatsiyasi (ETA uchun)
+PHOTO_OPERATIONS = {
+    "scene_change": "scene",
+    "pose_change": "pose",
+    "custom": "custom",
+}
+
+PHOTO_TASK_TYPES = {
+    "scene_change": TaskType.PHOTO_SCENE,
+    "pose_change": TaskType.PHOTO_POSE,
+    "custom": TaskType.PHOTO_CUSTOM,
+}
+
+
+def task_type_for(params: dict) -> TaskType:
+    """last_generation ko'rinishidagi parametrlardan Task.task_type."""
+    gen_type = params.get("type")
+    if gen_type == "product_card":
+        return TaskType.PRODUCT_CARD
+    if gen_type == "normalize":
+        return TaskType.NORMALIZE_OWN_MODEL if params["mode"] == "own_model" else TaskType.NORMALIZE_NEW_MODEL
+    if gen_type == "photo":
+        return PHOTO_TASK_TYPES[params["mode"]]
+    if gen_type == "video":
+        return VIDEO_TASK_TYPES[params["mode"]]
+    raise ValueError(f"Unknown generation type: {gen_type}")
+
+
+def service_unavailable_text(error: CircuitOpenError) -> str:
+    minutes = max(1, round(error.retry_after / 60))
+    return (
+        "⚠️ Сервис генерации временно недоступен.\n\n"
+        f"Попробуйте через {minutes} мин. Кредиты не списаны."
+    )
+
+
+def cancelled_text(refund: int, balance: int) -> str:
+    return (
+        "🚫 Генерация отменена.\n\n"
+        f"Возвращено: {refund} кр.\n"
+        f"Баланс: {balance} кр."
+    )
+
+
+class JobProgress:
+    """
+    Foydalanuvchiga allaqachon yetkazilgan natijalar: narxi (bekor qilinganda yoki xato bo'lganda
+    qolgani qaytariladi) va product card havolalari. Task result_data'sida saqlanadi —
+    worker o'lib task qayta boshlansa, yuborilgan rasmlar qayta yuborilmaydi.
+    """
+
+    def __init__(self, spent: int = 0, delivered: Optional[List[dict]] = None):
+        self.spent = spent
+        self.delivered = delivered or []
+
+    @classmethod
+    def restore(cls, task: Task) -> "JobProgress":
+        try:
+            data = json.loads(task.result_data or "{}")
+        except ValueError:
+            data = {}
+        return cls(int(data.get("spent", 0)), list(data.get("results", [])))
+
+    def add(self, credits: int):
+        self.spent += credits
+
+    def snapshot(self) -> dict:
+        return {"spent": self.spent, "results": self.delivered}
+
+
+class GenerationFailed(ValueError):
+    """Runner xatosi; backend_fault — sabab KIE nosozligi (shared health gate uchun task'da saqlanadi)."""
+
+    def __init__(self, message: str, backend_fault: bool = False):
+        super().__init__(message)
+        self.backend_fault = backend_fault
+
+
+def is_backend_failure(error: BaseException) -> bool:
+    if isinstance(error, GenerationFailed):
+        return error.backend_fault
+    return kie_service.is_backend_failure(error)
+
+
+class JobOutcome:
+    def __init__(self, summary: str, reply_markup=None, refund: int = 0, result_data: Optional[dict] = None):
+        self.summary = summary
+        self.reply_markup = reply_markup
+        self.refund = refund
+        self.result_data = result_data or {}
+
+
+class GenerationJobQueue:
+    """
+    'tasks' jadvali ustidagi doimiy navbat.
+    Handler kreditni yechib task yozadi (bitta tranzaksiyada), workerlar esa
+    SELECT ... FOR UPDATE SKIP LOCKED bilan taskni olib, KIEService orqali bajaradi.
+    Workerlar bot ichida yoki alohida jarayonlarda (worker.py) ishlashi mumkin — ular faqat
+    baza orqali kelishadi. Har bir jarayon o'z tasklarining heartbeat'ini yangilab turadi;
+    heartbeat'i eskirgan PROCESSING tasklar qayta navbatga qo'yiladi yoki kredit qaytariladi.
+    Foydalanuvchi taskni bekor qilsa, u bajarilayotgan jarayon ichki asyncio task'ni to'xtatadi
+    (poll, slotlar va navbatdagi batch elementlari darhol bo'shaydi) va sarflanmagan kredit qaytariladi.
+    """
+
+    def __init__(self):
+        self._bot: Optional[Bot] = None
+        self._storage: Optional[BaseStorage] = None
+        self._workers: List[asyncio.Task] = []
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._cancel_watch: Optional[asyncio.Task] = None
+        self._running: Dict[int, asyncio.Task] = {}
+        self._user_cancelled: Set[int] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def enqueue(self, user_id: int, chat_id: int, params: dict, use_cache: bool = True,
+                      status_message_id: Optional[int] = None) -> Optional[Task]:
+        """
+        Balans yetmasa None qaytaradi.
+        status_message_id — "⏳ Генерация..." xabari: worker unda progress va ETA'ni ko'rsatib boradi.
+        KIE circuit breaker ochiq bo'lsa kredit yechilmasdan CircuitOpenError ko'tariladi;
+        kirish rasmi ochilmasa — InvalidImageError.
+        """
+        if settings.JOB_WORKERS_IN_BOT:
+            kie_breaker.check()
+        else:
+            # KIE'ni worker.py jarayonlari chaqiradi — bu jarayonning breaker'i hech narsa ko'rmaydi
+            await shared_health.check()
+        photo_refs = [params["photo_url"]] if params.get("photo_url") else params.get("photo_urls", [])
+        for photo_ref in photo_refs:
+            await input_stager.ensure_valid(photo_ref)
+        # ensure_valid fondagi staging'ni kutgan — tayyor URL'lar taskni bajaradigan jarayonga ham yetadi
+        staged_inputs = input_stager.export(photo_refs)
+        async with async_session_maker() as session:
+            task = await TaskRepository(session).enqueue_task(
+                user_id=user_id,
+                chat_id=chat_id,
+                task_type=task_type_for(params),
+                cost=int(params.get("cost", 0)),
+                input_data={"params": params, "use_cache": use_cache, "status_message_id": status_message_id,
+                            "staged_inputs": staged_inputs}
+            )
+        if task:
+            logger.info(f"Generation job {task.id} queued for user {user_id}: {params.get('type')}")
+            if self._wakeup is not None:
+                self._wakeup.set()
+        return task
+
+    async def cancel(self, task_id: int, user_id: int) -> Tuple[Optional[Task], Optional[User]]:
+        """
+        Navbatdagi task darhol yopiladi (kredit to'liq qaytadi) — (task, user) qaytariladi.
+        Bajarilayotgan task uchun esa faqat belgi qo'yiladi: uni ishlatayotgan jarayon to'xtatadi,
+        sarflanmagan kreditni qaytaradi va foydalanuvchiga o'zi xabar beradi (user None bo'ladi).
+        """
+        async with async_session_maker() as session:
+            task, user = await TaskRepository(session).request_cancel(task_id, user_id)
+        if task is None:
+            return None, None
+        if task.status == TaskStatus.CANCELLED and user is not None:
+            logger.info(f"Generation job {task_id} cancelled by user {user_id} before start")
+        elif task.status == TaskStatus.PROCESSING:
+            logger.info(f"Generation job {task_id} cancel requested by user {user_id}")
+            self._interrupt(task_id)
+        return task, user
+
+    def _interrupt(self, task_id: int):
+        job = self._running.get(task_id)
+        if job is not None and not job.done():
+            self._user_cancelled.add(task_id)
+            job.cancel()
+
+    # ----- worker pool -----
+
+    async def start(self, bot: Bot, storage: Optional[BaseStorage] = None, workers: Optional[int] = None):
+        self._bot = bot
+        self._storage = storage
+        self._wakeup = asyncio.Event()
+        await self.recover_orphans()
+        count = workers or settings.JOB_WORKERS
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(count)]
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+        self._cancel_watch = asyncio.create_task(self._cancel_watch_loop())
+        logger.info(f"Generation job workers started: {count} ({self.worker_id})")
+
+    async def stop(self):
+        if self._bot is None:
+            return
+        tasks = self._workers + [task for task in (self._heartbeat, self._cancel_watch) if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._heartbeat = None
+        self._cancel_watch = None
+        # Uzilgan tasklarni darhol qaytaramiz — boshqa workerlar heartbeat eskirishini kutmaydi
+        try:
+            async with async_session_maker() as session:
+                released = await TaskRepository(session).release_worker_tasks(self.worker_id)
+            if released:
+                logger.info(f"Released {released} interrupted jobs back to the queue")
+        except Exception as e:
+            logger.error(f"Failed to release jobs of {self.worker_id}: {e}")
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(settings.JOB_HEARTBEAT_INTERVAL)
+            try:
+                async with async_session_maker() as session:
+                    await TaskRepository(session).touch_heartbeat(self.worker_id)
+                await self.recover_orphans()
+            except Exception as e:
+                logger.error(f"Job heartbeat failed: {e}")
+
+    async def _cancel_watch_loop(self):
+        """Bekor qilish tugmasi boshqa jarayonda bosilgan bo'lsa — belgini bazadan olamiz."""
+        while True:
+            await asyncio.sleep(settings.JOB_CANCEL_CHECK_INTERVAL)
+            if not self._running:
+                continue
+            try:
+                async with async_session_maker() as session:
+                    task_ids = await TaskRepository(session).get_cancel_requested(self.worker_id)
+            except Exception as e:
+                logger.error(f"Job cancel check failed: {e}")
+                continue
+            for task_id in task_ids:
+                self._interrupt(task_id)
+
+    async def recover_orphans(self):
+        """Heartbeat'i JOB_STALE_AFTER'dan eski PROCESSING tasklar — worker'i o'lgan."""
+        stale_before = datetime.utcnow() - timedelta(seconds=settings.JOB_STALE_AFTER)
+        async with async_session_maker() as session:
+            task_repo = TaskRepository(session)
+            orphans = await task_repo.get_stale_tasks(stale_before)
+            for task in orphans:
+                # worker_id sharti: shu orada boshqa jarayon yopgan yoki qayta olgan task'ga tegilmaydi
+                if task.cancel_requested:
+                    await self._cancelled(task, JobProgress.restore(task), worker_id=task.worker_id)
+                elif task.attempts < settings.JOB_MAX_ATTEMPTS:
+                    previous_worker = task.worker_id
+                    # Shartli: shu orada boshqa worker uni olgan yoki heartbeat yangilangan bo'lishi mumkin
+                    if await task_repo.requeue_task(task.id, heartbeat_before=stale_before):
+                        logger.warning(f"Resuming orphaned job {task.id} from {previous_worker} "
+                                       f"(attempt {task.attempts})")
+                        if self._wakeup is not None:
+                            self._wakeup.set()
+                else:
+                    logger.error(f"Orphaned job {task.id} exceeded {settings.JOB_MAX_ATTEMPTS} attempts, refunding")
+                    await self._fail(task, "Generation was interrupted too many times",
+                                     JobProgress.restore(task), worker_id=task.worker_id)
+
+    async def _worker(self, number: int):
+        while True:
+            # KIE ishlamayotganda tasklar navbatda kutadi — olib, muvaffaqiyatsiz yopmaymiz
+            if not kie_breaker.allow_request():
+                await asyncio.sleep(min(settings.JOB_POLL_INTERVAL, max(1.0, kie_breaker.retry_after())))
+                continue
+
+            # clear() claim'dan oldin: claim'dan keyin kelgan enqueue signali yo'qolmaydi
+            self._wakeup.clear()
+            try:
+                async with async_session_maker() as session:
+                    task = await TaskRepository(session).claim_next_task(self.worker_id)
+            except Exception as e:
+                logger.error(f"Job worker {number} failed to claim a task: {e}")
+                await asyncio.sleep(settings.JOB_POLL_INTERVAL)
+                continue
+
+            if task is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._execute(task)
+
+    async def _execute(self, task: Task):
+        payload = json.loads(task.input_data or "{}")
+        params = payload.get("params", {})
+        use_cache = payload.get("use_cache", True)
+        input_stager.adopt(payload.get("staged_inputs", {}))
+        progress = JobProgress.restore(task)
+        if task.cancel_requested:
+            # Bekor qilish so'ralgan, lekin worker o'lib task qayta navbatga tushgan
+            await self._cancelled(task, progress, worker_id=self.worker_id)
+            return
+        logger.info(f"Running generation job {task.id} ({task.task_type.value}) for user {task.user_id}")
+
+        reporter = ProgressReporter(
+            self._bot, task.chat_id, payload.get("status_message_id"),
+            reply_markup=get_cancel_generation_button(task.id)
+        )
+        # Alohida asyncio task: foydalanuvchi bekor qilsa faqat shu generatsiya to'xtaydi, worker emas
+        job = asyncio.create_task(self._run(task, params, use_cache, progress, reporter))
+        self._running[task.id] = job
+        try:
+            outcome = await job
+        except asyncio.CancelledError:
+            # Worker o'zi to'xtatilyapti (shutdown) — task release_worker_tasks bilan navbatga qaytadi
+            if task.id not in self._user_cancelled or asyncio.current_task().cancelling():
+                await reporter.close()
+                raise
+            await reporter.close("🚫 Генерация отменена")
+            await self._cancelled(task, progress, worker_id=self.worker_id)
+            return
+        except Exception as e:
+            logger.error(f"Generation job {task.id} failed: {e}", exc_info=True)
+            await reporter.close("❌ Генерация не удалась")
+            await self._fail(task, str(e), progress, worker_id=self.worker_id,
+                             backend_fault=is_backend_failure(e))
+            return
+        finally:
+            self._running.pop(task.id, None)
+            self._user_cancelled.discard(task.id)
+
+        await reporter.close("✅ Генерация завершена")
+
+        async with async_session_maker() as session:
+            applied, user = await TaskRepository(session).finish_task(
+                task.id, TaskStatus.COMPLETED, refund=outcome.refund, result_data=outcome.result_data,
+                worker_id=self.worker_id
+            )
+        if not applied:
+            logger.warning(f"Generation job {task.id} was already finished or reassigned, not reporting completion")
+            return
+        balance = user.balance if user else 0
+        await self._send(task.chat_id, outcome.summary.format(balance=balance), outcome.reply_markup)
+
+    async def _fail(self, task: Task, error: str, progress: JobProgress, worker_id: Optional[str] = None,
+                    backend_fault: bool = False):
+        # Yetkazib bo'lingan natijalar (product card albomlari) uchun kredit qaytarilmaydi
+        refund = max(0, task.cost - progress.spent)
+        async with async_session_maker() as session:
+            applied, _ = await TaskRepository(session).finish_task(
+                task.id, TaskStatus.FAILED, refund=refund,
+                result_data=progress.snapshot() if progress.spent else None, error_message=error,
+                worker_id=worker_id, backend_fault=backend_fault
+            )
+        if not applied:
+            # Boshqa jarayon allaqachon yopgan — foydalanuvchiga ikkinchi xabar yubormaymiz
+            return
+        if refund == task.cost:
+            refund_text = "Кредиты возвращены на баланс."
+        else:
+            refund_text = f"Возвращено: {refund} кр. (за уже полученные изображения кредиты не возвращаются)"
+        await self._send(task.chat_id, f"❌ Ошибка при генерации: {error}\n\n{refund_text}", get_back_to_generation())
+
+    async def _save_progress(self, task: Task, progress: JobProgress):
+        try:
+            async with async_session_maker() as session:
+                await TaskRepository(session).save_progress(task.id, progress.snapshot())
+        except Exception as e:
+            # Saqlanmasa faqat restart'dan keyin qayta yuborish xavfi bor — generatsiyani to'xtatmaymiz
+            logger.warning(f"Failed to save progress of job {task.id}: {e}")
+
+    async def _cancelled(self, task: Task, progress: JobProgress, worker_id: Optional[str] = None):
+        refund = max(0, task.cost - progress.spent)
+        async with async_session_maker() as session:
+            applied, user = await TaskRepository(session).finish_task(
+                task.id, TaskStatus.CANCELLED, refund=refund,
+                result_data=progress.snapshot(), error_message="Cancelled by user", worker_id=worker_id
+            )
+        if not applied:
+            return
+        logger.info(f"Generation job {task.id} cancelled, refunded {refund} of {task.cost}")
+        balance = user.balance if user else 0
+        await self._send(task.chat_id, cancelled_text(refund, balance), get_back_to_generation())
+
+    async def _send(self, chat_id: Optional[int], text: str, reply_markup=None):
+        if chat_id is None or self._bot is None:
+            return
+        try:
+            await self._bot.send_message(chat_id, text, reply_markup=reply_markup)
+        except Exception as e:
+            logger.error(f"Failed to send job message to {chat_id}: {e}")
+
+    def _state(self, chat_id: int, user_id: int) -> Optional[FSMContext]:
+        if self._storage is None:
+            return None
+        key = StorageKey(bot_id=self._bot.id, chat_id=chat_id, user_id=user_id)
+        return FSMContext(storage=self._storage, key=key)
+
+    # ----- runners -----
+
+    async def _run(self, task: Task, params: dict, use_cache: bool, progress: JobProgress,
+                   reporter: ProgressReporter) -> JobOutcome:
+        gen_type = params.get("type")
+        if gen_type == "photo":
+            return await self._run_photo(task, params, use_cache, progress, reporter)
+        if gen_type == "normalize":
+            return await self._run_normalize(task, params, use_cache, progress, reporter)
+        if gen_type == "product_card":
+            return await self._run_product_card(task, params, use_cache, progress, reporter)
+        if gen_type == "video":
+            return await self._run_video(task, params, progress, reporter)
+        raise ValueError(f"Unknown generation type: {gen_type}")
+
+    async def _run_photo(self, task: Task, params: dict, use_cache: bool, progress: JobProgress,
+                         reporter: ProgressReporter) -> JobOutcome:
+        bot, user_id = self._bot, task.user_id
+        mode = params["mode"]
+        image_url = await input_stager.resolve(bot, params["photo_url"])
+        reporter.start("⏳ Генерация...", 1, model_registry.model_for(PHOTO_OPERATIONS.get(mode, mode)))
+
+        async with queue_position_notifier(bot, task.chat_id, user_id):
+            if mode == "scene_change":
+                async with async_session_maker() as session:
+                    item = await SceneCategoryRepository(session).get_item(int(params["item_id"]))
+                if not item:
+                    raise ValueError("Сцена не найдена")
+                result = await kie_service.change_scene(image_url, item.prompt, user_id=user_id, use_cache=use_cache)
+                filename, caption = "result", f"✅ {item.name}"
+            elif mode == "pose_change":
+                async with async_session_maker() as session:
+                    prompt = await PoseRepository(session).get_prompt(int(params["prompt_id"]))
+                if not prompt:
+                    raise ValueError("Поза не найдена")
+                result = await kie_service.change_pose(image_url, prompt.prompt, user_id=user_id, use_cache=use_cache)
+                filename, caption = "result", f"✅ {prompt.name}"
+            elif mode == "custom":
+                result = await kie_service.custom_generation(image_url, params["prompt"], user_id=user_id, use_cache=use_cache)
+                filename, caption = "custom", None
+            else:
+                raise ValueError(f"Unknown photo mode: {mode}")
+
+        if "image" not in result:
+            raise ValueError("No image in result")
+        image, ext = await output_processor.process(result["image"], PHOTO)
+        await bot.send_photo(task.chat_id, BufferedInputFile(image, f"{filename}.{ext}"), caption=caption)
+        progress.add(task.cost)
+        return JobOutcome(
+            f"✅ Готово!\n\nПотрачено: {task.cost} кр.\nБаланс: {{balance}} кр.",
+            get_repeat_button()
+        )
+
+    async def _run_normalize(self, task: Task, params: dict, use_cache: bool, progress: JobProgress,
+                             reporter: ProgressReporter) -> JobOutcome:
+        bot, user_id = self._bot, task.user_id
+        image_urls = await input_stager.resolve_all(bot, params["photo_urls"])
+        reporter.start("⏳ Магия началась...", 1, model_registry.model_for("normalize_combine"))
+
+        async with queue_position_notifier(bot, task.chat_id, user_id):
+            if params["mode"] == "own_model":
+                result = await kie_service.normalize_own_model(
+                    image_urls[0], image_urls[1], user_id=user_id, use_cache=use_cache
+                )
+            else:
+                result = await kie_service.normalize_new_model(
+                    image_urls[0], params["model_prompt"], user_id=user_id, use_cache=use_cache
+                )
+
+        if "image" not in result:
+            raise ValueError("No image in result")
+        image, ext = await output_processor.process(result["image"], PHOTO)
+        await bot.send_photo(
+            task.chat_id,
+            BufferedInputFile(image, filename=f"normalized.{ext}"),
+            caption="✅ Нормализация завершена!"
+        )
+        progress.add(task.cost)
+        return JobOutcome(
+            f"Потрачено: {task.cost} кредита\nБаланс: {{balance}} кредитов",
+            get_repeat_button()
+        )
+
+    async def _run_product_card(self, task: Task, params: dict, use_cache: bool,
+                                progress: JobProgress, reporter: ProgressReporter) -> JobOutcome:
+        bot, user_id = self._bot, task.user_id
+        items = await product_card_service.collect_items(params["generation_type"], params)
+        if not items:
+            raise ValueError("Нет доступных сцен")
+
+        per_result = config_loader.pricing["product_card"]["per_result"]
+        # Qayta boshlangan task: oldingi urinishda yuborilgan sahnalar o'tkazib yuboriladi
+        done = {result["index"] for result in progress.delivered}
+        pending = [{**item, "index": i} for i, item in enumerate(items) if i not in done]
+        if done:
+            logger.info(f"Resuming job {task.id}: {len(done)}/{len(items)} product cards already delivered")
+        image_url = await input_stager.resolve(bot, params["photo_url"])
+        reporter.start(
+            "⏳ Генерация карточек...", len(items), model_registry.model_for("scene"),
+            concurrency=settings.PRODUCT_CARD_CONCURRENCY
+        )
+        if done:
+            reporter.advance(done=len(done))
+
+        backend_faults = 0
+
+        def on_result(result: dict):
+            nonlocal backend_faults
+            backend_faults += int(result.get("backend_fault", False))
+            reporter.advance(done=int("image" in result), failed=int("image" not in result))
+
+        async def on_delivered(sent: List[dict]):
+            progress.add(len(sent) * per_result)
+            progress.delivered.extend(sent)
+            await self._save_progress(task, progress)
+
+        async with queue_position_notifier(bot, task.chat_id, user_id):
+            _, failed_count = await deliver_product_cards(
+                bot, task.chat_id, image_url, pending, user_id=user_id, use_cache=use_cache,
+                on_delivered=on_delivered,
+                on_result=on_result
+            )
+        results = sorted(progress.delivered, key=lambda result: result["index"])
+        if not results:
+            raise GenerationFailed("Не удалось сгенерировать ни одного изображения", backend_fault=backend_faults > 0)
+
+        # ZIP yuklab olish uchun: rasmlar blob_store'da, FSM va task natijasida faqat havolalar.
+        # Worker alohida jarayonda (FSM'siz) ishlasa, yuklab olish havolalarni task'dan oladi
+        state = self._state(task.chat_id, user_id)
+        if state is not None:
+            await state.update_data(generated_results=results)
+
+        refund = failed_count * per_result
+        summary = f"✅ Генерация завершена!\n\nПотрачено: {task.cost - refund} кредитов\n"
+        if failed_count:
+            summary += f"Не удалось: {failed_count} (возвращено {refund} кредитов)\n"
+        summary += "Баланс: {balance} кредитов"
+        return JobOutcome(
+            summary,
+            get_product_card_result_buttons(),
+            refund=refund,
+            result_data={"delivered": len(results), "failed": failed_count, "results": results}
+        )
+
+    async def _run_video(self, task: Task, params: dict, progress: JobProgress,
+                         reporter: ProgressReporter) -> JobOutcome:
+        bot, user_id = self._bot, task.user_id
+        mode = params["mode"]
+        image_url = await input_stager.resolve(bot, params["photo_url"])
+        duration = int(str(params["duration"]).split()[0].replace("~", ""))
+        reporter.start("⏳ Генерация видео...", 1, model_registry.model_for(f"video_{mode}"))
+
+        async with queue_position_notifier(bot, task.chat_id, user_id):
+            result = await kie_service.generate_video(
+                image_url, params["prompt"], mode, duration, params["resolution"], user_id=user_id
+            )
+
+        if "video" not in result:
+            raise ValueError("No video in result")
+        await bot.send_video(
+            task.chat_id, BufferedInputFile(result["video"], filename="video.mp4"), caption="✅ Видео готово!"
+        )
+        progress.add(task.cost)
+        return JobOutcome(
+            f"Потрачено: {task.cost} кредитов\nБаланс: {{balance}} кредитов",
+            get_repeat_button()
+        )
+
+
+async def _recent_task_outcomes(since: datetime) -> Tuple[int, int]:
+    async with async_session_maker() as session:
+        return await TaskRepository(session).get_recent_outcomes(since)
+
+
+shared_health = SharedHealthGate(
+    _recent_task_outcomes,
+    window=settings.KIE_BREAKER_SHARED_WINDOW,
+    min_tasks=settings.KIE_BREAKER_SHARED_MIN_TASKS,
+    failure_rate=settings.KIE_BREAKER_FAILURE_RATE,
+    open_seconds=settings.KIE_BREAKER_OPEN_SECONDS,
+    enabled=settings.KIE_BREAKER_ENABLED
+)
+
+generation_jobs = GenerationJobQueue()
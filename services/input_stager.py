@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+
+from config import settings
+from services.kie_service import kie_service
+from services.output_processor import output_processor
+from utils.image import HEIF_SUPPORTED, is_heif, prepare_input
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidImageError(ValueError):
+    """Foydalanuvchi yuborgan faylni rasm sifatida ochib bo'lmadi — kredit yechilmaydi."""
+
+    def __init__(self, file_unique_id: str):
+        self.file_unique_id = file_unique_id
+        super().__init__(
+            "❌ Не удалось прочитать изображение. Отправьте другой файл (JPG, PNG или WEBP)."
+        )
+
+
+class InputStager:
+    """
+    Foydalanuvchi yuborgan rasmni bir marta Telegram'dan yuklab olib, KIE file-upload'ga joylaydi.
+    Batch'dagi barcha tasklar shu bitta URL'dan foydalanadi: KIE rasmni Telegram'dan qayta-qayta
+    tortmaydi, bot tokeni tashqariga chiqmaydi va Telegram fayl havolasi eskirishi ta'sir qilmaydi.
+    Yuklashdan oldin rasm output_processor pool'ida tayyorlanadi (prepare_input); ochilmaydigan
+    fayllar eslab qolinadi va ensure_valid() orqali kredit yechilishidan oldin rad etiladi.
+    """
+
+    MEMO_LIMIT = 1000
+    # FSM'da URL o'rniga saqlanadigan havola: "tgfile:<file_id>:<file_unique_id>"
+    REF_PREFIX = "tgfile:"
+
+    def __init__(self):
+        # file_unique_id -> (KIE URL, amal qilish muddati); bir xil rasm qayta yuborilsa qayta yuklanmaydi
+        self._staged: "OrderedDict[str, tuple]" = OrderedDict()
+        # Fonda ketayotgan staging'lar — tasdiqlash handleri tayyor natijani kutadi
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # Ochib bo'lmagan rasmlar (file_unique_id) — qayta yuklab urinilmaydi
+        self._rejected: "OrderedDict[str, None]" = OrderedDict()
+
+    def _cached_url(self, file_unique_id: str) -> Optional[str]:
+        staged = self._staged.get(file_unique_id)
+        if staged and staged[1] > time.monotonic():
+            self._staged.move_to_end(file_unique_id)
+            return staged[0]
+        return None
+
+    def _remember(self, file_unique_id: str, url: str, ttl: Optional[float] = None):
+        ttl = settings.KIE_UPLOAD_REUSE_TTL if ttl is None else ttl
+        self._staged[file_unique_id] = (url, time.monotonic() + ttl)
+        self._staged.move_to_end(file_unique_id)
+        while len(self._staged) > self.MEMO_LIMIT:
+            self._staged.popitem(last=False)
+
+    def _reject(self, file_unique_id: str):
+        self._rejected[file_unique_id] = None
+        self._rejected.move_to_end(file_unique_id)
+        while len(self._rejected) > self.MEMO_LIMIT:
+            self._rejected.popitem(last=False)
+
+    async def _prepare(self, data: bytes, file_unique_id: str,
+                       filename: str, content_type: str) -> Tuple[bytes, str, str]:
+        """(baytlar, fayl nomi, content type) — KIE'ga yuklanadigan ko'rinishda."""
+        if not settings.INPUT_PREPROCESS_ENABLED:
+            return data, filename, content_type
+        if is_heif(data) and not HEIF_SUPPORTED:
+            # pillow-heif o'rnatilmagan — HEIC'ni o'zgarishsiz yuboramiz, KIE o'zi o'qiydi
+            return data, filename, content_type
+        try:
+            prepared = await output_processor.run(
+                prepare_input, data, settings.INPUT_MAX_SIDE, settings.INPUT_JPEG_QUALITY
+            )
+        except BrokenProcessPool:
+            # Pool muammosi rasmning aybi emas — aslini yuklaymiz
+            return data, filename, content_type
+        except Exception as e:
+            logger.warning(f"Input {file_unique_id} is not a readable image: {e}")
+            self._reject(file_unique_id)
+            raise InvalidImageError(file_unique_id) from e
+        logger.info(f"Input {file_unique_id} prepared: {len(data)} -> {len(prepared)} bytes")
+        return prepared, f"{file_unique_id}.jpg", "image/jpeg"
+
+    async def stage(self, bot: Bot, file_id: str, file_unique_id: str,
+                    filename: str = "input.jpg", content_type: str = "image/jpeg") -> str:
+        if file_unique_id in self._rejected:
+            raise InvalidImageError(file_unique_id)
+        cached = self._cached_url(file_unique_id)
+        if cached:
+            logger.info(f"Input {file_unique_id} already staged: {cached}")
+            return cached
+
+        file = await bot.get_file(file_id)
+        if not settings.KIE_UPLOAD_ENABLED:
+            return f"https://api.telegram.org/file/bot{settings.BOT_TOKEN}/{file.file_path}"
+
+        buffer = await bot.download(file)
+        data, filename, content_type = await self._prepare(
+            buffer.getvalue(), file_unique_id, filename, content_type
+        )
+        url = await kie_service.upload_file(data, filename, content_type)
+        self._remember(file_unique_id, url)
+        return url
+
+    def start(self, bot: Bot, file_id: str, file_unique_id: str,
+              filename: str = "input.jpg", content_type: str = "image/jpeg") -> str:
+        """
+        Staging'ni fonda boshlaydi va darhol havolani (ref) qaytaradi.
+        Foydalanuvchi menyularni ko'rib chiqayotganda rasm allaqachon yuklanib bo'ladi.
+        """
+        if not self._cached_url(file_unique_id) and file_unique_id not in self._inflight:
+            task = asyncio.create_task(self.stage(bot, file_id, file_unique_id, filename, content_type))
+            self._inflight[file_unique_id] = task
+            task.add_done_callback(lambda done: self._on_staged(file_unique_id, done))
+        return f"{self.REF_PREFIX}{file_id}:{file_unique_id}"
+
+    def _on_staged(self, file_unique_id: str, task: asyncio.Task):
+        if self._inflight.get(file_unique_id) is task:
+            del self._inflight[file_unique_id]
+        if not task.cancelled() and isinstance(task.exception(), InvalidImageError):
+            return
+        if not task.cancelled() and task.exception() is not None:
+            # Xato resolve() paytida qayta urinishda ko'rinadi; bu yerda faqat log
+            logger.warning(f"Background staging of {file_unique_id} failed: {task.exception()}")
+
+    async def ensure_valid(self, photo_ref: str):
+        """
+        Kredit yechishdan oldin: rasm ochilmasligi aniqlangan bo'lsa InvalidImageError.
+        Fonda staging ketayotgan bo'lsa natijasi kutiladi; boshqa xatolar (tarmoq, KIE) bu yerda
+        e'tiborga olinmaydi — ular resolve() paytida qayta urinib ko'riladi.
+        """
+        if not photo_ref.startswith(self.REF_PREFIX):
+            return
+        file_unique_id = photo_ref.rsplit(":", 1)[1]
+        task = self._inflight.get(file_unique_id)
+        if task is not None:
+            try:
+                await asyncio.shield(task)
+            except InvalidImageError:
+                raise
+            except Exception:
+                pass
+        if file_unique_id in self._rejected:
+            raise InvalidImageError(file_unique_id)
+
+    def export(self, photo_refs: List[str]) -> Dict[str, list]:
+        """
+        Tayyor URL'lar: {ref: [url, amal qilish muddati (unix vaqt)]} — task bilan bazaga yoziladi.
+        Dispatcher rejimida taskni boshqa jarayon bajaradi: uning xotirasida bu URL'lar yo'q.
+        """
+        staged = {}
+        for photo_ref in photo_refs:
+            if not photo_ref.startswith(self.REF_PREFIX):
+                continue
+            file_unique_id = photo_ref.rsplit(":", 1)[1]
+            url = self._cached_url(file_unique_id)
+            if url:
+                remaining = self._staged[file_unique_id][1] - time.monotonic()
+                staged[photo_ref] = [url, time.time() + remaining]
+        return staged
+
+    def adopt(self, staged: Dict[str, list]):
+        """export() natijasini shu jarayonga oladi — resolve() rasmni qayta yuklamaydi."""
+        for photo_ref, (url, expires_at) in staged.items():
+            remaining = expires_at - time.time()
+            if remaining <= 0 or not photo_ref.startswith(self.REF_PREFIX):
+                continue
+            file_unique_id = photo_ref.rsplit(":", 1)[1]
+            if not self._cached_url(file_unique_id):
+                self._remember(file_unique_id, url, ttl=remaining)
+
+    async def resolve(self, bot: Bot, photo_ref: str) -> str:
+        """Ref'ni KIE URL'ga aylantiradi; oddiy URL bo'lsa o'zgarishsiz qaytaradi."""
+        if not photo_ref.startswith(self.REF_PREFIX):
+            return photo_ref
+        file_id, file_unique_id = photo_ref[len(self.REF_PREFIX):].rsplit(":", 1)
+
+        cached = self._cached_url(file_unique_id)
+        if cached:
+            return cached
+        task = self._inflight.get(file_unique_id)
+        if task is not None:
+            try:
+                return await asyncio.shield(task)
+            except Exception as e:
+                logger.warning(f"Background staging of {file_unique_id} failed, retrying: {e}")
+        # Fon task'i yo'q (restart, muddati o'tgan) yoki xato bilan tugagan — hozir bajaramiz
+        return await self.stage(bot, file_id, file_unique_id, filename=f"{file_unique_id}.jpg")
+
+    async def resolve_all(self, bot: Bot, photo_refs: List[str]) -> List[str]:
+        return list(await asyncio.gather(*(self.resolve(bot, ref) for ref in photo_refs)))
+
+
+input_stager = InputStager()
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class NoKIEKeyAvailable(Exception):
+    """Barcha KIE kalitlari karantinda."""
+
+
+class KIEKey:
+    def __init__(self, index: int, api_key: str, rate: float, burst: int):
+        self.index = index
+        self.api_key = api_key
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.in_flight = 0
+        self.quarantined_until = 0.0
+        self.last_error: Optional[str] = None
+        self.created = 0
+        self.errors = 0
+
+    @property
+    def label(self) -> str:
+        # Logda kalitning o'zi ko'rinmasin
+        return f"#{self.index + 1} (…{self.api_key[-4:]})"
+
+    def quarantined(self, now: float) -> bool:
+        return self.quarantined_until > now
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def time_until_token(self, now: float) -> float:
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+
+class KIEKeyPool:
+    """
+    Bir nechta KIE API kaliti: har birida o'z token bucket'i (createTask tezligi) va
+    ishlayotgan tasklar hisoblagichi bor. Yangi task eng kam yuklangan kalitga beriladi;
+    auth/kvota xatosi qaytargan kalit vaqtincha karantinga olinadi.
+    Task qaysi kalit bilan yaratilgan bo'lsa, holati ham o'sha kalit bilan so'raladi.
+    """
+
+    TASK_KEYS_LIMIT = 10000
+
+    def __init__(self, api_keys: List[str], rate: float, burst: int, max_in_flight: int,
+                 quarantine_seconds: float):
+        self.keys = [KIEKey(i, api_key, rate, burst) for i, api_key in enumerate(api_keys)]
+        self.max_in_flight = max_in_flight
+        self.quarantine_seconds = quarantine_seconds
+        self._task_keys: "OrderedDict[str, KIEKey]" = OrderedDict()
+        self._changed: Optional[asyncio.Event] = None
+
+    def _available(self, now: float) -> List[KIEKey]:
+        return [key for key in self.keys if not key.quarantined(now)]
+
+    def has_available(self) -> bool:
+        return bool(self._available(time.monotonic()))
+
+    def pick(self) -> KIEKey:
+        """Token sarflamasdan eng kam yuklangan sog' kalit (upload va h.k. uchun)."""
+        available = self._available(time.monotonic())
+        if not available:
+            raise NoKIEKeyAvailable("All KIE API keys are quarantined")
+        return min(available, key=lambda key: key.in_flight)
+
+    async def acquire(self) -> KIEKey:
+        """Task yaratish uchun kalit: token va in-flight limiti bo'lguncha kutadi."""
+        while True:
+            now = time.monotonic()
+            available = self._available(now)
+            if not available:
+                raise NoKIEKeyAvailable("All KIE API keys are quarantined")
+
+            ready = []
+            wait = None
+            for key in available:
+                if key.in_flight >= self.max_in_flight:
+                    continue
+                until_token = key.time_until_token(now)
+                if until_token == 0:
+                    ready.append(key)
+                elif wait is None or until_token < wait:
+                    wait = until_token
+
+            if ready:
+                key = min(ready, key=lambda k: (k.in_flight, -k.tokens))
+                key.tokens -= 1
+                key.in_flight += 1
+                return key
+
+            # Token to'lishini yoki biror task tugashini kutamiz
+            if self._changed is None:
+                self._changed = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, key: KIEKey, task_id: Optional[str] = None):
+        key.in_flight -= 1
+        if task_id is not None:
+            self._task_keys.pop(task_id, None)
+        self._signal()
+
+    def bind(self, task_id: str, key: KIEKey):
+        key.created += 1
+        self._task_keys[task_id] = key
+        while len(self._task_keys) > self.TASK_KEYS_LIMIT:
+            self._task_keys.popitem(last=False)
+
+    def key_for_task(self, task_id: str) -> KIEKey:
+        key = self._task_keys.get(task_id)
+        if key is not None:
+            return key
+        # Noma'lum task (masalan, boshqa jarayonda yaratilgan) — asosiy kalit
+        return self.keys[0]
+
+    def throttle(self, key: KIEKey, seconds: float):
+        """429 dan keyin kalit tokenlarini "qarzga" tushiramiz — acquire shu vaqtcha kutadi."""
+        now = time.monotonic()
+        key.refill(now)
+        key.tokens = min(key.tokens, 1 - seconds * key.rate)
+        key.last_error = "rate limited"
+        logger.warning(f"KIE key {key.label} rate limited, cooling down for {seconds:.0f}s")
+
+    def quarantine(self, key: KIEKey, reason: str, seconds: Optional[float] = None):
+        seconds = self.quarantine_seconds if seconds is None else seconds
+        key.quarantined_until = time.monotonic() + seconds
+        key.last_error = reason
+        key.errors += 1
+        logger.warning(f"KIE key {key.label} quarantined for {seconds:.0f}s: {reason}")
+        self._signal()
+
+    def _signal(self):
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    def snapshot(self) -> List[dict]:
+        now = time.monotonic()
+        return [
+            {
+                "label": key.label,
+                "in_flight": key.in_flight,
+                "tokens": round(min(key.burst, key.tokens + (now - key.updated_at) * key.rate), 1),
+                "quarantined_for": max(0.0, key.quarantined_until - now),
+                "created": key.created,
+                "last_error": key.last_error,
+            }
+            for key in self.keys
+        ]
+
+
+def _configured_keys() -> List[str]:
+    keys = [key.strip() for key in settings.KIE_API_KEYS.split(",") if key.strip()]
+    return keys or [settings.KIE_API_KEY]
+
+
+kie_key_pool = KIEKeyPool(
+    _configured_keys(),
+    rate=settings.KIE_KEY_RATE,
+    burst=settings.KIE_KEY_BURST,
+    max_in_flight=settings.KIE_KEY_MAX_IN_FLIGHT,
+    quarantine_seconds=settings.KIE_KEY_QUARANTINE_SECONDS
+)
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+
+from aiogram import Bot
+from aiogram.types import Message
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class KIEScheduler:
+    """
+    KIE tasklari uchun umumiy "slot" boshqaruvchisi.
+    Bir vaqtda ishlayotgan tasklar soni global va har bir foydalanuvchi bo'yicha cheklanadi,
+    bo'sh slotlar esa navbatdagi foydalanuvchilarga navbatma-navbat (round-robin) beriladi —
+    katta batch boshlagan bitta foydalanuvchi boshqalarni to'sib qo'ymaydi.
+    """
+
+    def __init__(self, global_limit: int, per_user_limit: int):
+        self.global_limit = global_limit
+        self.per_user_limit = per_user_limit
+        self._active_total = 0
+        self._active: Dict[Hashable, int] = defaultdict(int)
+        # Navbatdagi foydalanuvchilar round-robin tartibida; har birida o'z kutuvchilari
+        self._waiting: "OrderedDict[Hashable, Deque[asyncio.Future]]" = OrderedDict()
+        self._watchers: Dict[Hashable, List[PositionCallback]] = defaultdict(list)
+
+    @property
+    def active_count(self) -> int:
+        return self._active_total
+
+    @property
+    def waiting_count(self) -> int:
+        return sum(len(waiters) for waiters in self._waiting.values())
+
+    def position(self, user_id: Hashable) -> int:
+        """
+        Foydalanuvchining navbatdagi o'rni (1 — keyingi bo'sh slot unga).
+        Navbatda bo'lmasa yoki tasklari allaqachon ishlayotgan bo'lsa 0.
+        """
+        if user_id not in self._waiting or self._active.get(user_id):
+            return 0
+        ahead = 0
+        for waiting_user in self._waiting:
+            if waiting_user == user_id:
+                break
+            # O'z limitiga yetgan foydalanuvchilar slot olmaydi — ular oldinda hisoblanmaydi
+            if self._active.get(waiting_user, 0) < self.per_user_limit:
+                ahead += 1
+        return ahead + 1
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[int] = None):
+        await self.acquire(user_id)
+        try:
+            yield
+        finally:
+            self.release(user_id)
+
+    def _can_start(self, user_id: Hashable) -> bool:
+        return self._active_total < self.global_limit and self._active.get(user_id, 0) < self.per_user_limit
+
+    def _grant(self, user_id: Hashable):
+        self._active_total += 1
+        self._active[user_id] += 1
+
+    async def acquire(self, user_id: Optional[int] = None):
+        if user_id not in self._waiting and self._can_start(user_id):
+            self._grant(user_id)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user_id, deque()).append(future)
+        logger.info(f"KIE slot queued for user {user_id}: position {self.position(user_id)}, "
+                    f"active {self._active_total}/{self.global_limit}")
+        self._notify_positions()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot berilgan, lekin kutuvchi bekor qilindi — slotni qaytaramiz
+                self.release(user_id)
+            else:
+                self._discard(user_id, future)
+                self._notify_positions()
+            raise
+
+    def release(self, user_id: Optional[int] = None):
+        self._active_total -= 1
+        self._active[user_id] -= 1
+        if self._active[user_id] <= 0:
+            del self._active[user_id]
+        self._dispatch()
+
+    def _discard(self, user_id: Hashable, future: asyncio.Future):
+        waiters = self._waiting.get(user_id)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(future)
+        except ValueError:
+            pass
+        if not waiters:
+            del self._waiting[user_id]
+
+    def _dispatch(self):
+        granted = False
+        while self._active_total < self.global_limit:
+            eligible = [
+                waiting_user for waiting_user in self._waiting
+                if self._active.get(waiting_user, 0) < self.per_user_limit
+            ]
+            if not eligible:
+                break
+
+            user_id = eligible[0]
+            waiters = self._waiting[user_id]
+            future = waiters.popleft()
+            if waiters:
+                self._waiting.move_to_end(user_id)
+            else:
+                del self._waiting[user_id]
+            self._grant(user_id)
+            future.set_result(None)
+            granted = True
+
+        if granted:
+            self._notify_positions()
+
+    # ----- queue position -----
+
+    def watch(self, user_id: int, callback: PositionCallback):
+        self._watchers[user_id].append(callback)
+
+    def unwatch(self, user_id: int, callback: PositionCallback):
+        callbacks = self._watchers.get(user_id)
+        if callbacks and callback in callbacks:
+            callbacks.remove(callback)
+        if not callbacks:
+            self._watchers.pop(user_id, None)
+
+    def _notify_positions(self):
+        for user_id, callbacks in list(self._watchers.items()):
+            position = self.position(user_id)
+            for callback in list(callbacks):
+                asyncio.create_task(self._safe_notify(callback, position))
+
+    @staticmethod
+    async def _safe_notify(callback: PositionCallback, position: int):
+        try:
+            await callback(position)
+        except Exception as e:
+            logger.warning(f"Queue position notification failed: {e}")
+
+
+kie_scheduler = KIEScheduler(
+    global_limit=settings.KIE_GLOBAL_CONCURRENCY,
+    per_user_limit=settings.KIE_PER_USER_CONCURRENCY
+)
+
+
+@asynccontextmanager
+async def queue_position_notifier(bot: Bot, chat_id: int, user_id: int):
+    """
+    Generatsiya davomida foydalanuvchiga navbatdagi o'rnini ko'rsatadi.
+    Navbat bo'lmasa hech narsa yubormaydi; tugagach xabar o'chiriladi.
+    """
+    status_message: Optional[Message] = None
+    last_position = 0
+    lock = asyncio.Lock()
+
+    async def on_position(position: int):
+        nonlocal status_message, last_position
+        async with lock:
+            if position == last_position:
+                return
+            last_position = position
+            if position:
+                text = f"🕒 Вы в очереди: {position}\n\nГенерация начнётся автоматически."
+            else:
+                text = "⏳ Генерация..."
+            if status_message is None:
+                if position:
+                    status_message = await bot.send_message(chat_id, text)
+            else:
+                await status_message.edit_text(text)
+
+    kie_scheduler.watch(user_id, on_position)
+    try:
+        yield
+    finally:
+        kie_scheduler.unwatch(user_id, on_position)
+        async with lock:
+            if status_message is not None:
+                try:
+                    await status_message.delete()
+                except Exception:
+                    pass
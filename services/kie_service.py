@@ -1,27 +1,77 @@
 import aiohttp
 import asyncio
-import requests
 import json
 import base64
 import time
-from typing import Optional, List, Dict
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Awaitable, Callable, Optional, List, Dict
 from config import settings
 import logging
 
 from database import async_session_maker
-from database.repositories import BotMessageRepository, SceneCategoryRepository
+from database.repositories import BotMessageRepository
+from services.task_poller import TaskPoller
+from services.kie_scheduler import kie_scheduler
+from services.result_cache import result_cache
+from services.poll_schedule import LatencyHistogram, PollSchedule
+from services.retry_policy import ErrorKind, KIEAPIError, KIETaskFailed, KIETaskTimeout, kie_retry_policy
+from services.circuit_breaker import CircuitOpenError, kie_breaker
+from services.kie_keys import KIEKey, NoKIEKeyAvailable, kie_key_pool
+from services.model_registry import ModelRoute, model_registry
 
 logger = logging.getLogger(__name__)
 
+
+class _GhostStepCancelled(Exception):
+    pass
+
+
 class KIEService:
+    INPUT_DIGESTS_LIMIT = 1000
+    GHOST_MEMO_LIMIT = 1000
+    DOWNLOAD_ATTEMPTS = 3
+
     def __init__(self):
-        self.api_key = settings.KIE_API_KEY
         self.create_url = "https://api.kie.ai/api/v1/jobs/createTask"
         self.query_url = "https://api.kie.ai/api/v1/jobs/recordInfo"
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+        self.upload_url = "https://kieai.redpandaai.co/api/file-stream-upload"
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Har bir model uchun kuzatilgan bajarilish vaqtlari — polling jadvali shundan o'rganiladi
+        self.latency = LatencyHistogram(window=settings.KIE_LATENCY_WINDOW)
+        self.poller = TaskPoller(
+            self.get_task_status,
+            schedule_for=self._schedule_for,
+            concurrency=settings.KIE_POLL_CONCURRENCY,
+            timeout=settings.KIE_POLL_TIMEOUT,
+            retry_policy=kie_retry_policy
+        )
+        # Kirish rasmi URL -> sha256; Telegram fayl URL'lari o'zgarmaydi, qayta yuklab olmaslik uchun
+        self._input_digests: "OrderedDict[str, str]" = OrderedDict()
+        # Normalize ghost bosqichi: (model, kiyim rasmi, ghost prompt) -> (ghost URL, amal qilish muddati)
+        self._ghost_memo: "OrderedDict[str, tuple]" = OrderedDict()
+        self._ghost_inflight: Dict[str, asyncio.Future] = {}
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        # Bitta umumiy sessiya: keep-alive ulanishlar create/status/download uchun qayta ishlatiladi
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=settings.KIE_POOL_LIMIT,
+                limit_per_host=settings.KIE_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=settings.KIE_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=settings.KIE_HTTP_TIMEOUT,
+                connect=settings.KIE_CONNECT_TIMEOUT
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
     
     DEFAULT_GHOST_PROMPT = (
         "Create a ghost mannequin from the reference image: transparent body, "
@@ -51,38 +101,163 @@ class KIEService:
     def get_model_base(self, model: str) -> str:
         return model.split('/')[0]
     
-    def create_task(self, model: str, input_data: dict) -> str:
+    @property
+    def webhook_enabled(self) -> bool:
+        return bool(settings.KIE_CALLBACK_URL)
+
+    def _schedule_for(self, model: Optional[str]) -> PollSchedule:
+        if self.webhook_enabled:
+            # Natija callback orqali keladi — polling faqat sekin "safety-net" sifatida qoladi
+            interval = settings.KIE_WEBHOOK_SAFETY_POLL_INTERVAL
+            return PollSchedule(initial_delay=interval, min_interval=interval, backoff=1, max_interval=interval)
+        return self.latency.schedule_for(model)
+
+    @staticmethod
+    def _headers(key: KIEKey) -> dict:
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {key.api_key}"
+        }
+
+    @staticmethod
+    def _error_code(error: BaseException) -> Optional[str]:
+        if isinstance(error, KIEAPIError):
+            return str(error.code)
+        if isinstance(error, aiohttp.ClientResponseError):
+            return str(error.status)
+        return None
+
+    def _is_key_error(self, error: BaseException) -> bool:
+        """Kalitga tegishli xato (auth / kvota) — boshqa kalit bilan qayta urinish mumkin."""
+        return self._error_code(error) in ("401", "402", "403")
+
+    def _check_key_error(self, key: KIEKey, error: BaseException):
+        if self._is_key_error(error):
+            kie_key_pool.quarantine(key, str(error))
+        elif self._error_code(error) == "429":
+            kie_key_pool.throttle(key, settings.KIE_RATE_LIMIT_DELAY)
+
+    async def create_task(self, model: str, input_data: dict, key: Optional[KIEKey] = None) -> str:
+        key = key or kie_key_pool.pick()
+        try:
+            return await self._create_task(model, input_data, key)
+        except Exception as e:
+            self._check_key_error(key, e)
+            raise
+
+    async def _create_task(self, model: str, input_data: dict, key: KIEKey) -> str:
         payload = {"model": model, "input": input_data}
-        logger.info(f"Creating task with model: {model}")
+        if self.webhook_enabled:
+            payload["callBackUrl"] = settings.KIE_CALLBACK_URL
+        logger.info(f"Creating task with model: {model}, key {key.label}")
         logger.info(f"Input data: {json.dumps(input_data, ensure_ascii=False)[:200]}...")
-        response = requests.post(self.create_url, headers=self.headers, data=json.dumps(payload))
-        response.raise_for_status()
-        result = response.json()
+        session = await self._get_session()
+        async with session.post(self.create_url, headers=self._headers(key), json=payload) as response:
+            response.raise_for_status()
+            result = await response.json(content_type=None)
         logger.info(f"Create task response: {result}")
         if result.get("code") != 200:
             logger.error(f"API create task error: {result}")
-            raise ValueError(f"Failed to create task: {result.get('msg', 'Unknown error')}")
+            raise KIEAPIError(result.get("code"), f"Failed to create task: {result.get('msg', 'Unknown error')}")
         task_id = result.get("data", {}).get("taskId")
         if not task_id:
             logger.error(f"API response without taskId: {result}")
             raise ValueError(f"Failed to extract taskId: {result}")
         return task_id
     
-    def get_task_status(self, task_id: str) -> dict:
+    async def upload_file(self, data: bytes, filename: str, content_type: str = "image/jpeg") -> str:
+        """Faylni KIE file-upload'ga yuklaydi va tasklarda ishlatiladigan downloadUrl'ni qaytaradi."""
+        form = aiohttp.FormData()
+        form.add_field("file", data, filename=filename, content_type=content_type)
+        form.add_field("uploadPath", settings.KIE_UPLOAD_PATH)
+        form.add_field("fileName", filename)
+        session = await self._get_session()
+        key = kie_key_pool.pick()
+        headers = {"Authorization": f"Bearer {key.api_key}"}
+        try:
+            async with session.post(self.upload_url, headers=headers, data=form) as response:
+                response.raise_for_status()
+                result = await response.json(content_type=None)
+            if not result.get("success") or result.get("code") != 200:
+                logger.error(f"API upload error: {result}")
+                raise KIEAPIError(result.get("code"), f"Failed to upload file: {result.get('msg', 'Unknown error')}")
+        except Exception as e:
+            self._check_key_error(key, e)
+            raise
+        url = result["data"]["downloadUrl"]
+        # Bayt'lar allaqachon qo'limizda — kesh kaliti uchun qayta yuklab olinmaydi
+        self.remember_input_digest(url, result_cache.digest(data))
+        logger.info(f"Uploaded {len(data)} bytes to KIE: {url}")
+        return url
+
+    def remember_input_digest(self, url: str, digest: str):
+        self._input_digests[url] = digest
+        self._input_digests.move_to_end(url)
+        while len(self._input_digests) > self.INPUT_DIGESTS_LIMIT:
+            self._input_digests.popitem(last=False)
+
+    @staticmethod
+    def _is_backend_fault(error: BaseException) -> bool:
+        """Circuit breaker uchun: xato KIE holatiga bog'liqmi (foydalanuvchi so'roviga emas)."""
+        if isinstance(error, (KIETaskTimeout, NoKIEKeyAvailable)):
+            return True
+        if isinstance(error, KIEAPIError) and str(error.code) in ("401", "402"):
+            # Kalit yoki hisobdagi mablag' muammosi — barcha generatsiyalar yiqiladi
+            return True
+        return kie_retry_policy.classify(error) != ErrorKind.TERMINAL
+
+    @classmethod
+    def is_backend_failure(cls, error: BaseException) -> bool:
+        """
+        Yiqilgan generatsiya uchun: sabab KIE yoki tarmoq nosozligimi. KIE rad etgan so'rovlar
+        (content policy, yaroqsiz kirish) va bizning kod xatolarimiz hisoblanmaydi.
+        """
+        if isinstance(error, CircuitOpenError):
+            return True
+        if not isinstance(error, (KIEAPIError, KIETaskTimeout, NoKIEKeyAvailable,
+                                  aiohttp.ClientError, asyncio.TimeoutError)):
+            return False
+        return cls._is_backend_fault(error)
+
+    async def _tracked(self, call: Callable[[], Awaitable], probe: bool = False):
+        """KIE so'rovi natijasi va davomiyligini circuit breaker'ga yozadi."""
+        started = time.monotonic()
+        try:
+            result = await call()
+        except Exception as e:
+            if self._is_backend_fault(e):
+                kie_breaker.record_failure(e)
+            else:
+                kie_breaker.record_success(time.monotonic() - started, probe=probe)
+            raise
+        kie_breaker.record_success(time.monotonic() - started, probe=probe)
+        return result
+
+    async def get_task_status(self, task_id: str) -> dict:
+        return await self._tracked(lambda: self._fetch_task_status(task_id))
+
+    async def _fetch_task_status(self, task_id: str) -> dict:
         if not task_id:
             raise ValueError("Task ID cannot be None")
         params = {"taskId": task_id}
-        response = requests.get(self.query_url, params=params, headers=self.headers)
-        logger.info(f"Status request URL: {response.url}, status: {response.status_code}")
-        logger.info(f"Raw response: {response.text}")
-        response.raise_for_status()
-        result = response.json()
+        session = await self._get_session()
+        # Task qaysi kalit bilan yaratilgan bo'lsa, holati ham shu kalit bilan so'raladi
+        headers = self._headers(kie_key_pool.key_for_task(task_id))
+        async with session.get(self.query_url, params=params, headers=headers) as response:
+            raw_text = await response.text()
+            logger.info(f"Status request URL: {response.url}, status: {response.status}")
+            logger.info(f"Raw response: {raw_text}")
+            response.raise_for_status()
+        result = json.loads(raw_text)
         logger.info(f"Status response parsed: {result}")
         if result.get("code") != 200:
             error_msg = result.get("message") or result.get("msg", "Unknown error")
             logger.error(f"API status error: {result}")
-            raise ValueError(f"Failed to get status: {error_msg}")
-        data = result.get("data", {})
+            raise KIEAPIError(result.get("code"), f"Failed to get status: {error_msg}")
+        return self.parse_task_record(result.get("data", {}))
+
+    def parse_task_record(self, data: dict) -> dict:
+        """recordInfo javobidagi 'data' qismini {'status', 'result'} ga aylantiradi."""
         state = data.get("state", "unknown")
         result_json_str = data.get("resultJson", "{}")
         try:
@@ -95,240 +270,263 @@ class KIEService:
             fail_msg = data.get("failMsg", "Unknown error")
             fail_code = data.get("failCode", "Unknown")
             logger.error(f"Task failed - Code: {fail_code}, Message: {fail_msg}")
-            raise Exception(f"Task failed: {fail_msg} (code: {fail_code})")
+            raise KIETaskFailed(fail_msg, fail_code)
         return {"status": state, "result": result_dict}
 
-    async def poll_task(self, task_id: str, max_attempts: int = 120) -> dict:
-        for attempt in range(max_attempts):
+    async def poll_task(self, task_id: str, model: Optional[str] = None, timeout: Optional[float] = None) -> dict:
+        return await self.poller.wait(task_id, model, timeout)
+
+    async def _run_task(self, model: str, input_data: dict, user_id: Optional[int] = None,
+                        route: Optional[ModelRoute] = None) -> dict:
+        # Avval operatsiya/model kvotasi (configs/models.json): kvota kutayotgan uzun video tasklar
+        # umumiy slotlarni band qilib, tez rasm tasklarini to'sib qo'ymasin.
+        # Slot task yaratilgandan natija kelguncha band turadi — KIE'dagi parallel tasklar soni cheklanadi
+        async with model_registry.slot(route) if route else nullcontext(), kie_scheduler.slot(user_id):
+            loop = asyncio.get_running_loop()
+            # Umumiy muddat slot olingandan boshlanadi: yaratishdagi qayta urinishlar ham shunga kiradi
+            deadline = loop.time() + settings.KIE_POLL_TIMEOUT
+            # Breaker ochiq bo'lsa task yaratilmaydi; half-open'da bu chaqiruv sinov bo'lishi mumkin
+            async with kie_breaker.guard() as probe:
+                # createTask idempotent emas: faqat so'rov KIE'ga yetmagani aniq bo'lgan holatlarda
+                # (yoki kalit rad etilib, boshqa sog' kalit bo'lsa) qayta yuboramiz
+                key, task_id = await kie_retry_policy.run(
+                    lambda: self._create_with_pool(model, input_data, probe),
+                    description=f"Create task ({model})",
+                    deadline=deadline,
+                    retry_on=(ErrorKind.RATE_LIMITED,),
+                    retry_if=lambda e: (
+                        isinstance(e, aiohttp.ClientConnectorError)
+                        or (self._is_key_error(e) and kie_key_pool.has_available())
+                    )
+                )
+            started = time.monotonic()
+            try:
+                result = await self.poll_task(task_id, model, timeout=max(0.0, deadline - loop.time()))
+            except KIETaskTimeout as e:
+                kie_breaker.record_failure(e)
+                raise
+            finally:
+                kie_key_pool.release(key, task_id)
+        self.latency.record(model, time.monotonic() - started)
+        return result
+
+    async def _create_with_pool(self, model: str, input_data: dict, probe: bool = False) -> tuple:
+        """Eng kam yuklangan kalitni olib task yaratadi; kalit task tugaguncha band hisoblanadi."""
+        key = await kie_key_pool.acquire()
+        try:
+            task_id = await self._tracked(lambda: self.create_task(model, input_data, key), probe=probe)
+        except BaseException:
+            kie_key_pool.release(key)
+            raise
+        kie_key_pool.bind(task_id, key)
+        return key, task_id
+
+    async def _input_digest(self, url: str) -> str:
+        digest = self._input_digests.get(url)
+        if digest is None:
+            digest = result_cache.digest(await self.download_image(url))
+            self.remember_input_digest(url, digest)
+        else:
+            self._input_digests.move_to_end(url)
+        return digest
+
+    async def _cached_image(self, model: str, input_data: dict, use_cache: bool,
+                            generate: Callable[[], Awaitable[bytes]]) -> dict:
+        """
+        Natijani result_cache orqali qaytaradi. use_cache=False ("Сгенерировать заново")
+        keshni o'qimaydi, lekin yangi natija bilan uni yangilaydi.
+        """
+        key = None
+        if result_cache.enabled:
+            params = {k: v for k, v in input_data.items() if k != "image_urls"}
             try:
-                status_info = await asyncio.to_thread(self.get_task_status, task_id)
-                logger.info(f"Poll attempt {attempt + 1}/{max_attempts} for {task_id}: status={status_info['status']}")
-                if status_info["status"] == "success":
-                    logger.info(f"Task {task_id} completed successfully!")
-                    return status_info["result"]
-                elif status_info["status"] in ["fail", "failed", "error"]:
-                    logger.error(f"Task {task_id} failed with status: {status_info['status']}")
-                    raise Exception(f"Task failed: {status_info}")
-                logger.info("Task still processing, waiting 10 seconds...")
-                await asyncio.sleep(10)
+                digests = [await self._input_digest(url) for url in input_data.get("image_urls", [])]
+                key = result_cache.make_key(model, digests, params)
             except Exception as e:
-                logger.error(f"Error polling task {task_id} on attempt {attempt + 1}: {e}")
-                if attempt == max_attempts - 1:
-                    raise
-                logger.info("Retrying in 10 seconds...")
-                await asyncio.sleep(10)
-        raise Exception(f"Task timeout after {max_attempts} attempts ({max_attempts * 10} seconds)")
+                logger.warning(f"Result cache key failed, generating without cache: {e}")
+
+        if key and use_cache:
+            cached = await result_cache.get(key)
+            if cached is not None:
+                logger.info(f"Result cache hit for {model} ({key[:12]})")
+                return {"image": cached}
+
+        image = await generate()
+        if key:
+            await result_cache.put(key, image)
+        return {"image": image}
+
+    async def _generate_image(self, operation: str, values: dict, user_id: Optional[int] = None,
+                              use_cache: bool = True) -> dict:
+        route = model_registry.route(operation)
+        input_data = route.render(values)
+
+        async def generate() -> bytes:
+            result = await self._run_task(route.model, input_data, user_id, route)
+            if "resultUrls" in result and result["resultUrls"]:
+                return await self.download_image(result["resultUrls"][0])
+            raise ValueError("No image in result")
+
+        return await self._cached_image(route.model, input_data, use_cache, generate)
+
+    async def _ghost_step(self, item_image_url: str, ghost_prompt: str,
+                          user_id: Optional[int] = None, use_cache: bool = True) -> str:
+        """
+        Normalize'ning 1-qadami (ghost / maneken). Natija URL'i TTL bilan eslab qolinadi,
+        shu kiyimga boshqa model variantlari uchun faqat kombinat bosqichi qoladi.
+        Bir vaqtdagi bir xil so'rovlar bitta KIE task'ini bo'lishadi.
+        """
+        try:
+            digest = await self._input_digest(item_image_url)
+        except Exception as e:
+            logger.warning(f"Ghost memo key failed, running ghost step directly: {e}")
+            digest = None
+
+        route = model_registry.route("normalize_ghost")
+        input_data_ghost = route.render({"prompt": ghost_prompt, "image_url": item_image_url})
+
+        key = None
+        if digest:
+            params = {k: v for k, v in input_data_ghost.items() if k != "image_urls"}
+            key = result_cache.make_key(route.model, [digest], params)
+            now = time.monotonic()
+            memo = self._ghost_memo.get(key)
+            if use_cache and memo and memo[1] > now:
+                logger.info(f"Ghost step memo hit ({key[:12]})")
+                return memo[0]
+            inflight = self._ghost_inflight.get(key)
+            if use_cache and inflight is not None:
+                try:
+                    return await asyncio.shield(inflight)
+                except _GhostStepCancelled:
+                    # Birinchi so'rov bekor qilingan — ghost bosqichini o'zimiz bajaramiz
+                    pass
+
+        future = asyncio.get_running_loop().create_future()
+        if key:
+            self._ghost_inflight[key] = future
+        try:
+            ghost_result = await self._run_task(route.model, input_data_ghost, user_id, route)
+            if "resultUrls" not in ghost_result or not ghost_result["resultUrls"]:
+                raise ValueError("No ghost image in result")
+            ghost_url = ghost_result["resultUrls"][0]
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else _GhostStepCancelled())
+            # Kutuvchi bo'lmasa "exception was never retrieved" ogohlantirishi chiqmasin
+            future.exception()
+            raise
+        else:
+            future.set_result(ghost_url)
+        finally:
+            if key and self._ghost_inflight.get(key) is future:
+                del self._ghost_inflight[key]
+
+        if key:
+            self._ghost_memo[key] = (ghost_url, time.monotonic() + settings.KIE_GHOST_MEMO_TTL)
+            self._ghost_memo.move_to_end(key)
+            while len(self._ghost_memo) > self.GHOST_MEMO_LIMIT:
+                self._ghost_memo.popitem(last=False)
+        return ghost_url
 
     async def download_image(self, url: str) -> bytes:
         logger.info(f"Downloading content from: {url}")
+
+        async def download() -> bytes:
+            session = await self._get_session()
+            timeout = aiohttp.ClientTimeout(total=settings.KIE_DOWNLOAD_TIMEOUT, connect=settings.KIE_CONNECT_TIMEOUT)
+            async with session.get(url, timeout=timeout) as response:
+                response.raise_for_status()
+                return await response.read()
+
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=aiohttp.ClientTimeout(total=300)) as response:
-                    response.raise_for_status()
-                    content = await response.read()
-                    logger.info(f"Successfully downloaded {len(content)} bytes")
-                    return content
+            content = await kie_retry_policy.run(
+                download, description=f"Download {url}", max_attempts=self.DOWNLOAD_ATTEMPTS
+            )
+            logger.info(f"Successfully downloaded {len(content)} bytes")
+            return content
         except Exception as e:
             logger.error(f"Failed to download from {url}: {e}")
             raise
 
 
-    async def generate_product_cards(self, data: dict) -> list:
-        photo_url = data["photo_url"]
-        results = []
-        model = "google/nano-banana-edit"
-
-        async with async_session_maker() as session:
-            scene_repo = SceneCategoryRepository(session)
-
-            if data["generation_type"] == "all_scenes":
-                hierarchy = await scene_repo.get_full_hierarchy()
-                for cat_id, cat in hierarchy.items():
-                    cat_name = cat["name"]
-                    for sub_id, sub in cat["subcategories"].items():
-                        sub_name = sub["name"]
-                        for item in sub["items"]:
-                            item_name = item["name"]
-                            item_prompt = item["prompt"]
-                            full_prompt = (
-                                "Create a professional product card: Place the product from the "
-                                f"reference image into the scene: {cat_name} → {sub_name} → {item_name}. "
-                                f"Details: {item_prompt}. High quality, photorealistic, studio lighting, clean background."
-                            )
-                            input_data = {
-                                "prompt": full_prompt,
-                                "image_urls": [photo_url],
-                                "output_format": "png",
-                                "image_size": "1:1"
-                            }
-                            task_id = await asyncio.to_thread(self.create_task, model, input_data)
-                            result = await self.poll_task(task_id)
-                            if "resultUrls" in result and result["resultUrls"]:
-                                image_bytes = await self.download_image(result["resultUrls"][0])
-                                results.append({
-                                    "image": image_bytes,
-                                    "category": cat_name,
-                                    "subcategory": sub_name,
-                                    "item": item_name
-                                })
-
-            elif data["generation_type"] == "group_scenes":
-                category_id = int(data["selected_group"])
-                category = await scene_repo.get_category(category_id)
-                if not category:
-                    raise ValueError(f"Scene category {category_id} not found")
-
-                subcats = await scene_repo.get_subcategories_by_category(category_id)
-                for sub in subcats:
-                    items = await scene_repo.get_items_by_subcategory(sub.id)
-                    for it in items:
-                        full_prompt = (
-                            "Create a professional product card: Place the product from the "
-                            f"reference image into the scene: {category.name} → {sub.name} → {it.name}. "
-                            f"Details: {it.prompt}. High quality, photorealistic, studio lighting, clean background."
-                        )
-                        input_data = {
-                            "prompt": full_prompt,
-                            "image_urls": [photo_url],
-                            "output_format": "png",
-                            "image_size": "1:1"
-                        }
-                        task_id = await asyncio.to_thread(self.create_task, model, input_data)
-                        result = await self.poll_task(task_id)
-                        if "resultUrls" in result and result["resultUrls"]:
-                            image_bytes = await self.download_image(result["resultUrls"][0])
-                            results.append({
-                                "image": image_bytes,
-                                "category": category.name,
-                                "subcategory": sub.name,
-                                "item": it.name
-                            })
-
-            elif data["generation_type"] == "single_scene":
-                item_id = int(data["selected_item"])
-                item = await scene_repo.get_item(item_id)
-                if not item:
-                    raise ValueError(f"Scene item {item_id} not found")
-
-                sub = await scene_repo.get_subcategory(item.subcategory_id)
-                if not sub:
-                    raise ValueError(f"Subcategory {item.subcategory_id} for item {item_id} not found")
-
-                cat = await scene_repo.get_category(sub.category_id)
-                if not cat:
-                    raise ValueError(f"Category {sub.category_id} for subcategory {sub.id} not found")
-
-                full_prompt = (
-                    "Create a professional product card: Place the product from the "
-                    f"reference image into the scene: {cat.name} → {sub.name} → {item.name}. "
-                    f"Details: {item.prompt}. High quality, photorealistic, studio lighting, clean background."
-                )
-                input_data = {
-                    "prompt": full_prompt,
-                    "image_urls": [photo_url],
-                    "output_format": "png",
-                    "image_size": "1:1"
-                }
-                task_id = await asyncio.to_thread(self.create_task, model, input_data)
-                result = await self.poll_task(task_id)
-                if "resultUrls" in result and result["resultUrls"]:
-                    image_bytes = await self.download_image(result["resultUrls"][0])
-                    results.append({
-                        "image": image_bytes,
-                        "category": cat.name,
-                        "subcategory": sub.name,
-                        "item": item.name
-                    })
-            else:
-                raise ValueError("Unknown generation_type")
-
-        return results
-
-    async def normalize_own_model(self, item_image_url: str, model_image_url: str) -> dict:
-        model = "google/nano-banana-edit"
+    async def normalize_own_model(self, item_image_url: str, model_image_url: str, user_id: Optional[int] = None,
+                                  use_cache: bool = True) -> dict:
+        combine_route = model_registry.route("normalize_combine")
 
         # 1) PROMPT – ghost / maneken (ikkala tugma uchun umumiy)
         ghost_prompt, own_combine_prompt = await self._get_normalize_prompts()
 
-        # 1-qadam: itemdan ghost / maneken
-        input_data_ghost = {
-            "prompt": ghost_prompt,
-            "image_urls": [item_image_url],
-            "output_format": "png",
-            "image_size": "1:1"
+        async def generate() -> bytes:
+            # 1-qadam: itemdan ghost / maneken (shu kiyim uchun yaqinda qilingan bo'lsa — qayta ishlatiladi)
+            ghost_url = await self._ghost_step(item_image_url, ghost_prompt, user_id, use_cache)
+
+            # 2) PROMPT – admin kiritgan 'own' kombinat promnti
+            input_data_combine = combine_route.render({
+                "prompt": own_combine_prompt,
+                "image_urls": [ghost_url, model_image_url]
+            })
+            combine_result = await self._run_task(combine_route.model, input_data_combine, user_id, combine_route)
+            if "resultUrls" in combine_result and combine_result["resultUrls"]:
+                return await self.download_image(combine_result["resultUrls"][0])
+            raise ValueError("No final image in result")
+
+        # Ikki bosqichli pipeline butunligicha keshlanadi: oraliq ghost URL har safar boshqacha
+        cache_input = {
+            "pipeline": "normalize_own_model",
+            "ghost": model_registry.route("normalize_ghost").render({"prompt": ghost_prompt, "image_url": ""}),
+            "combine": combine_route.render({"prompt": own_combine_prompt, "image_urls": []}),
+            "image_urls": [item_image_url, model_image_url]
         }
-        task_id_ghost = await asyncio.to_thread(self.create_task, model, input_data_ghost)
-        ghost_result = await self.poll_task(task_id_ghost)
-        if "resultUrls" not in ghost_result or not ghost_result["resultUrls"]:
-            raise ValueError("No ghost image in result")
-        ghost_url = ghost_result["resultUrls"][0]
-
-        # 2) PROMPT – admin kiritgan 'own' kombinat promnti
-        input_data_combine = {
-            "prompt": own_combine_prompt,
-            "image_urls": [ghost_url, model_image_url],
-            "output_format": "png",
-            "image_size": "1:1"
-        }
-        task_id_combine = await asyncio.to_thread(self.create_task, model, input_data_combine)
-        combine_result = await self.poll_task(task_id_combine)
-        if "resultUrls" in combine_result and combine_result["resultUrls"]:
-            return {"image": await self.download_image(combine_result["resultUrls"][0])}
-        raise ValueError("No final image in result")
+        return await self._cached_image(combine_route.model, cache_input, use_cache, generate)
 
-    async def normalize_new_model(self, item_image_url: str, model_prompt: str) -> dict:
-        model = "google/nano-banana-edit"
+    async def normalize_new_model(self, item_image_url: str, model_prompt: str, user_id: Optional[int] = None,
+                                  use_cache: bool = True) -> dict:
+        combine_route = model_registry.route("normalize_combine")
 
         # Faqat 1-PROMPT (ghost) – admin paneldan
         ghost_prompt, _ = await self._get_normalize_prompts()
 
-        # 1-qadam: itemdan ghost / maneken
-        input_data_ghost = {
-            "prompt": ghost_prompt,
-            "image_urls": [item_image_url],
-            "output_format": "png",
-            "image_size": "1:1"
-        }
-        task_id_ghost = await asyncio.to_thread(self.create_task, model, input_data_ghost)
-        ghost_result = await self.poll_task(task_id_ghost)
-        if "resultUrls" not in ghost_result or not ghost_result["resultUrls"]:
-            raise ValueError("No ghost image in result")
-        ghost_url = ghost_result["resultUrls"][0]
-
         # 2-qadam: yangi fotomodelni AI bilan generatsiya qilish (oldingidek)
         combine_prompt = (
             "Professional product normalization: Take the ghost mannequin from the reference image "
             "and place it on a new model described as: "
             f"{model_prompt}. High quality, photorealistic, studio lighting, natural pose."
         )
-        input_data_combine = {
-            "prompt": combine_prompt,
-            "image_urls": [ghost_url],
-            "output_format": "png",
-            "image_size": "1:1"
+
+        async def generate() -> bytes:
+            # 1-qadam: itemdan ghost / maneken (shu kiyim uchun yaqinda qilingan bo'lsa — qayta ishlatiladi)
+            ghost_url = await self._ghost_step(item_image_url, ghost_prompt, user_id, use_cache)
+
+            input_data_combine = combine_route.render({"prompt": combine_prompt, "image_urls": [ghost_url]})
+            combine_result = await self._run_task(combine_route.model, input_data_combine, user_id, combine_route)
+            if "resultUrls" in combine_result and combine_result["resultUrls"]:
+                return await self.download_image(combine_result["resultUrls"][0])
+            raise ValueError("No final image in result")
+
+        cache_input = {
+            "pipeline": "normalize_new_model",
+            "ghost": model_registry.route("normalize_ghost").render({"prompt": ghost_prompt, "image_url": ""}),
+            "combine": combine_route.render({"prompt": combine_prompt, "image_urls": []}),
+            "image_urls": [item_image_url]
         }
-        task_id_combine = await asyncio.to_thread(self.create_task, model, input_data_combine)
-        combine_result = await self.poll_task(task_id_combine)
-        if "resultUrls" in combine_result and combine_result["resultUrls"]:
-            return {"image": await self.download_image(combine_result["resultUrls"][0])}
-        raise ValueError("No final image in result")
-
-    async def generate_video(self, image_url: str, prompt: str, model: str, duration: int, resolution: str) -> dict:
-        logger.info(f"Starting video generation with model: {model}")
+        return await self._cached_image(combine_route.model, cache_input, use_cache, generate)
+
+    async def generate_video(self, image_url: str, prompt: str, mode: str, duration: int, resolution: str,
+                             user_id: Optional[int] = None) -> dict:
+        """mode — pricing.json'dagi video tarifi (balance, pro_6, ...); model va input formati models.json'dan."""
+        route = model_registry.route(f"video_{mode}")
+        logger.info(f"Starting video generation ({mode}) with model: {route.model}")
         logger.info(f"Image URL: {image_url}")
         logger.info(f"Prompt: {prompt}")
         logger.info(f"Duration: {duration}, Resolution: {resolution}")
-        if "grok" in model.lower():
-            input_data = {"image_urls": [image_url], "index": 0, "prompt": prompt, "mode": "normal"}
-            logger.info("Using Grok model format")
-        else:
-            input_data = {"prompt": prompt, "image_url": image_url, "duration": str(duration), "resolution": resolution}
-            logger.info("Using Hailuo model format")
+        input_data = route.render({
+            "image_url": image_url,
+            "prompt": prompt,
+            "duration": str(duration),
+            "resolution": resolution
+        })
         logger.info(f"Creating task with input: {input_data}")
-        task_id = await asyncio.to_thread(self.create_task, model, input_data)
-        logger.info(f"Task created with ID: {task_id}")
-        logger.info("Starting to poll task status...")
-        result = await self.poll_task(task_id)
+        result = await self._run_task(route.model, input_data, user_id, route)
         logger.info(f"Video generation complete! Result: {result}")
         if "resultUrls" in result and result["resultUrls"]:
             video_url = result["resultUrls"][0]
@@ -339,35 +537,17 @@ class KIEService:
         logger.error(f"No video URLs in result: {result}")
         raise ValueError(f"No video URLs in result: {result}")
 
-    async def change_scene(self, image_url: str, prompt: str) -> dict:
-        model = "google/nano-banana-edit"
-        full_prompt = f"Scene transformation using the reference image: Change the background and scene to {prompt}. Keep the main subject (person or product) unchanged, professional photography, high detail, photorealistic."
-        input_data = {"prompt": full_prompt, "image_urls": [image_url], "output_format": "png", "image_size": "1:1"}
-        task_id = await asyncio.to_thread(self.create_task, model, input_data)
-        result = await self.poll_task(task_id)
-        if "resultUrls" in result and result["resultUrls"]:
-            return {"image": await self.download_image(result["resultUrls"][0])}
-        raise ValueError("No image in result")
-
-    async def change_pose(self, image_url: str, prompt: str) -> dict:
-        model = "google/nano-banana-edit"
-        full_prompt = f"Pose transformation using the reference image: Change the pose to {prompt}. Keep the face, clothing, and other details unchanged, natural body position, professional photography, high quality."
-        input_data = {"prompt": full_prompt, "image_urls": [image_url], "output_format": "png", "image_size": "1:1"}
-        task_id = await asyncio.to_thread(self.create_task, model, input_data)
-        result = await self.poll_task(task_id)
-        if "resultUrls" in result and result["resultUrls"]:
-            return {"image": await self.download_image(result["resultUrls"][0])}
-        raise ValueError("No image in result")
-
-    async def custom_generation(self, image_url: str, prompt: str) -> dict:
-        model = "google/nano-banana-edit"
-        full_prompt = f"Custom image edit based on the reference image: {prompt}. High quality, photorealistic, maintain original subject details."
-        input_data = {"prompt": full_prompt, "image_urls": [image_url], "output_format": "png", "image_size": "1:1"}
-        task_id = await asyncio.to_thread(self.create_task, model, input_data)
-        result = await self.poll_task(task_id)
-        if "resultUrls" in result and result["resultUrls"]:
-            return {"image": await self.download_image(result["resultUrls"][0])}
-        raise ValueError("No image in result")
+    async def change_scene(self, image_url: str, prompt: str, user_id: Optional[int] = None,
+                           use_cache: bool = True) -> dict:
+        return await self._generate_image("scene", {"prompt": prompt, "image_url": image_url}, user_id, use_cache)
+
+    async def change_pose(self, image_url: str, prompt: str, user_id: Optional[int] = None,
+                          use_cache: bool = True) -> dict:
+        return await self._generate_image("pose", {"prompt": prompt, "image_url": image_url}, user_id, use_cache)
+
+    async def custom_generation(self, image_url: str, prompt: str, user_id: Optional[int] = None,
+                                use_cache: bool = True) -> dict:
+        return await self._generate_image("custom", {"prompt": prompt, "image_url": image_url}, user_id, use_cache)
 
 
 kie_service = KIEService()
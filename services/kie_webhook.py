@@ -0,0 +1,75 @@
+import logging
+from typing import Optional
+
+from aiohttp import web
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class KIEWebhookServer:
+    """
+    KIE 'callBackUrl' uchun kichik aiohttp endpoint.
+    Callback faqat signal: task holati darhol recordInfo orqali (KIE API kaliti bilan) tekshiriladi,
+    body'dagi resultJson URL'lariga ishonilmaydi — endpoint'ga kim POST qilsa ham foydalanuvchiga
+    begona fayl yuborilmaydi. Polling esa faqat sekin safety-net bo'lib qoladi.
+    """
+
+    def __init__(self, kie_service, host: str, port: int, path: str, secret: str = ""):
+        self.kie_service = kie_service
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self._runner: Optional[web.AppRunner] = None
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_callback)
+        return app
+
+    async def handle_callback(self, request: web.Request) -> web.Response:
+        # KIE_CALLBACK_URL ga ?token=<KIE_WEBHOOK_SECRET> qo'shilgan bo'lishi kerak
+        if self.secret and request.query.get("token") != self.secret:
+            logger.warning(f"KIE callback with invalid token from {request.remote}")
+            return web.json_response({"ok": False}, status=403)
+
+        try:
+            body = await request.json()
+        except Exception as e:
+            logger.error(f"Invalid KIE callback body: {e}")
+            return web.json_response({"ok": False}, status=400)
+
+        data = body.get("data") or {}
+        task_id = data.get("taskId")
+        if not task_id:
+            logger.error(f"KIE callback without taskId: {body}")
+            return web.json_response({"ok": False}, status=400)
+
+        logger.info(f"KIE callback for {task_id}: state={data.get('state')}")
+        self.kie_service.poller.poll_now(task_id)
+        return web.json_response({"ok": True})
+
+    async def start(self):
+        if not self.secret:
+            logger.warning("KIE_WEBHOOK_SECRET is empty: anyone can trigger status checks via the callback URL")
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"KIE webhook listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def create_webhook_server(kie_service) -> KIEWebhookServer:
+    return KIEWebhookServer(
+        kie_service,
+        host=settings.KIE_WEBHOOK_HOST,
+        port=settings.KIE_WEBHOOK_PORT,
+        path=settings.KIE_WEBHOOK_PATH,
+        secret=settings.KIE_WEBHOOK_SECRET
+    )
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, Deque, Dict, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Butun qiymat bitta placeholder bo'lsa ("{image_urls}") — qiymat turi (ro'yxat va h.k.) saqlanadi
+_WHOLE_PLACEHOLDER = re.compile(r"^\{(\w+)\}$")
+
+
+class _Quota:
+    """O'lchami ish vaqtida o'zgartiriladigan semafor (limit None — cheklovsiz)."""
+
+    def __init__(self, limit: Optional[int]):
+        self.limit = limit
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _has_room(self) -> bool:
+        return self.limit is None or self.active < self.limit
+
+    async def acquire(self):
+        if not self._waiters and self._has_room():
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                self._waiters.remove(future)
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def resize(self, limit: Optional[int]):
+        self.limit = limit
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._waiters and self._has_room():
+            future = self._waiters.popleft()
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+
+class ModelRoute:
+    def __init__(self, operation: str, model: str, input_template: Dict[str, Any], quota: Optional[int]):
+        self.operation = operation
+        self.model = model
+        self.input_template = input_template
+        self.quota = quota
+
+    def render(self, values: Dict[str, Any]) -> dict:
+        return _render(self.input_template, values)
+
+
+def _render(template: Any, values: Dict[str, Any]) -> Any:
+    if isinstance(template, dict):
+        return {key: _render(value, values) for key, value in template.items()}
+    if isinstance(template, list):
+        return [_render(value, values) for value in template]
+    if isinstance(template, str):
+        whole = _WHOLE_PLACEHOLDER.match(template)
+        if whole and whole.group(1) in values:
+            return values[whole.group(1)]
+        return template.format_map(values)
+    return template
+
+
+class ModelRegistry:
+    """
+    configs/models.json: har bir operatsiya (scene, pose, custom, normalize_*, video_*) uchun
+    KIE modeli, input shabloni va parallel tasklar kvotasi; qo'shimcha ravishda model bo'yicha kvota.
+    Fayl o'zgarsa (mtime) yoki reload() chaqirilsa deploysiz qayta o'qiladi.
+    """
+
+    def __init__(self, path: Path, check_interval: float):
+        self.path = path
+        self.check_interval = check_interval
+        self._routes: Dict[str, ModelRoute] = {}
+        self._model_quotas: Dict[str, Optional[int]] = {}
+        self._operation_limits: Dict[str, _Quota] = {}
+        self._model_limits: Dict[str, _Quota] = {}
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self.reload()
+
+    def reload(self) -> bool:
+        """Faylni qayta o'qiydi; xato bo'lsa oldingi jadval saqlanib qoladi."""
+        try:
+            mtime = self.path.stat().st_mtime
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            routes = {
+                operation: ModelRoute(operation, spec["model"], spec.get("input", {}), spec.get("quota"))
+                for operation, spec in data.get("operations", {}).items()
+            }
+            model_quotas = dict(data.get("model_quotas", {}))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Failed to load model registry {self.path}: {e}")
+            return False
+
+        self._routes = routes
+        self._model_quotas = model_quotas
+        self._mtime = mtime
+        # Mavjud kvotalarning hajmi yangilanadi — kutayotganlar yangi limit bilan davom etadi
+        for operation, quota in self._operation_limits.items():
+            route = routes.get(operation)
+            quota.resize(route.quota if route else None)
+        for model, quota in self._model_limits.items():
+            quota.resize(model_quotas.get(model))
+        logger.info(f"Model registry loaded: {len(routes)} operations")
+        return True
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = self.path.stat().st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.reload()
+
+    def route(self, operation: str) -> ModelRoute:
+        self._maybe_reload()
+        route = self._routes.get(operation)
+        if route is None:
+            raise ValueError(f"Unknown generation operation: {operation}")
+        return route
+
+    def model_for(self, operation: str) -> Optional[str]:
+        route = self._routes.get(operation)
+        return route.model if route else None
+
+    def _quota(self, limits: Dict[str, _Quota], name: str, limit: Optional[int]) -> _Quota:
+        quota = limits.get(name)
+        if quota is None:
+            quota = limits[name] = _Quota(limit)
+        return quota
+
+    @asynccontextmanager
+    async def slot(self, route: ModelRoute):
+        """Operatsiya va model kvotalari; ikkalasi ham bo'shaguncha kutadi."""
+        operation_quota = self._quota(self._operation_limits, route.operation, route.quota)
+        model_quota = self._quota(self._model_limits, route.model, self._model_quotas.get(route.model))
+        await operation_quota.acquire()
+        try:
+            await model_quota.acquire()
+            try:
+                yield
+            finally:
+                model_quota.release()
+        finally:
+            operation_quota.release()
+
+    def snapshot(self) -> Dict[str, dict]:
+        result = {}
+        for operation, route in self._routes.items():
+            quota = self._operation_limits.get(operation)
+            result[operation] = {
+                "model": route.model,
+                "quota": route.quota,
+                "active": quota.active if quota else 0,
+                "waiting": quota.waiting if quota else 0,
+            }
+        return result
+
+
+model_registry = ModelRegistry(
+    Path(__file__).parent / ".." / "configs" / "models.json",
+    check_interval=settings.MODEL_REGISTRY_CHECK_INTERVAL
+)
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+
+from config import settings
+from utils.image import encode_image, sniff_extension
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Yetkazish kanallari: chatdagi rasm xabarlari va ZIP hujjatlar alohida sozlanadi
+PHOTO = "photo"
+ZIP = "zip"
+
+FORMATS = ("jpeg", "webp", "png", "original")
+FORMAT_ALIASES = {"jpg": "jpeg"}
+
+
+def normalize_format(channel: str, fmt: str) -> str:
+    fmt = fmt.strip().lower()
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    if fmt not in FORMATS:
+        logger.warning(f"Unknown post-processing format '{fmt}' for {channel}, using 'original'")
+        return "original"
+    return fmt
+
+
+class OutputProcessor:
+    """
+    KIE natijalarini yetkazishdan oldin qayta kodlash (PNG -> JPEG/WebP, metadata'siz).
+    Kodlash ProcessPoolExecutor'da bajariladi — event loop va GIL bloklanmaydi.
+    Xato bo'lsa asl baytlar qaytariladi: post-processing yetkazishni to'xtatmasligi kerak.
+    """
+
+    def __init__(self, channels: Dict[str, Tuple[str, int]], workers: int):
+        # kanal -> (format, sifat); format "original" — KIE natijasi o'zgarishsiz yuboriladi
+        self.channels = {
+            channel: (normalize_format(channel, fmt), quality) for channel, (fmt, quality) in channels.items()
+        }
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Pool event loop'dan ham, ZIP qurayotgan thread'dan ham yaratilishi mumkin
+        self._lock = threading.Lock()
+
+    def enabled(self, channel: str) -> bool:
+        fmt, _ = self.channels.get(channel, ("original", 0))
+        return fmt != "original"
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: bola jarayon event loop va ochiq ulanishlarni meros qilib olmasin
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        """Ixtiyoriy CPU-og'ir funksiyani (masalan, kirish rasmini tayyorlash) pool'da bajaradi."""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._pool(), func, *args)
+        except BrokenProcessPool as e:
+            self._reset(e)
+            raise
+
+    async def process(self, data: bytes, channel: str) -> Tuple[bytes, str]:
+        """(baytlar, kengaytma) qaytaradi."""
+        if not self.enabled(channel):
+            return data, sniff_extension(data)
+        fmt, quality = self.channels[channel]
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._pool(), encode_image, data, fmt, quality)
+        except BrokenProcessPool as e:
+            self._reset(e)
+            return data, sniff_extension(data)
+        except Exception as e:
+            logger.warning(f"Output post-processing ({channel}) failed, sending original: {e}")
+            return data, sniff_extension(data)
+
+    def process_blocking(self, data: bytes, channel: str) -> Tuple[bytes, str]:
+        """Worker thread'lar uchun (masalan, ZIP qurish) — natijani pool'dan kutib oladi."""
+        if not self.enabled(channel):
+            return data, sniff_extension(data)
+        fmt, quality = self.channels[channel]
+        try:
+            return self._pool().submit(encode_image, data, fmt, quality).result()
+        except BrokenProcessPool as e:
+            self._reset(e)
+            return data, sniff_extension(data)
+        except Exception as e:
+            logger.warning(f"Output post-processing ({channel}) failed, using original: {e}")
+            return data, sniff_extension(data)
+
+    def submit(self, func: Callable[..., T], *args) -> Future:
+        """Worker thread'lar uchun: bir nechta ishni parallel yuborib, natijalarni keyin yig'ish."""
+        try:
+            return self._pool().submit(func, *args)
+        except BrokenProcessPool as e:
+            self._reset(e)
+            raise
+
+    def _reset(self, error: BaseException):
+        # Bola jarayon yiqilgan (masalan, OOM) — keyingi chaqiruvda pool qayta yaratiladi
+        logger.error(f"Output post-processing pool broken, recreating: {error}")
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+output_processor = OutputProcessor(
+    channels={
+        PHOTO: (settings.POSTPROCESS_PHOTO_FORMAT, settings.POSTPROCESS_PHOTO_QUALITY),
+        ZIP: (settings.POSTPROCESS_ZIP_FORMAT, settings.POSTPROCESS_ZIP_QUALITY),
+    },
+    workers=settings.POSTPROCESS_WORKERS
+)
@@ -0,0 +1,79 @@
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional
+
+
+@dataclass(frozen=True)
+class PollSchedule:
+    initial_delay: float
+    min_interval: float
+    backoff: float
+    max_interval: float
+
+    def next_interval(self, current: float) -> float:
+        return min(self.max_interval, current * self.backoff)
+
+
+# Statistika yetarli bo'lmaganda ishlatiladigan boshlang'ich jadvallar
+DEFAULT_IMAGE_SCHEDULE = PollSchedule(initial_delay=4, min_interval=2, backoff=1.5, max_interval=10)
+DEFAULT_VIDEO_SCHEDULE = PollSchedule(initial_delay=30, min_interval=5, backoff=1.5, max_interval=30)
+
+MIN_SAMPLES = 5
+
+
+def _clamp(value: float, low: float, high: float) -> float:
+    return max(low, min(high, value))
+
+
+class LatencyHistogram:
+    """Har bir model uchun oxirgi N ta task bajarilish vaqtlari (soniya)."""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=self.window))
+
+    def record(self, model: str, seconds: float):
+        self._samples[model].append(seconds)
+
+    def count(self, model: str) -> int:
+        return len(self._samples.get(model, ()))
+
+    def percentile(self, model: str, q: float) -> Optional[float]:
+        samples = self._samples.get(model)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {
+            model: {
+                "count": len(samples),
+                "p10": self.percentile(model, 0.1),
+                "p50": self.percentile(model, 0.5),
+                "p90": self.percentile(model, 0.9),
+            }
+            for model, samples in self._samples.items() if samples
+        }
+
+    def schedule_for(self, model: Optional[str]) -> PollSchedule:
+        default = DEFAULT_VIDEO_SCHEDULE if model and "video" in model.lower() else DEFAULT_IMAGE_SCHEDULE
+        if not model or self.count(model) < MIN_SAMPLES:
+            return default
+
+        p10 = self.percentile(model, 0.1)
+        p50 = self.percentile(model, 0.5)
+        p90 = self.percentile(model, 0.9)
+
+        # Birinchi so'rov eng tez tasklar tugashidan sal oldin, keyin median atrofida
+        # zichroq, uzun "dum" uchun esa backoff bilan siyraklashadi
+        initial_delay = max(1.0, p10 * 0.9)
+        min_interval = _clamp((p50 - p10) / 4, 1.0, default.max_interval)
+        max_interval = _clamp((p90 - p10) / 3, min_interval, 60.0)
+        return PollSchedule(
+            initial_delay=initial_delay,
+            min_interval=min_interval,
+            backoff=default.backoff,
+            max_interval=max_interval
+        )
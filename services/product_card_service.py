@@ -0,0 +1,137 @@
+import asyncio
+import logging
+from typing import AsyncIterator, List, Optional
+
+from config import settings
+from database import async_session_maker
+from database.repositories import SceneCategoryRepository
+from services.kie_service import kie_service
+
+logger = logging.getLogger(__name__)
+
+
+class ProductCardService:
+    """
+    Карточка товара: сцены (category → subcategory → item) bo'yicha
+    generatsiyalarni parallel, ikki darajali limit bilan bajaradi:
+    bitta so'rov ichida va butun bot bo'yicha.
+    """
+
+    def __init__(self):
+        self._global_semaphore = asyncio.Semaphore(settings.PRODUCT_CARD_GLOBAL_CONCURRENCY)
+
+    async def collect_items(self, generation_type: str, data: dict) -> List[dict]:
+        """Tanlangan rejim bo'yicha sahnalar ro'yxati — tartibi caption'lar uchun saqlanadi."""
+        items = []
+        async with async_session_maker() as session:
+            scene_repo = SceneCategoryRepository(session)
+
+            if generation_type == "all_scenes":
+                hierarchy = await scene_repo.get_full_hierarchy()
+                for _, cat in hierarchy.items():
+                    for _, sub in cat["subcategories"].items():
+                        for item in sub["items"]:
+                            items.append({
+                                "prompt": item["prompt"],
+                                "category_name": cat["name"],
+                                "subcategory_name": sub["name"],
+                                "item_name": item["name"]
+                            })
+
+            elif generation_type in ("category_all", "category_all_subcats", "selected_categories"):
+                if generation_type != "selected_categories":
+                    category_ids = [int(data["selected_category"])]
+                else:
+                    category_ids = data.get("selected_categories", [])
+
+                for category_id in category_ids:
+                    category = await scene_repo.get_category(category_id)
+                    if not category:
+                        continue
+                    subcategories = await scene_repo.get_subcategories_by_category(category_id)
+                    for subcat in subcategories:
+                        for item in await scene_repo.get_items_by_subcategory(subcat.id):
+                            items.append({
+                                "prompt": item.prompt,
+                                "category_name": category.name,
+                                "subcategory_name": subcat.name,
+                                "item_name": item.name
+                            })
+
+            elif generation_type in ("subcategory_all_items", "single_item"):
+                if generation_type == "single_item":
+                    item = await scene_repo.get_item(int(data["selected_item"]))
+                    scene_items = [item] if item else []
+                    subcategory_id = item.subcategory_id if item else None
+                else:
+                    subcategory_id = int(data["selected_subcategory"])
+                    scene_items = await scene_repo.get_items_by_subcategory(subcategory_id)
+
+                subcategory = await scene_repo.get_subcategory(subcategory_id) if subcategory_id else None
+                category = await scene_repo.get_category(subcategory.category_id) if subcategory else None
+                if category:
+                    for item in scene_items:
+                        items.append({
+                            "prompt": item.prompt,
+                            "category_name": category.name,
+                            "subcategory_name": subcategory.name,
+                            "item_name": item.name
+                        })
+            else:
+                raise ValueError(f"Unknown generation_type: {generation_type}")
+
+        return items
+
+    async def _run_item(self, photo_url: str, index: int, item: dict, local_semaphore: asyncio.Semaphore,
+                        user_id: Optional[int] = None, use_cache: bool = True) -> dict:
+        meta = {
+            "index": index,
+            "category_name": item["category_name"],
+            "subcategory_name": item["subcategory_name"],
+            "item_name": item["item_name"]
+        }
+        async with local_semaphore, self._global_semaphore:
+            try:
+                result = await kie_service.change_scene(photo_url, item["prompt"], user_id=user_id, use_cache=use_cache)
+            except Exception as e:
+                logger.error(f"Product card item {index} ({item['item_name']}) failed: {e}")
+                return {**meta, "error": str(e), "backend_fault": kie_service.is_backend_failure(e)}
+        if "image" not in result:
+            return {**meta, "error": "No image in result"}
+        return {**result, **meta}
+
+    async def generate(self, photo_url: str, items: List[dict], concurrency: Optional[int] = None,
+                       user_id: Optional[int] = None, use_cache: bool = True) -> List[dict]:
+        """
+        Har bir item uchun natija qaytaradi (kirish tartibida).
+        Item'da "index" bo'lsa (qayta boshlangan task) natija shu tartib raqami bilan belgilanadi.
+        Muvaffaqiyatsiz item butun batch'ni to'xtatmaydi — unga "error" kaliti qo'yiladi.
+        """
+        local_semaphore = asyncio.Semaphore(concurrency or settings.PRODUCT_CARD_CONCURRENCY)
+        return await asyncio.gather(*(
+            self._run_item(photo_url, item.get("index", i), item, local_semaphore, user_id, use_cache)
+            for i, item in enumerate(items)
+        ))
+
+    async def generate_stream(self, photo_url: str, items: List[dict],
+                              concurrency: Optional[int] = None,
+                              user_id: Optional[int] = None,
+                              use_cache: bool = True) -> AsyncIterator[dict]:
+        """generate() bilan bir xil, lekin natijalarni tayyor bo'lish tartibida birma-bir beradi."""
+        local_semaphore = asyncio.Semaphore(concurrency or settings.PRODUCT_CARD_CONCURRENCY)
+        tasks = [
+            asyncio.create_task(
+                self._run_item(photo_url, item.get("index", i), item, local_semaphore, user_id, use_cache)
+            )
+            for i, item in enumerate(items)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+
+product_card_service = ProductCardService()
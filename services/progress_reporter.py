@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import math
+import time
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from config import settings
+from services.kie_service import kie_service
+
+logger = logging.getLogger(__name__)
+
+
+class EditThrottle:
+    """Chat bo'yicha status xabarlarini tahrirlash chastotasi (Telegram edit limitlari)."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._last_edit: Dict[int, float] = {}
+
+    def reserve(self, chat_id: int) -> float:
+        """0 — hozir tahrirlash mumkin (vaqt band qilinadi), aks holda necha soniya kutish kerak."""
+        now = time.monotonic()
+        wait = self._last_edit.get(chat_id, 0.0) + self.interval - now
+        if wait > 0:
+            return wait
+        self._last_edit[chat_id] = now
+        # Eski chatlar yozuvlari to'planib qolmasin
+        if len(self._last_edit) > 10000:
+            cutoff = now - self.interval
+            self._last_edit = {chat: at for chat, at in self._last_edit.items() if at > cutoff}
+        return 0.0
+
+    def penalize(self, chat_id: int, seconds: float):
+        self._last_edit[chat_id] = time.monotonic() + seconds
+
+
+edit_throttle = EditThrottle(settings.PROGRESS_EDIT_INTERVAL)
+
+
+def format_eta(seconds: float) -> str:
+    if seconds < 60:
+        return "меньше минуты"
+    return f"~{math.ceil(seconds / 60)} мин."
+
+
+class ProgressReporter:
+    """
+    Generatsiya davomida bitta status xabarini tahrirlaydi: tayyor/jami, xatolar va ETA.
+    ETA modelning kuzatilgan median bajarilish vaqtidan (kie_service.latency) hisoblanadi.
+    Yangilanishlar birlashtiriladi: chat bo'yicha PROGRESS_EDIT_INTERVAL da ko'pi bilan bitta edit.
+    message_id bo'lmasa hech narsa qilmaydi.
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, message_id: Optional[int], reply_markup=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.reply_markup = reply_markup
+        self.title = "⏳ Генерация..."
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.model: Optional[str] = None
+        self.concurrency = 1
+        self._started_at = time.monotonic()
+        self._last_progress_at = self._started_at
+        self._last_text: Optional[str] = None
+        self._dirty = False
+        self._flusher: Optional[asyncio.Task] = None
+        self._ticker: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.message_id is not None
+
+    def start(self, title: str, total: int, model: Optional[str] = None, concurrency: int = 1):
+        self.title = title
+        self.total = total
+        self.model = model
+        self.concurrency = max(1, min(concurrency, total or 1))
+        self._started_at = self._last_progress_at = time.monotonic()
+        if not self.enabled:
+            return
+        self._schedule()
+        if self._ticker is None:
+            # Natija kelmasa ham ETA kamayib borsin
+            self._ticker = asyncio.create_task(self._tick())
+
+    def advance(self, done: int = 0, failed: int = 0):
+        self.done += done
+        self.failed += failed
+        self._last_progress_at = time.monotonic()
+        if self.enabled:
+            self._schedule()
+
+    def eta(self) -> Optional[float]:
+        remaining = self.total - self.done - self.failed
+        if remaining <= 0:
+            return None
+        now = time.monotonic()
+        median = kie_service.latency.percentile(self.model, 0.5) if self.model else None
+        if median is None:
+            # Model statistikasi yo'q — shu batch'ning o'z tezligi
+            finished = self.done + self.failed
+            if not finished:
+                return None
+            return (now - self._started_at) / finished * remaining
+        waves = math.ceil(remaining / self.concurrency)
+        return max(0.0, waves * median - (now - self._last_progress_at))
+
+    def render(self, title: Optional[str] = None, with_eta: bool = True) -> str:
+        lines = [title or self.title]
+        if self.total > 1:
+            lines.append(f"Готово: {self.done}/{self.total}")
+        if self.failed:
+            lines.append(f"Не удалось: {self.failed}")
+        eta = self.eta() if with_eta else None
+        if eta is not None:
+            lines.append(f"Осталось: {format_eta(eta)}")
+        return "\n".join(lines)
+
+    async def close(self, final_title: Optional[str] = None):
+        """Fon tasklarini to'xtatadi; final_title berilsa xabar oxirgi marta (tugmasiz) tahrirlanadi."""
+        for task in (self._ticker, self._flusher):
+            if task is not None and not task.done():
+                task.cancel()
+        self._ticker = self._flusher = None
+        if self.enabled and final_title is not None:
+            await self._edit(self.render(final_title, with_eta=False), reply_markup=None)
+
+    def _schedule(self):
+        self._dirty = True
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        while self._dirty:
+            if self.render() == self._last_text:
+                # O'zgarish yo'q — chatning edit limitini band qilmaymiz
+                self._dirty = False
+                return
+            wait = edit_throttle.reserve(self.chat_id)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            self._dirty = False
+            await self._edit(self.render(), self.reply_markup)
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(settings.PROGRESS_REFRESH_INTERVAL)
+            self._schedule()
+
+    async def _edit(self, text: str, reply_markup=None):
+        try:
+            await self.bot.edit_message_text(
+                text, chat_id=self.chat_id, message_id=self.message_id, reply_markup=reply_markup
+            )
+            self._last_text = text
+        except TelegramRetryAfter as e:
+            edit_throttle.penalize(self.chat_id, e.retry_after)
+            self._dirty = True
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e).lower():
+                logger.warning(f"Progress edit failed in chat {self.chat_id}: {e}")
+        except Exception as e:
+            logger.warning(f"Progress edit failed in chat {self.chat_id}: {e}")
@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import Iterable, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    Generatsiya natijalari uchun diskdagi kesh (content-addressed).
+    Kalit — kirish rasmlari baytlari, yakuniy prompt, model va chiqish parametrlari xeshi.
+    Umumiy hajm max_bytes dan oshsa, eng uzoq ishlatilmagan fayllar o'chiriladi (LRU, mtime bo'yicha).
+    """
+
+    def __init__(self, directory: str, max_bytes: int, enabled: bool = True):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = asyncio.Lock()
+        self._size: Optional[int] = None
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def make_key(model: str, image_digests: Iterable[str], params: dict) -> str:
+        digest = hashlib.sha256()
+        digest.update(model.encode())
+        for image_digest in image_digests:
+            digest.update(b"\0image\0")
+            digest.update(image_digest.encode())
+        digest.update(b"\0params\0")
+        digest.update(json.dumps(params, sort_keys=True, ensure_ascii=False).encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.bin"
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        return await asyncio.to_thread(self._read, key)
+
+    async def put(self, key: str, data: bytes):
+        if not self.enabled:
+            return
+        async with self._lock:
+            await asyncio.to_thread(self._write, key, data)
+
+    def _read(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Result cache read failed for {key}: {e}")
+            return None
+        try:
+            # mtime — LRU uchun oxirgi foydalanish vaqti
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def _write(self, key: str, data: bytes):
+        path = self._path(key)
+        # Noyob vaqtinchalik nom: bot va worker.py jarayonlari (yoki ikki thread) bir xil kalitni
+        # bir vaqtda yozsa ham bir-birining faylini buzmaydi
+        tmp_path = path.with_suffix(f".{os.getpid()}.{uuid.uuid4().hex}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_bytes(data)
+            previous = path.stat().st_size if path.exists() else 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Result cache write failed for {key}: {e}")
+            try:
+                tmp_path.unlink(missing_ok=True)
+            except OSError:
+                pass
+            return
+
+        if self._size is None:
+            self._size = self._scan_size()
+        else:
+            self._size += len(data) - previous
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _entries(self):
+        if not self.directory.exists():
+            return []
+        return [path for path in self.directory.glob("*/*.bin") if path.is_file()]
+
+    def _scan_size(self) -> int:
+        total = 0
+        for path in self._entries():
+            try:
+                total += path.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def _evict(self):
+        entries = []
+        for path in self._entries():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        # Chegaradan biroz pastga tushiramiz, har bir yozuvda qayta tozalamaslik uchun
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self._size = total
+        logger.info(f"Result cache evicted {removed} entries, size now {total} bytes")
+
+
+result_cache = ResultCache(
+    directory=settings.RESULT_CACHE_DIR,
+    max_bytes=settings.RESULT_CACHE_MAX_MB * 1024 * 1024,
+    enabled=settings.RESULT_CACHE_ENABLED
+)
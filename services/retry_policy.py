@@ -0,0 +1,134 @@
+import asyncio
+import json
+import logging
+import random
+from dataclasses import dataclass
+from enum import Enum
+from typing import Awaitable, Callable, Collection, Optional, TypeVar
+
+import aiohttp
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class ErrorKind(str, Enum):
+    TERMINAL = "terminal"          # task yoki so'rov qaytadan urinish bilan tuzalmaydi
+    RETRYABLE = "retryable"        # tarmoq / server xatosi — backoff bilan qayta urinamiz
+    RATE_LIMITED = "rate_limited"  # 429 — kamida rate_limit_delay kutamiz
+
+
+class KIEAPIError(ValueError):
+    """KIE javobidagi 'code' 200 bo'lmagan holat (HTTP 200 bo'lsa ham)."""
+
+    def __init__(self, code, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class KIETaskFailed(Exception):
+    """KIE taskni 'fail' holatida yakunladi — qayta so'rash natijani o'zgartirmaydi."""
+
+    def __init__(self, fail_msg: str, fail_code=None):
+        super().__init__(f"Task failed: {fail_msg} (code: {fail_code})")
+        self.fail_msg = fail_msg
+        self.fail_code = fail_code
+
+
+class KIETaskTimeout(Exception):
+    """Task umumiy muddat ichida tugamadi."""
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    headers = getattr(error, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    base_delay: float
+    max_delay: float
+    multiplier: float
+    rate_limit_delay: float
+    # 0..1: kechikishning qancha qismi tasodifiy — ko'p task bir vaqtda qayta urinmasligi uchun
+    jitter: float = 0.5
+
+    def classify(self, error: BaseException) -> ErrorKind:
+        if isinstance(error, (KIETaskFailed, KIETaskTimeout)):
+            return ErrorKind.TERMINAL
+        if isinstance(error, KIEAPIError):
+            return self._classify_status(error.code)
+        if isinstance(error, aiohttp.ClientResponseError):
+            return self._classify_status(error.status)
+        if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError)):
+            return ErrorKind.RETRYABLE
+        # Noma'lum xatolar avvalgidek qayta uriniladi; deadline baribir cheklaydi
+        return ErrorKind.RETRYABLE
+
+    @staticmethod
+    def _classify_status(code) -> ErrorKind:
+        try:
+            code = int(code)
+        except (TypeError, ValueError):
+            return ErrorKind.RETRYABLE
+        if code == 429:
+            return ErrorKind.RATE_LIMITED
+        # 501 — KIE'da "generation failed"
+        if code == 501:
+            return ErrorKind.TERMINAL
+        if code >= 500 or code == 408:
+            return ErrorKind.RETRYABLE
+        if code >= 400:
+            return ErrorKind.TERMINAL
+        return ErrorKind.RETRYABLE
+
+    def delay(self, attempt: int, kind: ErrorKind = ErrorKind.RETRYABLE,
+              error: Optional[BaseException] = None) -> float:
+        """attempt — ketma-ket nechanchi xato (1 dan); eksponensial backoff + jitter."""
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** max(0, attempt - 1))
+        delay *= 1 - self.jitter * random.random()
+        if kind == ErrorKind.RATE_LIMITED:
+            delay = max(delay, _retry_after(error) or self.rate_limit_delay)
+        return delay
+
+    async def run(self, operation: Callable[[], Awaitable[T]], *, description: str,
+                  deadline: Optional[float] = None, max_attempts: Optional[int] = None,
+                  retry_on: Collection[ErrorKind] = (ErrorKind.RETRYABLE, ErrorKind.RATE_LIMITED),
+                  retry_if: Optional[Callable[[BaseException], bool]] = None) -> T:
+        """
+        operation'ni policy bo'yicha qayta urinib bajaradi.
+        deadline — loop.time() bo'yicha; undan keyin oxirgi xato ko'tariladi.
+        """
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await operation()
+            except Exception as e:
+                kind = self.classify(e)
+                retry = kind in retry_on or (retry_if is not None and retry_if(e))
+                if not retry or (max_attempts is not None and attempt >= max_attempts):
+                    raise
+                delay = self.delay(attempt, kind, e)
+                if deadline is not None and loop.time() + delay >= deadline:
+                    raise
+                logger.warning(f"{description} failed ({kind.value}, attempt {attempt}): {e}; "
+                               f"retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+
+kie_retry_policy = RetryPolicy(
+    base_delay=settings.KIE_RETRY_BASE_DELAY,
+    max_delay=settings.KIE_RETRY_MAX_DELAY,
+    multiplier=2,
+    rate_limit_delay=settings.KIE_RATE_LIMIT_DELAY
+)
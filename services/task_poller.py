@@ -0,0 +1,202 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+from services.poll_schedule import PollSchedule
+from services.retry_policy import ErrorKind, KIETaskTimeout, RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+# _early'dagi belgi: callback keldi, holatni darhol recordInfo orqali tekshirish kerak
+POLL_NOW = object()
+
+
+class _PendingTask:
+    def __init__(self, task_id: str, future: asyncio.Future, schedule: PollSchedule,
+                 now: float, timeout: float):
+        self.task_id = task_id
+        self.future = future
+        self.schedule = schedule
+        self.attempts = 0
+        # Ketma-ket so'rov xatolari — backoff shundan hisoblanadi
+        self.errors = 0
+        self.interval = schedule.min_interval
+        self.next_poll_at = now + schedule.initial_delay
+        self.deadline = now + timeout
+
+
+class TaskPoller:
+    """
+    Barcha ishlayotgan KIE tasklari uchun bitta poller.
+    Har bir chaqiruvchi o'z future'ini kutadi, poller esa registrdagi task_id larni
+    har birining jadvali (model bo'yicha) asosida, cheklangan parallellik bilan tekshiradi.
+    Bir vaqtga to'g'ri kelgan tekshiruvlar bitta sweep'ga jamlanadi.
+    So'rov xatolari RetryPolicy bo'yicha ajratiladi: yakuniy (terminal) xato darhol qaytariladi,
+    tarmoq xatolari va 429 esa backoff bilan deadline'gacha qayta tekshiriladi.
+    """
+
+    # Shu oraliqda muddati keladigan tasklar ham joriy sweep'ga qo'shiladi
+    BATCH_WINDOW = 0.5
+    # Kutuvchi ro'yxatga olinmasdan oldin kelgan callback'lar uchun bufer hajmi
+    EARLY_RESULTS_LIMIT = 1000
+
+    def __init__(self, fetch_status: Callable[[str], Awaitable[dict]],
+                 schedule_for: Callable[[Optional[str]], PollSchedule],
+                 concurrency: int, timeout: float, retry_policy: RetryPolicy):
+        self._fetch_status = fetch_status
+        self.retry_policy = retry_policy
+        self._schedule_for = schedule_for
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._pending: Dict[str, _PendingTask] = {}
+        self._runner: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._early: "OrderedDict[str, tuple]" = OrderedDict()
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    async def wait(self, task_id: str, model: Optional[str] = None, timeout: Optional[float] = None) -> dict:
+        entry = self._pending.get(task_id)
+        if entry is None:
+            loop = asyncio.get_running_loop()
+            entry = _PendingTask(
+                task_id, loop.create_future(), self._schedule_for(model),
+                now=loop.time(), timeout=self.timeout if timeout is None else timeout
+            )
+            self._pending[task_id] = entry
+            early = self._early.pop(task_id, None)
+            if early is POLL_NOW:
+                entry.next_poll_at = loop.time()
+            elif early is not None:
+                self._apply(entry, *early)
+                # Oraliq holat (masalan, "generating") future'ni yakunlamaydi — odatdagidek poll qilinadi
+                if entry.future.done():
+                    return await entry.future
+        self._ensure_running()
+        return await entry.future
+
+    def notify(self, task_id: str, status_info: Optional[dict] = None, error: Optional[Exception] = None):
+        """Ishonchli manbadan kelgan holatni darhol qo'llaydi."""
+        entry = self._pending.get(task_id)
+        if entry is None:
+            self._remember_early(task_id, (status_info, error))
+            return
+        self._apply(entry, status_info, error)
+
+    def poll_now(self, task_id: str):
+        """
+        Tashqi signal (KIE callback): task navbatdan tashqari, hozir tekshiriladi.
+        Natijaning o'zi callback body'sidan emas, recordInfo'dan olinadi.
+        """
+        entry = self._pending.get(task_id)
+        if entry is None:
+            self._remember_early(task_id, POLL_NOW)
+            return
+        entry.next_poll_at = asyncio.get_running_loop().time()
+        self._ensure_running()
+
+    def _remember_early(self, task_id: str, value):
+        self._early[task_id] = value
+        while len(self._early) > self.EARLY_RESULTS_LIMIT:
+            self._early.popitem(last=False)
+
+    def _apply(self, entry: "_PendingTask", status_info: Optional[dict], error: Optional[Exception]):
+        if error is not None:
+            self._finish(entry, error=error)
+            return
+        status = status_info["status"]
+        if status == "success":
+            logger.info(f"Task {entry.task_id} completed successfully!")
+            self._finish(entry, result=status_info["result"])
+        elif status in ["fail", "failed", "error"]:
+            logger.error(f"Task {entry.task_id} failed with status: {status}")
+            self._finish(entry, error=Exception(f"Task failed: {status_info}"))
+
+    def _ensure_running(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        # Yangi task oldinroq tekshirilishi kerak bo'lishi mumkin — uyqudagi loop'ni uyg'otamiz
+        self._wakeup.set()
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            self._wakeup.clear()
+            next_due = min(entry.next_poll_at for entry in self._pending.values())
+            delay = next_due - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+            await self._sweep()
+
+    async def _sweep(self):
+        # Kutuvchisi bekor qilingan (cancelled) tasklarni registrdan olib tashlaymiz
+        for task_id, entry in list(self._pending.items()):
+            if entry.future.done():
+                self._pending.pop(task_id, None)
+
+        now = asyncio.get_running_loop().time()
+        due = [entry for entry in self._pending.values() if entry.next_poll_at <= now + self.BATCH_WINDOW]
+        if not due:
+            return
+
+        logger.info(f"Polling {len(due)}/{len(self._pending)} KIE tasks")
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def check(entry: _PendingTask):
+            async with semaphore:
+                await self._check(entry)
+
+        await asyncio.gather(*(check(entry) for entry in due))
+
+    def _reschedule(self, entry: _PendingTask):
+        now = asyncio.get_running_loop().time()
+        entry.next_poll_at = now + entry.interval
+        entry.interval = entry.schedule.next_interval(entry.interval)
+
+    async def _check(self, entry: _PendingTask):
+        entry.attempts += 1
+        timed_out = asyncio.get_running_loop().time() >= entry.deadline
+        try:
+            status_info = await self._fetch_status(entry.task_id)
+        except Exception as e:
+            kind = self.retry_policy.classify(e)
+            logger.error(f"Error polling task {entry.task_id} on attempt {entry.attempts} ({kind.value}): {e}")
+            if kind == ErrorKind.TERMINAL or timed_out:
+                self._finish(entry, error=e)
+                return
+            entry.errors += 1
+            # Xato oralig'i odatdagi jadvaldan qisqa bo'lmaydi, lekin deadline'dan oshmaydi
+            now = asyncio.get_running_loop().time()
+            delay = max(entry.interval, self.retry_policy.delay(entry.errors, kind, e))
+            entry.next_poll_at = min(now + delay, max(now, entry.deadline))
+            return
+
+        entry.errors = 0
+        status = status_info["status"]
+        logger.info(f"Poll attempt {entry.attempts} for {entry.task_id}: status={status}")
+        if status in ["success", "fail", "failed", "error"]:
+            self._apply(entry, status_info, None)
+        elif timed_out:
+            self._finish(entry, error=KIETaskTimeout(
+                f"Task timeout after {entry.attempts} attempts ({self.timeout:.0f} seconds)"
+            ))
+        else:
+            self._reschedule(entry)
+
+    def _finish(self, entry: _PendingTask, result: Optional[dict] = None, error: Optional[Exception] = None):
+        self._pending.pop(entry.task_id, None)
+        if entry.future.done():
+            return
+        if error is not None:
+            entry.future.set_exception(error)
+        else:
+            entry.future.set_result(result)
@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import zipfile
+from collections import OrderedDict
+from typing import AsyncGenerator, BinaryIO, Iterator, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.types.input_file import DEFAULT_CHUNK_SIZE, InputFile
+
+from config import settings
+from services.blob_store import blob_store
+from services.output_processor import ZIP, output_processor
+from utils.image import render_variant, sniff_extension
+
+logger = logging.getLogger(__name__)
+
+# (arxiv ichidagi nom kengaytmasiz, blob havolasi)
+ZipEntry = Tuple[str, str]
+
+# Local file header + central directory yozuvi (nom ikki marta) uchun taxminiy joy
+ZIP_ENTRY_OVERHEAD = 128
+
+# Tayyor qism: (vaqtinchalik fayl, rasmlar soni)
+ZipPart = Tuple[BinaryIO, int]
+
+# Arxivga yoziladigan fayl: (arxivdagi nom, kodlangan baytlar yoki None, blob fayli)
+ZipMember = Tuple[str, Optional[bytes], str]
+
+Ratio = Tuple[int, int]
+
+VARIANT_MODES = ("crop", "pad", "extend")
+
+
+class SpooledInputFile(InputFile):
+    """Vaqtinchalik fayldan (SpooledTemporaryFile) Telegram'ga bo'laklab yuklash."""
+
+    def __init__(self, file: BinaryIO, filename: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        await asyncio.to_thread(self.file.seek, 0)
+        while chunk := await asyncio.to_thread(self.file.read, self.chunk_size):
+            yield chunk
+
+
+def parse_ratios(value: str) -> List[Ratio]:
+    """ "3:4,9:16" -> [(3, 4), (9, 16)]; noto'g'ri qiymatlar log bilan tashlab ketiladi."""
+    ratios = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            width, height = (int(side) for side in item.split(":"))
+            if width <= 0 or height <= 0:
+                raise ValueError(item)
+        except ValueError:
+            logger.warning(f"Invalid ZIP variant ratio '{item}', skipping")
+            continue
+        ratios.append((width, height))
+    return ratios
+
+
+def entry_name(number: int, result: dict) -> str:
+    cat = result.get('category_name', 'N/A')[:20]
+    sub = result.get('subcategory_name', 'N/A')[:20]
+    item = result.get('item_name', 'N/A')[:20]
+    filename = f"{number:03d}_{cat}_{sub}_{item}"
+    filename = "".join(c for c in filename if c.isalnum() or c in ('_', '-', '.')).strip()
+    return filename[:95]
+
+
+class ZipExporter:
+    """
+    Карточка товара natijalarini ZIP qismlariga yig'ish.
+    Rasmlar blob_store'dan worker thread'da vaqtinchalik (spooled) faylga ZIP_STORED bilan
+    yoziladi — PNG/JPEG qayta siqilmaydi, xotirada bir vaqtda faqat spool chegarasicha ma'lumot turadi.
+    ZIP kanali uchun post-processing yoqilgan bo'lsa rasmlar avval output_processor'da qayta kodlanadi;
+    qismlar yozish davomida, haqiqiy (kodlangandan keyingi) hajm bo'yicha ajratiladi.
+    Har bir natijadan lokal (pool'da) qo'shimcha nisbatlar yasaladi va "3x4/", "9x16/" papkalariga
+    qo'yiladi — marketplace formatlari uchun qayta KIE generatsiyasi kerak emas. Natija va uning
+    variantlari doim bitta qismga tushadi.
+    Yuklangan qismlarning Telegram file_id'lari eslab qolinadi: xuddi shu to'plam qayta
+    so'ralsa arxiv qurilmaydi, file_id bilan darhol yuboriladi.
+    """
+
+    CACHE_LIMIT = 1000
+
+    def __init__(self, max_part_bytes: int, spool_bytes: int,
+                 variants: List[Ratio], variant_mode: str):
+        self.max_part_bytes = max_part_bytes
+        self.spool_bytes = spool_bytes
+        self.variants = variants
+        if variant_mode not in VARIANT_MODES:
+            logger.warning(f"Unknown ZIP variant mode '{variant_mode}', using 'extend'")
+            variant_mode = "extend"
+        self.variant_mode = variant_mode
+        self._file_ids: "OrderedDict[str, List[Tuple[str, int]]]" = OrderedDict()
+
+    @staticmethod
+    def entries(results: List[dict]) -> List[ZipEntry]:
+        return [(entry_name(i, result), result["blob"]) for i, result in enumerate(results, 1)]
+
+    def cache_key(self, entries: List[ZipEntry]) -> str:
+        digest = hashlib.sha256()
+        # Kodlash sozlamalari o'zgarsa eski arxivlar qayta ishlatilmaydi
+        digest.update(repr((output_processor.channels.get(ZIP), self.variants, self.variant_mode)).encode())
+        for name, ref in entries:
+            digest.update(f"{name}\0{ref}\n".encode())
+        return digest.hexdigest()
+
+    def cached(self, key: str) -> Optional[List[Tuple[str, int]]]:
+        parts = self._file_ids.get(key)
+        if parts is not None:
+            self._file_ids.move_to_end(key)
+        return parts
+
+    def remember(self, key: str, parts: List[Tuple[str, int]]):
+        self._file_ids[key] = parts
+        self._file_ids.move_to_end(key)
+        while len(self._file_ids) > self.CACHE_LIMIT:
+            self._file_ids.popitem(last=False)
+
+    async def parts(self, entries: List[ZipEntry]) -> AsyncGenerator[ZipPart, None]:
+        """Qismlarni navbat bilan quradi (har biri thread'da); har bir qismni chaqiruvchi yopadi."""
+        iterator = self._iter_parts(entries)
+        try:
+            while (part := await asyncio.to_thread(next, iterator, None)) is not None:
+                yield part
+        finally:
+            iterator.close()
+
+    def _iter_parts(self, entries: List[ZipEntry]) -> Iterator[ZipPart]:
+        spool: Optional[BinaryIO] = None
+        archive: Optional[zipfile.ZipFile] = None
+        count = size = 0
+        try:
+            for name, ref in entries:
+                try:
+                    files = self._prepare(name, ref)
+                    entry_size = sum(
+                        (len(data) if data is not None else os.path.getsize(path))
+                        + ZIP_ENTRY_OVERHEAD + 2 * len(arcname)
+                        for arcname, data, path in files
+                    )
+                except FileNotFoundError:
+                    # Shu orada RETENTION_HOURS bo'yicha o'chirilgan
+                    logger.warning(f"Blob {ref} expired before ZIP export, skipping")
+                    continue
+
+                if archive is not None and size + entry_size > self.max_part_bytes:
+                    archive.close()
+                    ready, spool, archive = spool, None, None
+                    yield ready, count
+                if archive is None:
+                    spool = tempfile.SpooledTemporaryFile(max_size=self.spool_bytes, suffix=".zip")
+                    archive = zipfile.ZipFile(spool, "w", zipfile.ZIP_STORED)
+                    count = size = 0
+
+                for arcname, data, path in files:
+                    if data is not None:
+                        archive.writestr(arcname, data)
+                    else:
+                        archive.write(path, arcname=arcname)
+                count += 1
+                size += entry_size
+
+            if archive is not None:
+                archive.close()
+                ready, spool, archive = spool, None, None
+                yield ready, count
+        finally:
+            # To'xtatilgan (yoki xato bergan) yig'ilayotgan qism
+            if spool is not None:
+                spool.close()
+
+    def _prepare(self, name: str, ref: str) -> List[ZipMember]:
+        """Natijaning o'zi va uning variantlari."""
+        path = blob_store.path(ref)
+        if not self.variants and not output_processor.enabled(ZIP):
+            # Qayta kodlash yo'q — fayl diskdan to'g'ridan-to'g'ri oqim bilan yoziladi
+            with open(path, "rb") as f:
+                ext = sniff_extension(f.read(12))
+            return [(f"{name}.{ext}", None, str(path))]
+
+        source = path.read_bytes()
+        # Variantlar pool'ga birdaniga yuboriladi — asl rasm kodlanayotganda ular ham tayyorlanadi
+        fmt, quality = output_processor.channels.get(ZIP, ("original", 95))
+        fmt = fmt if output_processor.enabled(ZIP) else None
+        futures = []
+        for ratio in self.variants:
+            try:
+                futures.append((ratio, output_processor.submit(
+                    render_variant, source, ratio, self.variant_mode, fmt, quality
+                )))
+            except Exception as e:
+                logger.warning(f"ZIP variant {ratio} for blob {ref} not scheduled: {e}")
+
+        data, ext = output_processor.process_blocking(source, ZIP)
+        files = [(f"{name}.{ext}", data, str(path))]
+        for (width, height), future in futures:
+            try:
+                variant = future.result()
+            except Exception as e:
+                # Variant bo'lmasa ham asl rasm arxivga tushadi
+                logger.warning(f"ZIP variant {width}:{height} for blob {ref} failed: {e}")
+                continue
+            if variant is not None:
+                variant_data, variant_ext = variant
+                files.append((f"{width}x{height}/{name}.{variant_ext}", variant_data, str(path)))
+        return files
+
+    @property
+    def variant_labels(self) -> str:
+        return ", ".join(f"{width}:{height}" for width, height in self.variants)
+
+
+zip_exporter = ZipExporter(
+    max_part_bytes=settings.ZIP_PART_MAX_MB * 1024 * 1024,
+    spool_bytes=settings.ZIP_SPOOL_MAX_MB * 1024 * 1024,
+    variants=parse_ratios(settings.ZIP_VARIANTS),
+    variant_mode=settings.ZIP_VARIANT_MODE
+)
@@ -0,0 +1,48 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from services import delivery
+
+
+class DeliverProductCardsCancelTest(unittest.IsolatedAsyncioTestCase):
+    async def test_cancel_during_send_album_sends_once_and_closes_stream(self):
+        sending = asyncio.Event()
+        stream_closed = asyncio.Event()
+
+        async def generate_stream(*args, **kwargs):
+            try:
+                for index in range(2):
+                    yield {"index": index, "image": b"img%d" % index}
+                # Qolgan natijalar KIE'da hali tayyor emas
+                await asyncio.Event().wait()
+            finally:
+                stream_closed.set()
+
+        async def send_media_group(*args, **kwargs):
+            sending.set()
+            await asyncio.Event().wait()
+
+        bot = MagicMock()
+        bot.send_media_group = AsyncMock(side_effect=send_media_group)
+        bot.send_photo = AsyncMock()
+
+        with patch.object(delivery.settings, "PRODUCT_CARD_STREAMING", True), \
+                patch.object(delivery.settings, "DELIVERY_ALBUM_SIZE", 2), \
+                patch.object(delivery.product_card_service, "generate_stream", generate_stream), \
+                patch.object(delivery.blob_store, "put", AsyncMock(return_value="ref")), \
+                patch.object(delivery.output_processor, "process",
+                             AsyncMock(side_effect=lambda data, channel: (data, "jpg"))):
+            job = asyncio.create_task(delivery.deliver_product_cards(bot, 1, "url", [{}, {}, {}]))
+            await asyncio.wait_for(sending.wait(), 1)
+            job.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await asyncio.wait_for(job, 1)
+
+        self.assertEqual(bot.send_media_group.await_count, 1)
+        bot.send_photo.assert_not_awaited()
+        self.assertTrue(stream_closed.is_set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import json
+import time
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from services import input_stager as stager_module
+from services.input_stager import InputStager
+
+
+class StagedInputsHandoffTest(unittest.IsolatedAsyncioTestCase):
+    async def test_worker_reuses_url_staged_by_dispatcher(self):
+        dispatcher = InputStager()
+        bot = MagicMock()
+        bot.get_file = AsyncMock(return_value=MagicMock(file_path="photos/a.jpg"))
+        bot.download = AsyncMock(return_value=MagicMock(getvalue=lambda: b"img"))
+
+        with patch.object(stager_module.settings, "INPUT_PREPROCESS_ENABLED", False), \
+                patch.object(stager_module.kie_service, "upload_file",
+                             AsyncMock(return_value="https://kie/inputs/a.jpg")) as upload:
+            ref = dispatcher.start(bot, "file-a", "uniq-a")
+            await dispatcher.ensure_valid(ref)
+            # Task bilan bazaga yoziladigan ko'rinish
+            staged = json.loads(json.dumps(dispatcher.export([ref])))
+
+            worker = InputStager()
+            worker.adopt(staged)
+            url = await worker.resolve(MagicMock(), ref)
+
+        self.assertEqual(url, "https://kie/inputs/a.jpg")
+        self.assertEqual(upload.await_count, 1)
+
+    async def test_expired_url_is_not_adopted(self):
+        worker = InputStager()
+        worker.adopt({"tgfile:file-a:uniq-a": ["https://kie/old.jpg", time.time() - 1]})
+        self.assertEqual(worker.export(["tgfile:file-a:uniq-a"]), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
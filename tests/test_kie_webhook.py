@@ -0,0 +1,106 @@
+import asyncio
+import json
+import unittest
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from services.poll_schedule import PollSchedule
+from services.retry_policy import KIETaskFailed, RetryPolicy
+from services.kie_webhook import KIEWebhookServer
+from services.task_poller import TaskPoller
+
+# Callback'siz natija faqat bir daqiqadan keyin tekshirilardi — testda bunga yetib bormaydi
+SAFETY_NET_SCHEDULE = PollSchedule(initial_delay=60, min_interval=60, backoff=1, max_interval=60)
+RETRY = RetryPolicy(base_delay=0.01, max_delay=0.01, multiplier=1, rate_limit_delay=0.01, jitter=0)
+SECRET = "s3cret"
+
+
+class FakeKIEService:
+    """KIEService o'rnida: recordInfo javoblari qo'lda beriladi."""
+
+    def __init__(self):
+        self.records = {}
+        self.fetched = []
+        self.poller = TaskPoller(
+            fetch_status=self.fetch_status,
+            schedule_for=lambda model: SAFETY_NET_SCHEDULE,
+            concurrency=5,
+            timeout=300,
+            retry_policy=RETRY
+        )
+
+    async def fetch_status(self, task_id: str) -> dict:
+        self.fetched.append(task_id)
+        record = self.records[task_id]
+        if isinstance(record, Exception):
+            raise record
+        return record
+
+
+def callback_body(task_id: str, state: str, urls=()) -> dict:
+    return {"code": 200, "data": {
+        "taskId": task_id, "state": state, "resultJson": json.dumps({"resultUrls": list(urls)})
+    }}
+
+
+class KIEWebhookTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.kie = FakeKIEService()
+        webhook = KIEWebhookServer(self.kie, host="127.0.0.1", port=0, path="/kie/callback", secret=SECRET)
+        self.client = TestClient(TestServer(webhook.build_app()))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def post(self, body: dict, token: str = SECRET):
+        return await self.client.post("/kie/callback", params={"token": token}, json=body)
+
+    async def test_success_callback_resolves_waiter_from_record_info(self):
+        self.kie.records["t1"] = {"status": "success", "result": {"resultUrls": ["https://kie/real.png"]}}
+        waiter = asyncio.create_task(self.kie.poller.wait("t1"))
+        await asyncio.sleep(0)
+
+        # Callback body'dagi URL e'tiborga olinmaydi — natija recordInfo'dan
+        response = await self.post(callback_body("t1", "success", ["https://evil/forged.png"]))
+        self.assertEqual(response.status, 200)
+
+        result = await asyncio.wait_for(waiter, 1)
+        self.assertEqual(result, {"resultUrls": ["https://kie/real.png"]})
+        self.assertEqual(self.kie.fetched, ["t1"])
+
+    async def test_fail_callback_fails_waiter(self):
+        self.kie.records["t2"] = KIETaskFailed("content policy", 400)
+        waiter = asyncio.create_task(self.kie.poller.wait("t2"))
+        await asyncio.sleep(0)
+
+        response = await self.post(callback_body("t2", "fail"))
+        self.assertEqual(response.status, 200)
+
+        with self.assertRaises(KIETaskFailed):
+            await asyncio.wait_for(waiter, 1)
+
+    async def test_callback_before_wait_polls_on_registration(self):
+        self.kie.records["t3"] = {"status": "success", "result": {"resultUrls": ["https://kie/3.png"]}}
+        response = await self.post(callback_body("t3", "success"))
+        self.assertEqual(response.status, 200)
+
+        result = await asyncio.wait_for(self.kie.poller.wait("t3"), 1)
+        self.assertEqual(result, {"resultUrls": ["https://kie/3.png"]})
+
+    async def test_bad_token_is_rejected(self):
+        self.kie.records["t4"] = {"status": "success", "result": {"resultUrls": ["https://kie/4.png"]}}
+        waiter = asyncio.create_task(self.kie.poller.wait("t4"))
+        await asyncio.sleep(0)
+
+        response = await self.post(callback_body("t4", "success"), token="wrong")
+        self.assertEqual(response.status, 403)
+
+        await asyncio.sleep(0.05)
+        self.assertFalse(waiter.done())
+        self.assertEqual(self.kie.fetched, [])
+        waiter.cancel()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import asyncio
+import unittest
+
+from services.poll_schedule import PollSchedule
+from services.retry_policy import KIETaskFailed, RetryPolicy
+from services.task_poller import TaskPoller
+
+FAST_SCHEDULE = PollSchedule(initial_delay=0.01, min_interval=0.01, backoff=1, max_interval=0.01)
+FAST_RETRY = RetryPolicy(base_delay=0.01, max_delay=0.01, multiplier=1, rate_limit_delay=0.01, jitter=0)
+
+
+class FakeKIE:
+    """recordInfo o'rnida: task holatlari qo'lda o'zgartiriladi, so'rovlar sanab boriladi."""
+
+    def __init__(self):
+        self.statuses = {}
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def fetch_status(self, task_id: str) -> dict:
+        self.calls.append(task_id)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0)
+            status = self.statuses[task_id]
+            if isinstance(status, Exception):
+                raise status
+            return status
+        finally:
+            self.in_flight -= 1
+
+
+def success(url: str) -> dict:
+    return {"status": "success", "result": {"resultUrls": [url]}}
+
+
+class TaskPollerTest(unittest.IsolatedAsyncioTestCase):
+    def make_poller(self, kie: FakeKIE, concurrency: int = 10) -> TaskPoller:
+        return TaskPoller(
+            fetch_status=kie.fetch_status,
+            schedule_for=lambda model: FAST_SCHEDULE,
+            concurrency=concurrency,
+            timeout=5,
+            retry_policy=FAST_RETRY
+        )
+
+    async def test_early_terminal_callback_resolves_without_polling(self):
+        kie = FakeKIE()
+        poller = self.make_poller(kie)
+        poller.notify("early", success("https://kie/1.png"))
+
+        result = await asyncio.wait_for(poller.wait("early"), 1)
+
+        self.assertEqual(result, {"resultUrls": ["https://kie/1.png"]})
+        self.assertEqual(kie.calls, [])
+        self.assertEqual(poller.pending_count, 0)
+
+    async def test_early_non_terminal_callback_still_polls(self):
+        kie = FakeKIE()
+        kie.statuses["early"] = {"status": "generating"}
+        poller = self.make_poller(kie)
+        poller.notify("early", {"status": "generating"})
+
+        waiter = asyncio.create_task(poller.wait("early"))
+        await asyncio.sleep(0.05)
+        self.assertFalse(waiter.done())
+        kie.statuses["early"] = success("https://kie/2.png")
+
+        result = await asyncio.wait_for(waiter, 1)
+        self.assertEqual(result, {"resultUrls": ["https://kie/2.png"]})
+        self.assertIn("early", kie.calls)
+
+    async def test_waiters_share_one_polling_loop(self):
+        kie = FakeKIE()
+        task_ids = [f"task{i}" for i in range(5)]
+        for task_id in task_ids:
+            kie.statuses[task_id] = {"status": "generating"}
+        poller = self.make_poller(kie, concurrency=2)
+
+        waiters = [asyncio.create_task(poller.wait(task_id)) for task_id in task_ids]
+        await asyncio.sleep(0)
+        runner = poller._runner
+        await asyncio.sleep(0.05)
+        self.assertIs(poller._runner, runner)
+        for task_id in task_ids:
+            kie.statuses[task_id] = success(f"https://kie/{task_id}.png")
+
+        results = await asyncio.wait_for(asyncio.gather(*waiters), 1)
+        self.assertEqual([r["resultUrls"][0] for r in results], [f"https://kie/{t}.png" for t in task_ids])
+        self.assertLessEqual(kie.max_in_flight, 2)
+        self.assertEqual(poller.pending_count, 0)
+
+    async def test_terminal_error_is_not_retried(self):
+        kie = FakeKIE()
+        kie.statuses["bad"] = KIETaskFailed("content policy", 400)
+        poller = self.make_poller(kie)
+
+        with self.assertRaises(KIETaskFailed):
+            await asyncio.wait_for(poller.wait("bad"), 1)
+        self.assertEqual(kie.calls, ["bad"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import io
+from typing import Optional, Tuple
+
+from PIL import Image, ImageOps, ImageStat
+
+try:
+    # HEIC/HEIF (iPhone) — ixtiyoriy: pillow-heif o'rnatilgan bo'lsa Pillow uni o'qiy oladi
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    HEIF_SUPPORTED = True
+except ImportError:
+    HEIF_SUPPORTED = False
+
+# Pillow format nomi -> fayl kengaytmasi
+EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+
+HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"mif1", b"msf1"}
+
+
+def is_heif(data: bytes) -> bool:
+    return data[4:8] == b"ftyp" and data[8:12] in HEIF_BRANDS
+
+
+def sniff_extension(data: bytes) -> str:
+    if data.startswith(b"\x89PNG"):
+        return "png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return "jpg"
+
+
+def _flatten(image: Image.Image) -> Image.Image:
+    # Shaffof fon JPEG'da qora bo'lib qolmasin — oq fon ustiga qo'yamiz
+    if image.mode == "RGB":
+        return image
+    rgba = image.convert("RGBA")
+    flat = Image.new("RGB", rgba.size, (255, 255, 255))
+    flat.paste(rgba, mask=rgba.getchannel("A"))
+    return flat
+
+
+def _save(image: Image.Image, fmt: str, quality: int, icc_profile: Optional[bytes]) -> Tuple[bytes, str]:
+    if fmt == "JPEG":
+        image = _flatten(image)
+    elif fmt in ("WEBP", "PNG") and image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+
+    output = io.BytesIO()
+    options = {} if fmt == "PNG" else {"quality": quality}
+    if icc_profile:
+        options["icc_profile"] = icc_profile
+    if fmt == "JPEG":
+        options.update(optimize=True, progressive=True, subsampling=0 if quality >= 90 else 2)
+    elif fmt == "WEBP":
+        options.update(method=4)
+    elif fmt == "PNG":
+        options.update(optimize=True)
+    image.save(output, format=fmt, **options)
+    return output.getvalue(), EXTENSIONS[fmt]
+
+
+def encode_image(data: bytes, fmt: str, quality: int) -> Tuple[bytes, str]:
+    """
+    Rasmni JPEG/WebP ga qayta kodlaydi, metadata (EXIF, ICC dan tashqari) olib tashlanadi.
+    ProcessPoolExecutor ichida ishlaydi — shuning uchun faqat Pillow'ga bog'liq.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        return _save(image, fmt.upper(), quality, image.info.get("icc_profile"))
+
+
+def _edge_color(image: Image.Image, vertical: bool) -> Tuple[int, ...]:
+    """Kengaytiriladigan chetlar (yuqori/past yoki chap/o'ng) piksellarining median rangi."""
+    width, height = image.size
+    if vertical:
+        strips = [image.crop((0, 0, width, 1)), image.crop((0, height - 1, width, height))]
+    else:
+        strips = [image.crop((0, 0, 1, height)), image.crop((width - 1, 0, width, height))]
+    medians = [ImageStat.Stat(strip).median for strip in strips]
+    return tuple(sum(channel) // len(medians) for channel in zip(*medians))
+
+
+def render_variant(data: bytes, ratio: Tuple[int, int], mode: str,
+                   fmt: Optional[str], quality: int) -> Optional[Tuple[bytes, str]]:
+    """
+    Bitta natijadan boshqa tomonlar nisbatidagi variant (masalan, 3:4, 9:16) yasaydi:
+    crop — markazdan kesish, pad — oq maydon, extend — chetlar rangidagi fon bilan to'ldirish.
+    fmt None bo'lsa manba formati saqlanadi. Rasm allaqachon shu nisbatda bo'lsa None.
+    """
+    ratio_w, ratio_h = ratio
+    with Image.open(io.BytesIO(data)) as source:
+        fmt = (fmt or source.format or "PNG").upper()
+        if fmt not in EXTENSIONS:
+            fmt = "PNG"
+        icc_profile = source.info.get("icc_profile")
+        width, height = source.size
+        if abs(width * ratio_h - height * ratio_w) <= max(ratio_w, ratio_h):
+            return None
+        image = _flatten(source)
+        wider = width * ratio_h > height * ratio_w
+
+        if mode == "crop":
+            size = (height * ratio_w // ratio_h, height) if wider else (width, width * ratio_h // ratio_w)
+            image = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+        else:
+            # Rasm kesilmaydi — yetishmagan tomoni fon bilan to'ldiriladi
+            size = (width, width * ratio_h // ratio_w) if wider else (height * ratio_w // ratio_h, height)
+            color = _edge_color(image, vertical=wider) if mode == "extend" else (255, 255, 255)
+            canvas = Image.new("RGB", size, color)
+            canvas.paste(image, ((size[0] - width) // 2, (size[1] - height) // 2))
+            image = canvas
+        return _save(image, fmt, quality, icc_profile)
+
+
+def prepare_input(data: bytes, max_side: int, quality: int) -> bytes:
+    """
+    Foydalanuvchi rasmini KIE uchun tayyorlaydi: bir marta dekodlash, EXIF orientatsiyasi,
+    uzun tomoni max_side gacha kichraytirish va ixcham JPEG. Rasm buzuq bo'lsa Pillow xatosi ko'tariladi.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        # JPEG'ni dekodlashda darhol kichikroq masshtabda o'qish (to'liq 12 MP kerak emas)
+        image.draft("RGB", (max_side, max_side))
+        image = _flatten(ImageOps.exif_transpose(image))
+        if max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+    return output.getvalue()
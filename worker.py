@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import signal
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.enums import ParseMode
+from config import settings
+from services.kie_service import kie_service
+from services.kie_webhook import create_webhook_server
+from services.generation_jobs import generation_jobs
+from services.output_processor import output_processor
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    """
+    Faqat generatsiya workerlari: Telegram update'larini qabul qilmaydi, tasklarni bazadagi
+    navbatdan oladi va natijani Bot API orqali o'zi yuboradi. Bir nechta jarayon/serverda
+    parallel ishga tushirish mumkin; bot (main.py) esa JOB_WORKERS_IN_BOT=false bilan ishlaydi.
+    """
+    bot = Bot(
+        token=settings.BOT_TOKEN,
+        default=DefaultBotProperties(
+            parse_mode=ParseMode.HTML
+        )
+    )
+
+    # KIE callback'lari taskni yaratgan jarayonga kelishi kerak:
+    # har bir worker o'z KIE_WEBHOOK_PORT / KIE_CALLBACK_URL qiymatlari bilan ishga tushiriladi
+    webhook_server = None
+    if kie_service.webhook_enabled:
+        webhook_server = create_webhook_server(kie_service)
+        await webhook_server.start()
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    await generation_jobs.start(bot)
+    logger.info(f"Generation worker started: {generation_jobs.worker_id}")
+    try:
+        await stop_event.wait()
+    finally:
+        await generation_jobs.stop()
+        if webhook_server is not None:
+            await webhook_server.stop()
+        await kie_service.close()
+        output_processor.shutdown()
+        await bot.session.close()
+    logger.info("Generation worker stopped")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())